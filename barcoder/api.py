@@ -0,0 +1,208 @@
+"""Programmatic interface for rendering labels
+
+A Renderer is created once for a label type and reused for many
+documents, for example in a web application::
+
+  from barcoder.api import Renderer
+
+  renderer = Renderer('pool')
+
+  with open('pool.pdf', 'wb') as f:
+      codes = renderer.render(f, npages=2, timestamp='0123', fileno=1)
+
+  # or from a coroutine
+  buf = io.BytesIO()
+  codes = await renderer.render_async(buf, npages=2, timestamp='0123', fileno=1)
+
+Each document is drawn on its own canvas, so a Renderer can be used
+by several threads at once. The only reportlab state shared between
+documents is its registry of fonts, which are loaded when a Renderer
+is created.
+"""
+
+import asyncio
+import functools
+import itertools
+import logging
+import tempfile
+import threading
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen.canvas import Canvas
+
+from barcoder import code128, layouts
+from barcoder.commands import pool, sheet, threecol, twocol
+from barcoder.utils import (ImageCache, draw_grid, draw_label_bounds, draw_page_number,
+                            generate_codes, get_code)
+
+log = logging.getLogger(__name__)
+
+LABEL_TYPES = ['threecol', 'twocol', 'pool', 'sheet']
+
+# default layouts (twocol has a fixed layout)
+LAYOUTS = {'threecol': layouts.threecol, 'pool': layouts.pool, 'sheet': layouts.onecol}
+
+FONT_NAMES = ['Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique', code128.FONT_NAME]
+
+# reportlab registers fonts at module level the first time they are used
+_font_lock = threading.Lock()
+
+
+def page_codes(codes, per_page, npages=None):
+    """Yield a list of up to `per_page` codes from iterable `codes` for
+    each page, stopping after `npages` pages (if provided) or when the
+    codes run out, so that the last page may be partly filled.
+
+    """
+
+    codes = iter(codes)
+    for _ in range(npages) if npages is not None else itertools.count():
+        chunk = list(itertools.islice(codes, per_page))
+        if not chunk:
+            break
+        yield chunk
+
+
+class Renderer:
+    """Render pdf documents containing labels of type `label_type`
+    (one of LABEL_TYPES). `layout` overrides the layout in LAYOUTS
+    (twocol has a fixed layout). Barcode images are kept in `cache_dir`, or
+    in a temporary directory for the lifetime of the Renderer if not
+    provided. `draft`, `grid` and `engine` have the same meaning as
+    the corresponding command line options.
+
+    """
+
+    def __init__(self, label_type, layout=None, cache_dir=None, draft=False, grid=False,
+                 engine='writer'):
+        if label_type not in LABEL_TYPES:
+            raise ValueError(f'label_type must be one of {", ".join(LABEL_TYPES)}')
+
+        if label_type == 'twocol' and layout is not None:
+            raise ValueError('twocol labels have a fixed layout')
+
+        self.label_type = label_type
+        self.layout = layout or LAYOUTS.get(label_type)
+        self.pagesize = twocol.PAGESIZE if label_type == 'twocol' else self.layout.pagesize
+        self.draft = draft
+        self.grid = grid
+        self.engine = engine
+
+        if cache_dir is None:
+            self._tmpdir = tempfile.TemporaryDirectory()
+            cache_dir = self._tmpdir.name
+        self.images = ImageCache(cache_dir)
+
+        # load font metrics once rather than on first use in each document
+        with _font_lock:
+            for font_name in FONT_NAMES:
+                pdfmetrics.getFont(font_name)
+
+    def render(self, fileobj, npages=None, codes=None, **kwargs):
+        """Write a pdf file with `npages` pages of labels to `fileobj`
+        (a file-like object or file name) and return the list of
+        codes used. If `codes` is provided, it is an iterable of codes
+        (for sheet, dicts as described in sheet.fill_sheet()) used to
+        fill the pages in order; rendering stops when they run out,
+        and `npages` defaults to the number of pages needed for all of
+        them. Otherwise, codes are generated as for the command line
+        (or `fake_code` is used) and `npages` defaults to 1. Remaining
+        keyword arguments depend on the label type:
+
+        * threecol: batch, filename, code_length
+        * twocol: batch, fake_code
+        * pool: timestamp, fileno, fake_code
+        * sheet: none (codes are required)
+
+        """
+
+        render_pages = getattr(self, f'_render_{self.label_type}')
+        canvas = Canvas(fileobj, pagesize=self.pagesize)
+        used = render_pages(canvas, npages, codes, **kwargs)
+        canvas.save()
+        return used
+
+    async def render_async(self, fileobj, npages=None, codes=None, **kwargs):
+        """As for render(), but runs in the default executor of the event
+        loop.
+
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(self.render, fileobj, npages, codes, **kwargs))
+
+    def _finish_page(self, canvas, page_number=None, include_vline=False):
+        if self.grid:
+            draw_grid(canvas, layout=self.layout, include_vline=include_vline)
+        if self.draft:
+            draw_label_bounds(canvas, layout=self.layout)
+        if page_number is not None:
+            draw_page_number(canvas, page_number)
+        canvas.showPage()
+
+    def _render_threecol(self, canvas, npages, codes, batch='', filename='filename',
+                         code_length=12):
+        if codes is None:
+            codes, npages = generate_codes(code_length), npages or 1
+
+        used = []
+        chunks = page_codes(codes, self.layout.num_y, npages)
+        for page_number, chunk in enumerate(chunks):
+            used.extend(threecol.fill_sheet(
+                canvas, layout=self.layout, page_number=page_number,
+                code_generator=iter(chunk), batch=batch, filename=filename,
+                draft=self.draft, images=self.images, engine=self.engine))
+            self._finish_page(canvas)
+        return used
+
+    def _render_twocol(self, canvas, npages, codes, batch=None, fake_code=None):
+        if codes is None:
+            codes = (fake_code or get_code(length=16) for _ in itertools.count())
+            npages = npages or 1
+
+        used = []
+        chunks = page_codes(codes, twocol.NUM_LABELS_Y, npages)
+        for page_number, chunk in enumerate(chunks):
+            used.extend(twocol.fill_sheet(
+                canvas, page_number=page_number, batch=batch, draft=self.draft,
+                images=self.images, engine=self.engine, codes=chunk))
+            twocol.draw_grid(canvas, include_vline=self.grid or self.draft)
+            canvas.showPage()
+        return used
+
+    def _render_pool(self, canvas, npages, codes, timestamp=None, fileno=1, fake_code=None):
+        if codes is None:
+            if fake_code:
+                codes = itertools.repeat(fake_code)
+            elif timestamp is None:
+                raise ValueError('either codes, timestamp or fake_code is required')
+            else:
+                codes = pool.generate_codes(timestamp, f'{fileno:02}')
+            npages = npages or 1
+
+        used = []
+        chunks = page_codes(codes, self.layout.num_x * self.layout.num_y, npages)
+        for page_number, chunk in enumerate(chunks, 1):
+            pool.fill_sheet(canvas, iter(chunk), layout=self.layout, timestamp=timestamp,
+                            page_number=page_number, draft=self.draft,
+                            images=self.images, engine=self.engine)
+            used.extend(chunk)
+            self._finish_page(canvas, page_number, include_vline=True)
+        return used
+
+    def _render_sheet(self, canvas, npages, codes):
+        if codes is None:
+            raise ValueError('codes are required for sheet labels')
+
+        used = []
+        chunks = sheet.grouper(sheet.expand_copies(codes),
+                               self.layout.num_x * self.layout.num_y)
+        for page_number, chunk in enumerate(chunks, 1):
+            if npages is not None and page_number > npages:
+                break
+            sheet.fill_sheet(canvas, chunk, layout=self.layout, draft=self.draft,
+                             images=self.images, engine=self.engine)
+            used.extend(code for code in chunk if code)
+            self._finish_page(canvas, page_number, include_vline=True)
+        return used
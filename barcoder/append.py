@@ -0,0 +1,190 @@
+"""Adding pages to existing pdf files using incremental updates
+
+New pages are rendered by reportlab into a separate document, and
+their objects are renumbered and written after the end of the
+existing file, followed by a new version of the page tree, a
+cross-reference section for the new objects and a trailer pointing
+to the previous cross-reference section. The existing content of the
+file (including its pages and images) is not rewritten.
+
+Only files with cross-reference tables are supported: files written
+by reportlab, or linearized by output.optimize_pdf() (which are no
+longer linearized once pages are added), but not files with object
+streams.
+"""
+
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+REF = re.compile(rb'(\d+) 0 R\b')
+XREF_ENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+SUBSECTION = re.compile(rb'(\d+) (\d+)\s*$')
+
+
+def _value(dictionary, key, pattern=rb'(\d+) 0 R'):
+    match = re.search(rb'/' + key + rb'\s+' + pattern, dictionary)
+    if not match:
+        raise ValueError(f'/{key.decode()} not found')
+    return int(match.group(1))
+
+
+def read_xref(data):
+    """Return (offsets, trailer, startxref) for the pdf file contents
+    `data`, where `offsets` maps object numbers to byte offsets for
+    the current version of each object (following /Prev through any
+    previous updates) and `trailer` is the most recent trailer
+    dictionary.
+
+    """
+
+    startxref = int(re.search(rb'startxref\s+(\d+)\s+%%EOF\s*$', data).group(1))
+
+    offsets, trailer, pos = {}, None, startxref
+    while pos is not None:
+        if not data.startswith(b'xref', pos):
+            raise ValueError('cross-reference streams are not supported')
+
+        end = data.index(b'trailer', pos)
+        number = 0
+        for line in data[pos + 4:end].splitlines():
+            subsection = SUBSECTION.match(line)
+            entry = XREF_ENTRY.match(line)
+            if entry:
+                if entry.group(3) == b'n':
+                    offsets.setdefault(number, int(entry.group(1)))
+                number += 1
+            elif subsection:
+                number = int(subsection.group(1))
+
+        section_trailer = data[end:data.index(b'startxref', end)]
+        trailer = trailer or section_trailer
+        prev = re.search(rb'/Prev\s+(\d+)', section_trailer)
+        pos = int(prev.group(1)) if prev else None
+
+    return offsets, trailer, startxref
+
+
+def _object(data, offset):
+    # objects read from existing files are dictionaries without streams
+    return data[offset:data.index(b'endobj', offset) + len(b'endobj')]
+
+
+def _pages(data):
+    offsets, trailer, startxref = read_xref(data)
+    root = _value(trailer, b'Root')
+    pages = _value(_object(data, offsets[root]), b'Pages')
+    return offsets, trailer, startxref, pages
+
+
+def page_count(path):
+    """Return the number of pages in pdf file `path`."""
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    offsets, _, _, pages = _pages(data)
+    return _value(_object(data, offsets[pages]), b'Count', rb'(\d+)')
+
+
+def _renumber(obj, numbers):
+    """Replace object numbers in the header and dictionary of `obj`
+    (but not in stream data) using dict `numbers`.
+
+    """
+
+    head, sep, stream = obj.partition(b'stream')
+    head = re.sub(rb'^(\d+) 0 obj', lambda m: b'%d 0 obj' % numbers[int(m.group(1))], head)
+    head = REF.sub(lambda m: b'%d 0 R' % numbers[int(m.group(1))], head)
+    return head + sep + stream
+
+
+def _xref_section(entries):
+    """Return a cross-reference section for `entries`, a sorted list of
+    (object number, offset).
+
+    """
+
+    lines = [b'xref']
+    start = 0
+    while start < len(entries):
+        stop = start + 1
+        while stop < len(entries) and entries[stop][0] == entries[stop - 1][0] + 1:
+            stop += 1
+        lines.append(b'%d %d' % (entries[start][0], stop - start))
+        lines.extend(b'%010d 00000 n ' % offset for _, offset in entries[start:stop])
+        start = stop
+    return b'\n'.join(lines) + b'\n'
+
+
+def append_pages(path, pdf):
+    """Append the pages of the pdf document `pdf` (bytes written by
+    reportlab) to the pdf file `path` as an incremental update. The
+    document information dictionary of `pdf` is discarded.
+
+    """
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    offsets, trailer, startxref, pages = _pages(data)
+    size = _value(trailer, b'Size', rb'(\d+)')
+    pages_obj = _object(data, offsets[pages])
+
+    new_offsets, new_trailer, new_startxref, new_pages = _pages(pdf)
+    skip = {_value(new_trailer, b'Root'), _value(new_trailer, b'Info'), new_pages}
+    kids = [int(n) for n in REF.findall(
+        re.search(rb'/Kids\s*\[(.*?)\]', _object(pdf, new_offsets[new_pages]), re.S).group(1))]
+
+    # new objects are numbered after existing ones; references to the
+    # new page tree refer to the existing one
+    numbers = {n: size + n - 1 for n in new_offsets}
+    numbers[new_pages] = pages
+
+    # each object extends to the start of the next one
+    starts = sorted(new_offsets.values())
+    ends = dict(zip(starts, starts[1:] + [new_startxref]))
+
+    chunks = [b'' if data.endswith(b'\n') else b'\n']
+    pos = len(data) + len(chunks[0])
+    entries = []
+    for n in sorted(new_offsets):
+        if n in skip:
+            continue
+        start = new_offsets[n]
+        chunk = _renumber(pdf[start:ends[start]], numbers)
+        entries.append((numbers[n], pos))
+        chunks.append(chunk)
+        pos += len(chunk)
+
+    # a new version of the page tree including the new pages
+    count = _value(pages_obj, b'Count', rb'(\d+)') + len(kids)
+    refs = b''.join(b' %d 0 R' % numbers[n] for n in kids)
+    pages_obj = re.sub(rb'/Count\s+\d+', b'/Count %d' % count, pages_obj)
+    pages_obj = re.sub(rb'(/Kids\s*\[.*?)\s*\]', lambda m: m.group(1) + refs + b' ]',
+                       pages_obj, flags=re.S)
+    chunk = pages_obj + b'\n'
+    entries.append((pages, pos))
+    chunks.append(chunk)
+    pos += len(chunk)
+
+    new_size = max(size, max(numbers.values()) + 1)
+    fields = [b'/Size %d' % new_size, b'/Prev %d' % startxref,
+              b'/Root %d 0 R' % _value(trailer, b'Root')]
+    info = re.search(rb'/Info\s+\d+ 0 R', trailer)
+    if info:
+        fields.append(info.group(0))
+    # reportlab writes a comment between /ID and its value
+    doc_id = re.search(rb'/ID\s*(?:%[^\n]*\n\s*)?(\[.*?\])', trailer, re.S)
+    if doc_id:
+        fields.append(b'/ID ' + doc_id.group(1))
+
+    chunks.append(_xref_section(sorted(entries)))
+    chunks.append(b'trailer\n<<\n' + b'\n'.join(fields) + b'\n>>\n')
+    chunks.append(b'startxref\n%d\n%%%%EOF\n' % pos)
+
+    with open(path, 'ab') as f:
+        f.write(b''.join(chunks))
+
+    log.info(f'appended {len(kids)} pages to {path}')
@@ -0,0 +1,93 @@
+"""Rasterizing Code 128 barcodes using numpy
+
+Images have the same proportions as those created by
+python-barcode's ImageWriter using the options in
+barcoder.utils.get_code128() (quiet zones, bar height and space for
+text below the bars), so they can be placed on labels at the same
+size. The human-readable text is not drawn; instead, text_position()
+describes where it should be placed in the pdf.
+"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+from barcoder import symbols
+
+# geometry of python-barcode images in mm (see barcode.writer.BaseWriter)
+MODULE_WIDTH = 0.2
+QUIET_ZONE = 2.54
+MODULE_HEIGHT = 5
+TEXT_DISTANCE = 1
+FONT_SIZE = 10
+IMAGE_HEIGHT = 2.0 + MODULE_HEIGHT + FONT_SIZE * 0.352777778 / 2 + TEXT_DISTANCE
+
+# baseline, cap height and character advance of the text as
+# fractions of the image height (measured from ImageWriter output),
+# and the font used to draw it in the pdf along with its cap height
+# and advance in em
+TEXT_BASELINE = 0.148
+TEXT_CAP_HEIGHT = 0.130
+TEXT_ADVANCE = 0.104
+FONT_NAME = 'Courier'
+FONT_CAP_HEIGHT = 0.562
+FONT_ADVANCE = 0.6
+
+
+def get_modules(payload):
+    """Return a uint8 array with one element per module (1 for bars)."""
+
+    return symbols.code128(payload).modules()
+
+
+def image_aspect(payload, module_px=3):
+    """Return the proportions (width / height in pixels) of the image
+    created by rasterize() for `payload`.
+
+    """
+
+    px_per_mm = module_px / MODULE_WIDTH
+    width = 2 * round(QUIET_ZONE * px_per_mm) + module_px * symbols.code128(payload).nmodules
+    return width / round(IMAGE_HEIGHT * px_per_mm)
+
+
+def rasterize(payload, module_px=3):
+    """Return bytes representing a 1-bit png image of the Code 128
+    barcode for `payload` with `module_px` pixels per module.
+
+    """
+
+    px_per_mm = module_px / MODULE_WIDTH
+    quiet = round(QUIET_ZONE * px_per_mm)
+    top = round(1.0 * px_per_mm)
+    bottom = round((1.0 + MODULE_HEIGHT) * px_per_mm)
+    height = round(IMAGE_HEIGHT * px_per_mm)
+
+    modules = get_modules(payload)
+    row = np.zeros(2 * quiet + module_px * len(modules), dtype=bool)
+    row[quiet:-quiet] = modules.repeat(module_px).astype(bool)
+
+    # white background; bars are drawn by broadcasting the row
+    pixels = np.ones((height, row.size), dtype=bool)
+    pixels[top:bottom] = ~row
+
+    with io.BytesIO() as f:
+        Image.fromarray(pixels).save(f, format='PNG')
+        return f.getvalue()
+
+
+def text_position(x, y, width, height, aspect):
+    """Return (x, y, font_size, hscale) for the human-readable text
+    (centered at x and using FONT_NAME) of a barcode image with
+    proportions `aspect` (width / height in pixels) drawn at (x, y)
+    with the given width and height. Text should be scaled
+    horizontally by `hscale` to match the width of the text in an
+    ImageWriter image stretched in the same way.
+
+    """
+
+    font_size = TEXT_CAP_HEIGHT * height / FONT_CAP_HEIGHT
+    advance = TEXT_ADVANCE * height * (width / height) / aspect
+    hscale = advance / (FONT_ADVANCE * font_size)
+    return x + width / 2, y + TEXT_BASELINE * height, font_size, hscale
@@ -6,6 +6,7 @@ import sys
 import argparse
 import csv
 
+from barcoder.dedupe import generate_unique_codes
 from barcoder.utils import generate_codes, get_code
 
 log = logging.getLogger(__name__)
@@ -18,10 +19,34 @@ def build_parser(parser):
     parser.add_argument('--alpha-chars', help='limit to these characters')
     parser.add_argument('-o', '--outfile', help="Output file",
                         default=sys.stdout, type=argparse.FileType('w'))
+    parser.add_argument('--external', action='store_true', default=False,
+                        help="""deduplicate codes using sorted runs on disk so that
+                        memory use does not depend on --number""")
+    parser.add_argument('--run-size', metavar='N', type=int, default=1000000,
+                        help='codes per sorted run with --external [%(default)s]')
+    parser.add_argument('--tmpdir', help='directory for sorted runs with --external')
 
 
 def action(args):
 
+    if args.external:
+        if args.alpha_chars:
+            sys.exit('--alpha-chars cannot be used with --external')
+
+        codes = generate_unique_codes(args.length, args.number, run_size=args.run_size,
+                                      tmpdir=args.tmpdir, stop_if_seen=args.stop_if_seen)
+
+        # write in blocks rather than a line at a time
+        block = []
+        for code in codes:
+            block.append(code)
+            if len(block) == 65536:
+                args.outfile.write('\n'.join(block) + '\n')
+                block = []
+        if block:
+            args.outfile.write('\n'.join(block) + '\n')
+        return
+
     if args.alpha_chars:
         codes = (get_code(args.length, alphanum_chars=list(args.alpha_chars.upper()))
                  for i in range(args.number))
@@ -5,25 +5,36 @@
 # https://programtalk.com/vs2/python/8113/ReportLab/tests/test_graphics_images.py/
 
 import logging
+import re
 import tempfile
-from os import path
 from datetime import datetime
+import itertools
 import sys
 from pathlib import Path
 
-from reportlab.graphics.shapes import Drawing, Image
-from reportlab.graphics import renderPDF
-from reportlab.pdfgen.canvas import Canvas
 from reportlab.lib.units import inch
 
-from barcoder import layouts, __version__
-from barcoder.utils import get_pool_label, draw_grid
+from barcoder import layouts
+from barcoder.append import page_count
+from barcoder.estimate import estimate, sample_action
+from barcoder.output import RollingCanvas, pikepdf
+from barcoder.progress import Progress, add_progress_arguments
+from barcoder.raster import COMPRESSIONS, PageRaster
+from barcoder.sinks import add_upload_arguments, get_sink
+from barcoder.thermal import FORMATS, Label
+from barcoder.labels import (Barcode, draw_form, draw_label, form_name, has_form,
+                             label_form, label_origins, to_drawing)
+from barcoder.utils import (get_pool_label, get_pool_label_bars, draw_grid,
+                            draw_label_bounds, ImageCache, draw_page_number,
+                            CODE128_ENGINES)
 
 log = logging.getLogger(__name__)
 
 
 VERSION = 2
 
+POOL_NAME = re.compile(r'pool-labels-(?P<timestamp>[^-]+)-(?P<fileno>\d+)-n\d+')
+
 
 def generate_codes(timestamp, batch, hexlen=4):
     for i in range(int('0x' + 'f' * hexlen, base=16)):
@@ -31,41 +42,89 @@ def generate_codes(timestamp, batch, hexlen=4):
         yield f'P{timestamp}-{batch}-{h}'
 
 
-def specimenlabel(layout, code, img):
-    label_drawing = Drawing(layout.label_width, layout.label_height)
+def repeat_codes(codes, copies=1):
+    """Yield each of `codes` `copies` times."""
+
+    for code in codes:
+        yield from itertools.repeat(code, copies)
+
 
+def specimenlabel_items(layout, code, img, engine='writer'):
     bc_width = 1.75 * inch
     bc_height = 0.4 * inch
-    barcode = Image(x=0, y=0, width=bc_width, height=bc_height, path=img)
-    label_drawing.add(barcode)
-    return label_drawing
+    return [Barcode(0, 0, bc_width, bc_height, img, code, engine)]
+
+
+def specimenlabel(layout, code, img, engine='writer'):
+    return to_drawing(layout.label_width, layout.label_height,
+                      specimenlabel_items(layout, code, img, engine))
+
 
+def thermal_specimenlabel(layout, code, language='zpl', dpi=203):
+    """Printer commands for the label drawn by specimenlabel()"""
 
-def fill_sheet(canvas, codes, layout, timestamp, page_number, fake_code=None):
+    label = Label(layout.label_width, layout.label_height, language, dpi)
+    label.code128(0, 0, 1.75 * inch, 0.4 * inch, code.replace('-', ''), code)
+    return label
+
+
+def fill_sheet(canvas, codes, layout, timestamp, page_number, fake_code=None, draft=False,
+               images=None, labels=None, engine='writer', raster_dpi=None,
+               raster_compression='flate', copies=1):
+    """Draw one page of labels using the next `layout.num_x *
+    layout.num_y` codes from iterator `codes` (leaving the remaining
+    positions empty if they run out). Images are written to
+    ImageCache `images` if provided. If `labels` is provided, only
+    labels at these positions (numbered from 1 starting at the top
+    left) are drawn. `engine` is one of CODE128_ENGINES. If
+    `raster_dpi` is provided, bars are drawn in a single image for
+    the page instead (see raster.PageRaster). If `copies` is greater
+    than 1 (ie, `codes` repeats each code; see repeat_codes()), each
+    label is drawn once as a form that is placed for every copy in
+    the document.
+
+    """
 
     # consume enough codes to fill the page and reverse the order
-    revcodes = iter(reversed([next(codes) for i in range(layout.num_x * layout.num_y)]))
+    nlabels = layout.num_x * layout.num_y
+    page_codes = list(itertools.islice(codes, nlabels))
+    revcodes = iter(reversed(page_codes + [None] * (nlabels - len(page_codes))))
+    get_barcode = get_pool_label_bars if engine == 'numpy' else get_pool_label
+    raster = None
+    if raster_dpi and not draft:
+        raster = PageRaster(layout.pagesize, raster_dpi, raster_compression)
 
     with tempfile.TemporaryDirectory() as d:
+        images = images or ImageCache(d)
+
         # start at the bottom of the page
-        ypos = layout.margin_bottom
-        for label_number in range(layout.num_y):
+        for label_number, row in enumerate(label_origins(layout)):
             for i in reversed(range(layout.num_x)):
                 code = fake_code or next(revcodes)
 
+                position = (layout.num_y - label_number - 1) * layout.num_x + i + 1
+                if code is None or (labels and position not in labels):
+                    continue
+
+                name = None
+                if copies > 1 and not raster:
+                    name = form_name(code, engine, draft)
+                    if has_form(canvas, name):
+                        draw_form(canvas, name, *row[i])
+                        continue
+
                 # generate barcode images
-                code128_path = path.join(d, code) + '-code128.png'
-                with open(code128_path, 'wb') as f:
-                    f.write(get_pool_label(code))
+                code128_path = None if draft or raster else images.path(get_barcode, code)
+                items = specimenlabel_items(layout, code, code128_path, engine)
 
-                label = specimenlabel(layout, code, code128_path)
-                renderPDF.draw(
-                    drawing=label,
-                    canvas=canvas,
-                    x=layout.margin_left + i * (layout.label_width + layout.hspace),
-                    y=ypos)
+                if name:
+                    label_form(canvas, name, items, layout.pagesize)
+                    draw_form(canvas, name, *row[i])
+                else:
+                    draw_label(canvas, items, *row[i], raster=raster)
 
-            ypos += layout.label_height + layout.vspace
+    if raster:
+        raster.draw(canvas)
 
 
 def build_parser(parser):
@@ -80,48 +139,175 @@ def build_parser(parser):
     parser.add_argument('-p', '--npages', default=25, type=int,
                         help='number of pages, max 99 [default %(default)s]')
     parser.add_argument('-f', '--nfiles', default=99, type=int, help='[default %(default)s]')
+    parser.add_argument('--first-file', metavar='N', default=1, type=int,
+                        help='number of the first file [%(default)s]')
     parser.add_argument('--grid', help='draw grid',
                         action='store_true', default=False)
     parser.add_argument('--fake-code', help='fill sheet with this fake code')
+    parser.add_argument('--draft', action='store_true', default=False,
+                        help='proof the layout using placeholders instead of barcode images')
+    parser.add_argument('--draft-pages', metavar='N', type=int,
+                        help='render only the first N pages (implies --draft)')
+    parser.add_argument('--max-pages-per-file', metavar='N', type=int,
+                        help="""start a new output file after N pages;
+                        limits memory use for large values of --npages""")
+    parser.add_argument('--max-bytes-per-file', metavar='BYTES', type=int,
+                        help='start a new output file before exceeding BYTES')
+    parser.add_argument('--code128-engine', choices=CODE128_ENGINES, default='writer',
+                        help="""create Code 128 images using python-barcode's ImageWriter,
+                        or rasterize the bars using numpy and add the text to the pdf
+                        [%(default)s]""")
+    parser.add_argument('--format', choices=FORMATS, default='pdf',
+                        help="""output format; zpl and epl write commands for
+                        thermal label printers, one label at a time [%(default)s]""")
+    parser.add_argument('--dpi', type=int, default=203,
+                        help='printer resolution for zpl and epl output [%(default)s]')
+    parser.add_argument('--copies', metavar='N', type=int, default=1,
+                        help="""print N consecutive labels for each code; each label
+                        is drawn once and reused for its copies [%(default)s]""")
+    parser.add_argument('--raster-dpi', metavar='DPI', type=int,
+                        help="""draw the bars of all barcodes on a page into a single
+                        1-bit image at the printer's resolution (eg, 600)""")
+    parser.add_argument('--raster-compression', choices=COMPRESSIONS, default='flate',
+                        help='compression of page images with --raster-dpi [%(default)s]')
+    parser.add_argument('--append', metavar='FILE',
+                        help="""add --npages pages to an existing pool pdf file,
+                        continuing its page numbers and codes (the timestamp and
+                        file number are read from the file name, which is not
+                        changed)""")
+    add_upload_arguments(parser)
+    parser.add_argument('--estimate', action='store_true', default=False,
+                        help="""render a small sample and report the estimated time,
+                        peak memory and size of the output for each Code 128 engine
+                        and number of worker processes (see the run command),
+                        without writing the output""")
+    add_progress_arguments(parser)
+    parser.add_argument('--object-streams', action='store_true', default=False,
+                        help="""compress pdf objects into object streams with a
+                        cross-reference stream (requires pikepdf)""")
+    parser.add_argument('--linearize', action='store_true', default=False,
+                        help="""write linearized ("fast web view") pdf files so that
+                        the first page can be printed before the whole file is
+                        read (requires pikepdf)""")
 
 
 def action(args):
     layout = layouts.pool
+    if args.draft_pages is not None and args.draft_pages < 1:
+        sys.exit('--draft-pages must be at least 1')
+
+    draft = args.draft or args.draft_pages is not None
+    npages = args.npages
+    if args.draft_pages is not None:
+        npages = min(npages, args.draft_pages)
+
+    if (args.object_streams or args.linearize) and pikepdf is None:
+        sys.exit('--object-streams and --linearize require pikepdf')
 
     if args.npages > 99:
         sys.exit('The maximum number of pages is 99')
 
-    if args.nfiles > 99:
+    if args.first_file + args.nfiles - 1 > 99:
         sys.exit('The maximum number of files is 99')
 
-    outdir = Path(args.dirname)
-    outdir.mkdir(parents=True, exist_ok=True)
-
-    for fileno in range(1, args.nfiles + 1):
-        codes = generate_codes(args.timestamp, f'{fileno:02}')
-
-        outfile = outdir / args.outfile.format(
-            timestamp=args.timestamp,
+    if args.copies < 1:
+        sys.exit('--copies must be at least 1')
+
+    if args.estimate:
+        engines = CODE128_ENGINES
+        if draft or args.format != 'pdf' or args.raster_dpi:
+            engines = [args.code128_engine]
+        print(estimate('pool', sample_action(action, args), npages=npages,
+                       nfiles=1 if args.append else args.nfiles,
+                       labels_per_page=layout.num_x * layout.num_y, engines=engines,
+                       selected=args.code128_engine, max_pages=args.max_pages_per_file,
+                       max_bytes=args.max_bytes_per_file),
+              end='')
+        return
+
+    timestamp, first_page = args.timestamp, 0
+    if args.append:
+        if args.format != 'pdf' or args.max_pages_per_file or args.max_bytes_per_file \
+           or args.object_streams or args.linearize:
+            sys.exit('--append cannot be used with --format, --max-*-per-file, '
+                     '--object-streams or --linearize')
+
+        match = POOL_NAME.search(Path(args.append).name)
+        if not match:
+            sys.exit(f'could not determine timestamp and file number from {args.append}')
+        timestamp = match.group('timestamp')
+
+        try:
+            first_page = page_count(args.append)
+        except (OSError, ValueError) as err:
+            sys.exit(f'cannot append to {args.append}: {err}')
+        if first_page + npages > 99:
+            sys.exit('The maximum number of pages is 99')
+
+        files = [(int(match.group('fileno')), Path(args.append))]
+    else:
+        outdir = Path(args.dirname)
+        outdir.mkdir(parents=True, exist_ok=True)
+        files = [(fileno, outdir / args.outfile.format(
+            timestamp=timestamp,
             fileno=fileno,
             npages=args.npages
-        )
-
-        print(outfile)
-
-        canvas = Canvas(str(outfile), pagesize=layout.pagesize)
-        for page_number in range(args.npages):
-            fill_sheet(canvas, codes, layout=layout, page_number=page_number + 1,
-                       timestamp=args.timestamp, fake_code=args.fake_code)
-            if args.grid:
-                draw_grid(canvas, layout=layout, include_vline=True)
-
-            # add page number (bottom left)
-            canvas.drawString(10, 20, str(page_number + 1))
-
-            # add package version
-            canvas.drawString(30, 20, f'barcoder version {__version__}')
-
-            # starts a new page
-            canvas.showPage()
-
-        canvas.save()
+        )) for fileno in range(args.first_file, args.first_file + args.nfiles)]
+
+    try:
+        sink = get_sink(args.upload, endpoint_url=args.endpoint_url,
+                        workers=args.upload_workers)
+    except (ImportError, ValueError) as err:
+        sys.exit(str(err))
+
+    per_page = layout.num_x * layout.num_y
+
+    progress = Progress.from_args('pool', args, total_pages=npages * len(files))
+    with progress, sink:
+        for fileno, outfile in files:
+            codes = repeat_codes(generate_codes(timestamp, f'{fileno:02}'), args.copies)
+            codes = itertools.islice(codes, first_page * per_page, None)
+
+            if args.format != 'pdf':
+                outfile = outfile.with_suffix('.' + args.format)
+                progress.file(outfile)
+                print(outfile)
+                with open(outfile, 'w') as f:
+                    for page_number in range(npages):
+                        for code in itertools.islice(codes, per_page):
+                            f.write(str(thermal_specimenlabel(
+                                layout, args.fake_code or code, args.format, args.dpi)))
+                        progress.page(per_page)
+                sink.put(outfile)
+                continue
+
+            output = RollingCanvas(outfile, pagesize=layout.pagesize,
+                                   max_pages=args.max_pages_per_file,
+                                   max_bytes=args.max_bytes_per_file,
+                                   object_streams=args.object_streams,
+                                   linearize=args.linearize,
+                                   append=bool(args.append),
+                                   sink=sink,
+                                   progress=progress)
+
+            for page_number in range(first_page, first_page + npages):
+                canvas = output.start_page()
+                if output.opened:
+                    print(output.path)
+                fill_sheet(canvas, codes, layout=layout, page_number=page_number + 1,
+                           timestamp=timestamp, fake_code=args.fake_code, draft=draft,
+                           engine=args.code128_engine, raster_dpi=args.raster_dpi,
+                           raster_compression=args.raster_compression, copies=args.copies)
+                if args.grid:
+                    draw_grid(canvas, layout=layout, include_vline=True)
+                if draft:
+                    draw_label_bounds(canvas, layout=layout)
+
+                # add page number and package version (bottom left)
+                draw_page_number(canvas, page_number + 1)
+
+                # starts a new page
+                output.end_page()
+                progress.page(per_page)
+
+            output.save()
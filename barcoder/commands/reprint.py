@@ -0,0 +1,196 @@
+"""Reprint selected pages or labels of threecol or pool output
+
+Threecol pages are reconstructed from the csv log written alongside
+each pdf file::
+
+  barcoder reprint --log securelink-3x10-b-004-n30.csv --pages 17
+
+Pool labels are numbered sequentially, so pages are reconstructed
+from the name of the pdf file (or from --timestamp and --fileno)::
+
+  barcoder reprint --pool pool-labels-0123-004-n25.pdf --pages 3 --labels 1-8
+
+Barcode images are saved in --cache-dir so that repeated reprints
+of the same page do not need to regenerate them.
+"""
+
+import argparse
+import csv
+import itertools
+import logging
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+from reportlab.pdfgen.canvas import Canvas
+
+from barcoder import layouts
+from barcoder.commands import pool, threecol
+from barcoder.utils import (ImageCache, default_cache_dir, draw_grid,
+                            draw_page_number, parse_ranges, CODE128_ENGINES)
+
+log = logging.getLogger(__name__)
+
+
+def format_ranges(numbers):
+    """Inverse of parse_ranges(), using '_' as a separator (eg, [1, 2, 3,
+    17] -> '1-3_17')
+
+    """
+
+    groups = []
+    for _, group in itertools.groupby(enumerate(numbers), lambda x: x[1] - x[0]):
+        group = [n for _, n in group]
+        groups.append(str(group[0]) if len(group) == 1 else f'{group[0]}-{group[-1]}')
+    return '_'.join(groups)
+
+
+def read_log(infile, filename=None):
+    """Return an OrderedDict mapping page number to a list of codes
+    (in the order in which they were consumed by
+    threecol.fill_sheet) and the name of the pdf file described by
+    the threecol csv log `infile`. If the log describes more than one
+    file, `filename` selects one of them.
+
+    """
+
+    files = OrderedDict()
+    for outfile, page, code in csv.reader(infile):
+        files.setdefault(Path(outfile).name, OrderedDict()).setdefault(int(page), []).append(code)
+
+    if filename:
+        filename = Path(filename).name
+        if filename not in files:
+            sys.exit(f'{filename} is not described in {infile.name}')
+    elif len(files) == 1:
+        filename, = files.keys()
+    else:
+        sys.exit(f'{infile.name} describes more than one file; choose one using --file')
+
+    return files[filename], filename
+
+
+def reprint_threecol(canvas, args, images):
+    layout = layouts.threecol
+    pages, filename = read_log(args.log, args.file)
+
+    for page_number in args.pages:
+        if page_number not in pages:
+            sys.exit(f'page {page_number} of {filename} is not in {args.log.name}')
+
+        threecol.fill_sheet(
+            canvas,
+            layout=layout,
+            page_number=page_number - 1,
+            code_generator=iter(pages[page_number]),
+            filename=filename,
+            images=images,
+            labels=args.labels,
+            engine=args.code128_engine)
+
+        if args.grid:
+            draw_grid(canvas, layout=layout)
+        canvas.showPage()
+
+    return filename
+
+
+def reprint_pool(canvas, args, images):
+    layout = layouts.pool
+    per_page = layout.num_x * layout.num_y
+
+    timestamp, fileno = args.timestamp, args.fileno
+    if args.pool and not (timestamp and fileno):
+        match = pool.POOL_NAME.search(Path(args.pool).name)
+        if not match:
+            sys.exit(f'could not determine timestamp and file number from {args.pool}')
+        timestamp = timestamp or match.group('timestamp')
+        fileno = fileno or int(match.group('fileno'))
+
+    if not (timestamp and fileno):
+        sys.exit('--log, --pool, or both --timestamp and --fileno are required')
+
+    filename = Path(args.pool).name if args.pool else f'pool-labels-{timestamp}-{fileno:03d}'
+
+    for page_number in args.pages:
+        codes = pool.repeat_codes(pool.generate_codes(timestamp, f'{fileno:02}'), args.copies)
+        codes = itertools.islice(codes, (page_number - 1) * per_page, None)
+
+        pool.fill_sheet(canvas, codes, layout=layout, timestamp=timestamp,
+                        page_number=page_number, images=images, labels=args.labels,
+                        engine=args.code128_engine, copies=args.copies)
+
+        if args.grid:
+            draw_grid(canvas, layout=layout, include_vline=True)
+        draw_page_number(canvas, page_number)
+        canvas.showPage()
+
+    return filename
+
+
+def build_parser(parser):
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--log', metavar='FILE', type=argparse.FileType('r'),
+                        help='csv log written by threecol')
+    source.add_argument('--pool', metavar='FILE',
+                        help='name of a pdf file written by pool')
+    parser.add_argument('--file', metavar='NAME',
+                        help='pdf file to reprint if --log describes more than one')
+    parser.add_argument('--timestamp', help='pool timestamp (overrides --pool)')
+    parser.add_argument('--fileno', type=int, help='pool file number (overrides --pool)')
+    parser.add_argument('--copies', metavar='N', type=int, default=1,
+                        help='--copies used to create the pool file [%(default)s]')
+    parser.add_argument('-p', '--pages', type=parse_ranges, required=True,
+                        help='pages to reprint, eg "17" or "1-3,17"')
+    parser.add_argument('-l', '--labels', type=parse_ranges,
+                        help="""reprint only these labels on each page, numbered
+                        from 1 starting at the top (threecol rows) or the top left
+                        (pool labels, left to right)""")
+    parser.add_argument('-o', '--outfile', default='{stem}-reprint-{pages}.pdf',
+                        help='File name template [%(default)s]')
+    parser.add_argument('-d', '--dirname', default='.',
+                        help='directory for output [%(default)s]')
+    parser.add_argument('--cache-dir', default=default_cache_dir(),
+                        help='directory for cached barcode images [%(default)s]')
+    parser.add_argument('--grid', help='draw grid',
+                        action='store_true', default=False)
+    parser.add_argument('--code128-engine', choices=CODE128_ENGINES, default='writer',
+                        help='engine used to create the original labels [%(default)s]')
+
+
+def action(args):
+    if args.log:
+        layout, reprint = layouts.threecol, reprint_threecol
+    else:
+        layout, reprint = layouts.pool, reprint_pool
+
+    images = ImageCache(Path(args.cache_dir) / 'images')
+
+    outdir = Path(args.dirname)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    # the file name depends on the source, so write to a temporary file
+    # (with the permissions of a new file) unique to this process
+    with tempfile.NamedTemporaryFile(dir=outdir, prefix='.reprint-', suffix='.pdf',
+                                     delete=False) as f:
+        tmpfile = Path(f.name)
+    umask = os.umask(0)
+    os.umask(umask)
+    tmpfile.chmod(0o666 & ~umask)
+
+    try:
+        canvas = Canvas(str(tmpfile), pagesize=layout.pagesize)
+        filename = reprint(canvas, args, images)
+        canvas.save()
+    except BaseException:
+        tmpfile.unlink()
+        raise
+
+    outfile = outdir / args.outfile.format(
+        stem=Path(filename).stem,
+        pages=format_ranges(args.pages)
+    )
+    tmpfile.replace(outfile)
+    print(outfile)
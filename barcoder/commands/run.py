@@ -0,0 +1,244 @@
+"""Run a batch of threecol, twocol, pool and sheet jobs in parallel
+
+Jobs are described in a json file::
+
+  {
+    "jobs": [
+      {"name": "w1", "command": "threecol", "priority": 1,
+       "args": {"dirname": "threecol-12char-w1", "code-length": 12,
+                "npages": 30, "nfiles": 350, "batch": "05-27-w1"}},
+      {"command": "pool", "args": ["--timestamp", "0123", "--nfiles", "10"]},
+      {"command": "sheet", "args": {"infile": "plates.csv", "outfile": "plates.pdf"}}
+    ]
+  }
+
+"args" are either a list of command line arguments or an object
+mapping option names to values (true for flags). Jobs creating more
+than one file are split into one task per file, except for threecol
+jobs (other than --fake-code), whose codes must be unique across all
+of their files, and --append jobs, which add pages to a single file;
+identical tasks are run only once. Tasks from jobs with a higher
+"priority" (default 0) are started first, and each worker process
+takes the next task as soon as it is idle. A summary of output files
+and timing for each job is written as json when all tasks are
+complete.
+"""
+
+import argparse
+import heapq
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import redirect_stdout
+from importlib import import_module
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+COMMANDS = ['threecol', 'twocol', 'pool', 'sheet']
+
+
+def get_parser(command):
+    parser = argparse.ArgumentParser(prog=f'barcoder {command}')
+    import_module(f'barcoder.commands.{command}').build_parser(parser)
+    return parser
+
+
+def to_argv(args):
+    """Return a list of command line arguments from `args`, which is
+    either a list or a dict such as {'npages': 30, 'grid': True}
+    (-> ['--npages', '30', '--grid']).
+
+    """
+
+    if isinstance(args, list):
+        return [str(arg) for arg in args]
+
+    argv = []
+    for key, val in args.items():
+        opt = '--' + key.replace('_', '-')
+        if val is True:
+            argv.append(opt)
+        elif val not in (False, None):
+            argv.extend([opt, str(val)])
+    return argv
+
+
+def task_key(command, argv):
+    """Return a hashable representation of the options for a task, so
+    that tasks with equivalent arguments are identical.
+
+    """
+
+    args = get_parser(command).parse_args(argv)
+    options = []
+    for key, val in sorted(vars(args).items()):
+        # files opened by argparse are identified by name
+        if hasattr(val, 'read'):
+            val.close()
+            val = val.name
+        options.append((key, val))
+    return command, tuple(options)
+
+
+def split_job(command, argv):
+    """Return a list of (argv, key) for each file created by the job;
+    see task_key().
+
+    """
+
+    key = task_key(command, argv)
+    options = dict(key[1])
+
+    # sheet and --append write a single file, and threecol codes
+    # (random or a fake series) must be generated by a single process
+    # so that they are unique across files
+    if command == 'sheet' or options.get('append') or options['nfiles'] == 1 or \
+       (command == 'threecol' and not options['fake_code']):
+        return [(argv, key)]
+
+    tasks = []
+    for fileno in range(options['first_file'], options['first_file'] + options['nfiles']):
+        task = argv + ['--first-file', str(fileno), '--nfiles', '1']
+        tasks.append((task, task_key(command, task)))
+    return tasks
+
+
+def run_task(command, argv):
+    """Run a single task and return the names of the files it created
+    and the elapsed time.
+
+    """
+
+    args = get_parser(command).parse_args(argv)
+    start = time.time()
+    with io.StringIO() as f, redirect_stdout(f):
+        import_module(f'barcoder.commands.{command}').action(args)
+        return f.getvalue().split(), time.time() - start
+
+
+def read_jobs(infile):
+    """Return an OrderedDict of job name -> dict describing each job."""
+
+    try:
+        spec = json.load(infile)
+    except ValueError as err:
+        sys.exit(f'{infile.name} is not valid json: {err}')
+
+    jobs = OrderedDict()
+    for i, job in enumerate(spec.get('jobs', []), 1):
+        command = job.get('command')
+        if command not in COMMANDS:
+            sys.exit(f'job {i}: "command" must be one of {", ".join(COMMANDS)}')
+
+        name = job.get('name') or f'{i}-{command}'
+        if name in jobs:
+            sys.exit(f'job {i}: the name "{name}" is used more than once')
+
+        argv = to_argv(job.get('args', []))
+        jobs[name] = {
+            'command': command,
+            'priority': job.get('priority', 0),
+            'tasks': split_job(command, argv),
+        }
+
+    return jobs
+
+
+def build_parser(parser):
+    parser.add_argument('jobs', type=argparse.FileType('r'),
+                        help='json file describing jobs')
+    parser.add_argument('-j', '--jobs', dest='nprocs', metavar='N', type=int,
+                        default=os.cpu_count(),
+                        help='number of worker processes [%(default)s]')
+    parser.add_argument('-s', '--summary', metavar='FILE',
+                        help='json file summarizing the results [<jobs>-summary.json]')
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='list the tasks for each job and exit')
+
+
+def action(args):
+    jobs = read_jobs(args.jobs)
+
+    # identical tasks are run once and shared among jobs
+    queue, tasks, seen = [], {}, set()
+    for seq, (name, job) in enumerate(jobs.items()):
+        job.update(done=0, duplicates=0, files=[], elapsed=0, errors=[])
+        for argv, key in job['tasks']:
+            tasks.setdefault(key, []).append(name)
+            if key in seen:
+                job['duplicates'] += 1
+                continue
+            seen.add(key)
+            heapq.heappush(queue, (-job['priority'], seq, len(seen), job['command'], argv, key))
+
+    if args.dry_run:
+        for name, job in jobs.items():
+            for argv, key in job['tasks']:
+                duplicate = ' (duplicate)' if tasks[key][0] != name else ''
+                print(f'{name}: {job["command"]} {" ".join(argv)}{duplicate}')
+        return
+
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=args.nprocs) as executor:
+        # submit only as many tasks as there are workers so that
+        # priorities are respected as tasks complete
+        running = {}
+        while queue or running:
+            while queue and len(running) < args.nprocs:
+                command, argv, key = heapq.heappop(queue)[-3:]
+                running[executor.submit(run_task, command, argv)] = command, argv, key
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                command, argv, key = running.pop(future)
+                try:
+                    files, elapsed = future.result()
+                except BaseException as err:
+                    files, elapsed = [], 0
+                    error = f'{command} {" ".join(argv)}: {err}'
+                    log.error(error)
+                else:
+                    error = None
+
+                for name in tasks[key]:
+                    job = jobs[name]
+                    job['done'] += 1
+                    job['files'].extend(f for f in files if f not in job['files'])
+                    job['elapsed'] += elapsed
+                    if error:
+                        job['errors'].append(error)
+                    if args.verbosity:
+                        print(f'{name}: {job["done"]}/{len(job["tasks"])} tasks',
+                              file=sys.stderr)
+
+                for fname in files:
+                    print(fname)
+
+    summary = {
+        'elapsed': round(time.time() - start, 2),
+        'jobs': OrderedDict(
+            (name, {
+                'command': job['command'],
+                'priority': job['priority'],
+                'tasks': len(job['tasks']),
+                'duplicates': job['duplicates'],
+                'errors': job['errors'],
+                'elapsed': round(job['elapsed'], 2),
+                'files': job['files'],
+            }) for name, job in jobs.items()),
+    }
+
+    summary_file = args.summary or Path(args.jobs.name).stem + '-summary.json'
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(summary_file)
+
+    nerrors = sum(len(job['errors']) for job in jobs.values())
+    if nerrors:
+        sys.exit(f'{nerrors} tasks failed; see {summary_file}')
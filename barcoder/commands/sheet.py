@@ -2,22 +2,32 @@
 """
 
 import logging
+import math
 import tempfile
-from os import path
 import io
 from pathlib import Path
-from itertools import zip_longest
+import itertools
+from itertools import islice, zip_longest
 import csv
 import argparse
 import sys
 
-from reportlab.graphics.shapes import Drawing, String, Image
-from reportlab.graphics import renderPDF
 from reportlab.pdfgen.canvas import Canvas
 from reportlab.lib.units import inch
 
-from barcoder import __version__, layouts
-from barcoder.utils import get_pool_label, draw_grid
+from barcoder import layouts
+from barcoder.append import append_pages, page_count
+from barcoder.csvindex import ENCODING, IndexedCSV
+from barcoder.estimate import estimate
+from barcoder.progress import Progress, add_progress_arguments
+from barcoder.raster import COMPRESSIONS, PageRaster
+from barcoder.sinks import add_upload_arguments, get_sink
+from barcoder.thermal import FORMATS, Label
+from barcoder.labels import (Barcode, Text, draw_form, draw_label, form_name, has_form,
+                             label_form, label_origins, to_drawing)
+from barcoder.utils import (get_pool_label, get_pool_label_bars, draw_grid,
+                            draw_label_bounds, ImageCache, draw_page_number,
+                            CODE128_ENGINES, default_cache_dir, parse_ranges)
 
 log = logging.getLogger(__name__)
 
@@ -27,85 +37,224 @@ def grouper(iterable, size, padvalue=None):
     return zip_longest(*[iter(iterable)] * size, fillvalue=padvalue)
 
 
-def specimenlabel(layout, img, barcode,
-                  label1=None, label2=None, label3=None, label4=None, **ignored):
+def label_copies(code):
+    """Return the number of copies of the label for `code` given by
+    its optional field 'copies' (1 if missing or empty).
 
-    label_drawing = Drawing(layout.label_width, layout.label_height)
+    """
+
+    value = (code or {}).get('copies') or 1
+    try:
+        copies = int(value)
+    except ValueError:
+        copies = 0
+    if copies < 1:
+        raise ValueError(f'invalid number of copies for {code["barcode"]}: {value}')
+    return copies
+
+
+def check_copies(codes):
+    """Exit with a message if the number of copies of any of `codes` is
+    invalid (see label_copies()).
+
+    """
+
+    try:
+        for code in codes:
+            label_copies(code)
+    except ValueError as err:
+        sys.exit(str(err))
+
+
+def expand_copies(codes):
+    """Yield each of `codes` (see fill_sheet()) once for each of its
+    copies.
+
+    """
+
+    for code in codes:
+        yield from itertools.repeat(code, label_copies(code))
+
+
+def barcode_width(barcode):
+    """Width of the barcode image based on the number of characters in
+    the barcode, to preserve appropriate horizontal spacing
+
+    """
 
-    # adjust the width based on number of characters in
-    # the barcode to preserve appropriate horizontal spacing
     code = barcode.replace('-', '')
     mils = 15 * 0.001
     alpha = len([c for c in code if c.isalpha()])
     num = len(code) - alpha
     # see https://www.traceability.com/calculators/7-code-128-barcode-length-calculator
-    bc_width = (11 * alpha + 5.5 * num + 35) * mils * inch
-    bc_height = 0.4 * inch
+    return (11 * alpha + 5.5 * num + 35) * mils * inch
+
+
+def label_positions(layout, bc_height):
     lmar = 5
 
     # lay out grid of labels
     topy = bc_height + 15
     boty = bc_height + 4
 
-    positions = [
+    return [
         (lmar, topy),
         (lmar, boty),
         (lmar + layout.label_width / 2, topy),
         (lmar + layout.label_width / 2, boty),
     ]
 
-    for label, (x, y) in zip([label1, label2, label3, label4], positions):
-        if label:
-            label_drawing.add(String(x=x, y=y, text=label, fontName="Helvetica", fontSize=8))
 
-    barcode = Image(x=0, y=0, width=bc_width, height=bc_height, path=img)
-    label_drawing.add(barcode)
-    return label_drawing
+def specimenlabel_items(layout, img, barcode,
+                        label1=None, label2=None, label3=None, label4=None, engine='writer',
+                        **ignored):
+
+    bc_width = barcode_width(barcode)
+    bc_height = 0.4 * inch
+
+    positions = label_positions(layout, bc_height)
+    items = [Text(x, y, label) for label, (x, y)
+             in zip([label1, label2, label3, label4], positions) if label]
+    items.append(Barcode(0, 0, bc_width, bc_height, img, barcode, engine))
+    return items
+
+
+def specimenlabel(layout, img, barcode, **kwargs):
+    return to_drawing(layout.label_width, layout.label_height,
+                      specimenlabel_items(layout, img, barcode, **kwargs))
+
+
+def thermal_specimenlabel(layout, barcode, label1=None, label2=None, label3=None,
+                          label4=None, language='zpl', dpi=203, **ignored):
+    """Printer commands for the label drawn by specimenlabel()"""
+
+    label = Label(layout.label_width, layout.label_height, language, dpi)
+
+    bc_height = 0.4 * inch
+    positions = label_positions(layout, bc_height)
+    for text, (x, y) in zip([label1, label2, label3, label4], positions):
+        label.text(x, y, text, font_size=8)
+
+    label.code128(0, 0, barcode_width(barcode), bc_height, barcode.replace('-', ''), barcode)
+    return label
 
 
-def fill_sheet(canvas, codes, layout):
+def fill_sheet(canvas, codes, layout, draft=False, images=None, engine='writer',
+               raster_dpi=None, raster_compression='flate'):
     """Fill the provided canvas with an array of labels. 'codes' is a
     sequence of dicts with required key 'barcode' and optional keys
     'label1' (...?). The sequence should be padded with falsy values
     (eg, None, {}, '', etc) to fill the sheet given the total number
-    of rows and columns.
+    of rows and columns. If 'draft' is True, placeholders are drawn
+    instead of barcode images. Images are written to ImageCache
+    'images' if provided. 'engine' is one of CODE128_ENGINES. If
+    'raster_dpi' is provided, bars are drawn in a single image for the
+    page instead (see raster.PageRaster).
+
+    Codes with more than one copy (optional key 'copies'; see
+    expand_copies()) are drawn once as a form that is placed for
+    every copy in the document.
 
     """
 
     # reverse the order of codes
     codes = reversed(list(codes))
+    get_barcode = get_pool_label_bars if engine == 'numpy' else get_pool_label
+    raster = None
+    if raster_dpi and not draft:
+        raster = PageRaster(layout.pagesize, raster_dpi, raster_compression)
 
     with tempfile.TemporaryDirectory() as d:
+        images = images or ImageCache(d)
+
         # start at the bottom of the page
-        ypos = layout.margin_bottom
-        for label_number in range(layout.num_y):
+        for row in label_origins(layout):
             for i in reversed(range(layout.num_x)):
                 code = next(codes)
                 if not code:
                     continue
 
                 barcode = code['barcode']
-                label1 = code.get('label1')
+
+                name = None
+                if label_copies(code) > 1 and not raster:
+                    name = form_name(sorted(code.items()), engine, draft)
+                    if has_form(canvas, name):
+                        draw_form(canvas, name, *row[i])
+                        continue
 
                 # generate barcode images
-                code128_path = path.join(d, barcode) + '.png'
-                with open(code128_path, 'wb') as f:
-                    f.write(get_pool_label(barcode))
+                code128_path = None if draft or raster else images.path(get_barcode, barcode)
+
+                items = specimenlabel_items(layout=layout, img=code128_path, engine=engine,
+                                            **code)
+                if name:
+                    label_form(canvas, name, items, layout.pagesize)
+                    draw_form(canvas, name, *row[i])
+                else:
+                    draw_label(canvas, items, *row[i], raster=raster)
 
-                label = specimenlabel(layout=layout, img=code128_path, **code)
+    if raster:
+        raster.draw(canvas)
 
-                renderPDF.draw(
-                    drawing=label,
-                    canvas=canvas,
-                    x=layout.margin_left + i * (layout.label_width + layout.hspace),
-                    y=ypos)
 
-            ypos += layout.label_height + layout.vspace
+def render_pages(pages, layout, grid=False, draft=False, engine='writer', raster_dpi=None,
+                 raster_compression='flate', invariant=False, progress=None):
+    """Return bytes encoding a pdf file with a page for each
+    (page_number, codes) in `pages`; see get_pdf(). `progress` (see
+    barcoder.progress) is updated after each page.
 
+    """
 
-def get_pdf(codes, layout, grid=False):
+    with io.BytesIO() as f:
+        canvas = Canvas(f, pagesize=layout.pagesize, invariant=int(invariant))
+        for page_number, chunk in pages:
+            fill_sheet(canvas, chunk, layout=layout, draft=draft, engine=engine,
+                       raster_dpi=raster_dpi, raster_compression=raster_compression)
+
+            if grid:
+                draw_grid(canvas, layout=layout, include_vline=True)
+            if draft:
+                draw_label_bounds(canvas, layout=layout)
+
+            # add page number and package version (bottom left)
+            draw_page_number(canvas, page_number)
+
+            # starts a new page
+            canvas.showPage()
+            if progress:
+                progress.page(sum(1 for code in chunk if code))
+
+        canvas.save()
+        f.seek(0)
+        return f.read()
+
+
+def get_pdf(codes, layout, grid=False, draft=False, max_pages=None, engine='writer',
+            raster_dpi=None, raster_compression='flate', first_page=1, pages=None,
+            invariant=False, cache_dir=None, progress=None):
     """Return bytes encoding a pdf file including the barcodes in sequence
-    'codes'; see fill_sheet() for details.
+    'codes', each repeated for its copies; see fill_sheet() and
+    expand_copies() for details. If 'draft' is True, labels
+    are outlined and barcode images are replaced with placeholders. If
+    'max_pages' is provided, only the first 'max_pages' pages are
+    rendered. 'engine' selects how Code 128 images are created (see
+    CODE128_ENGINES), or 'raster_dpi' and 'raster_compression' how
+    bars are drawn in a single image for each page (see fill_sheet()).
+    Pages are numbered starting with 'first_page'. If 'pages' is
+    provided, only these page numbers are rendered; rows for other
+    pages are not read if 'codes' supports slicing (eg, a list or a
+    csvindex.IndexedCSV).
+
+    If 'invariant' is True, the creation date and document id are
+    fixed, so that the same input always produces the same bytes. If
+    'cache_dir' is provided, invariant output is saved in that
+    directory under a hash of the codes, the remaining arguments and
+    the package version, and returned without rendering when the same
+    codes are provided again.
+
+    'progress' (a barcoder.progress.Progress) is updated as pages are
+    drawn.
 
     This function provides a programmatic interface to generate labels
     outside of the context of the CLI. For example:
@@ -124,59 +273,209 @@ def get_pdf(codes, layout, grid=False):
         f.write(bytes)
     """
 
-    chunks = grouper(codes, layout.num_x * layout.num_y)
-    with io.BytesIO() as f:
-        canvas = Canvas(f, pagesize=layout.pagesize)
-        for page_number, chunk in enumerate(chunks, 1):
-
-            fill_sheet(canvas, chunk, layout=layout)
-
-            if grid:
-                draw_grid(canvas, layout=layout, include_vline=True)
+    per_page = layout.num_x * layout.num_y
 
-            # add page number (bottom left)
-            canvas.drawString(10, 20, str(page_number))
+    # rows of an IndexedCSV can be read by position only if each is a
+    # single label
+    if getattr(codes, 'fieldnames', None) is None or 'copies' in codes.fieldnames:
+        codes = expand_copies(codes)
 
-            # add package version
-            canvas.drawString(30, 20, f'barcoder version {__version__}')
+    if pages is None:
+        numbered = enumerate(grouper(codes, per_page), first_page)
+    else:
+        if not hasattr(codes, '__getitem__'):
+            codes = list(codes)
+        starts = ((n, (n - first_page) * per_page) for n in pages if n >= first_page)
+        numbered = ((n, list(codes[start:start + per_page])) for n, start in starts)
+        numbered = ((n, chunk + [None] * (per_page - len(chunk)))
+                    for n, chunk in numbered if chunk)
+    numbered = islice(numbered, max_pages)
+
+    kwargs = dict(grid=grid, draft=draft, engine=engine, raster_dpi=raster_dpi,
+                  raster_compression=raster_compression)
+
+    if cache_dir:
+        numbered = [(n, [dict(code) if code else None for code in chunk])
+                    for n, chunk in numbered]
+        cache = ImageCache(cache_dir, suffix='.pdf')
+        pth = cache.path(render_pages, numbered, layout, invariant=True, **kwargs)
+        if progress:
+            progress.page(sum(1 for _, chunk in numbered for code in chunk if code),
+                          len(numbered))
+        with open(pth, 'rb') as f:
+            return f.read()
+
+    return render_pages(numbered, layout, invariant=invariant, progress=progress, **kwargs)
+
+
+def get_thermal(codes, layout, language='zpl', dpi=203):
+    """Return a string with printer commands in `language` (see
+    barcoder.thermal) for a label for each of the barcodes in
+    sequence 'codes' (see fill_sheet()), in order, repeated for their
+    copies.
 
-            # starts a new page
-            canvas.showPage()
+    """
 
-        canvas.save()
-        f.seek(0)
-        return f.read()
+    return ''.join(str(thermal_specimenlabel(layout, language=language, dpi=dpi, **code))
+                   for code in expand_copies(codes) if code)
 
 
 def build_parser(parser):
-    parser.add_argument('-i', '--infile', type=argparse.FileType('r'),
-                        help="""Input file in csv format with required
-                        field "barcode" and optional fields "label1", ...""")
+    parser.add_argument('-i', '--infile', type=argparse.FileType('r', encoding=ENCODING),
+                        help="""Input file in csv format (%s) with required
+                        field "barcode" and optional fields "label1", ... and
+                        "copies" (the number of identical labels, drawn once)""" % ENCODING)
     parser.add_argument('-o', '--outfile', default='platelabels.pdf',
                         help='File name template [%(default)s]')
     parser.add_argument('-g', '--grid', help='draw grid',
                         action='store_true', default=False)
+    parser.add_argument('--draft', action='store_true', default=False,
+                        help='proof the layout using placeholders instead of barcode images')
+    parser.add_argument('--draft-pages', metavar='N', type=int,
+                        help='render only the first N pages (implies --draft)')
+    parser.add_argument('--code128-engine', choices=CODE128_ENGINES, default='writer',
+                        help="""create Code 128 images using python-barcode's ImageWriter,
+                        or rasterize the bars using numpy and add the text to the pdf
+                        [%(default)s]""")
+    parser.add_argument('--format', choices=FORMATS, default='pdf',
+                        help="""output format; zpl and epl write commands for
+                        thermal label printers, one label at a time [%(default)s]""")
+    parser.add_argument('--dpi', type=int, default=203,
+                        help='printer resolution for zpl and epl output [%(default)s]')
+    parser.add_argument('--raster-dpi', metavar='DPI', type=int,
+                        help="""draw the bars of all barcodes on a page into a single
+                        1-bit image at the printer's resolution (eg, 600)""")
+    parser.add_argument('--raster-compression', choices=COMPRESSIONS, default='flate',
+                        help='compression of page images with --raster-dpi [%(default)s]')
+    parser.add_argument('--invariant', action='store_true', default=False,
+                        help="""fix the creation date and document id so that the
+                        same input always produces an identical pdf""")
+    parser.add_argument('--cache', action='store_true', default=False,
+                        help="""reuse the pdf created for identical input, layout
+                        and options (implies --invariant)""")
+    parser.add_argument('--cache-dir', default=default_cache_dir(),
+                        help='directory for cached output with --cache [%(default)s]')
+    parser.add_argument('--pages', type=parse_ranges,
+                        help="""render only these pages, eg "400-410" (page numbers
+                        match the full document); rows are read using an index
+                        written alongside the input file (<infile>.idx)""")
+    parser.add_argument('--append', action='store_true', default=False,
+                        help="""add pages for the input to the existing pdf --outfile,
+                        continuing its page numbers""")
+    add_upload_arguments(parser)
+    parser.add_argument('--estimate', action='store_true', default=False,
+                        help="""render a small sample and report the estimated time,
+                        peak memory and size of the output for each Code 128 engine,
+                        without writing the output""")
+    add_progress_arguments(parser)
 
 
 def action(args):
-    outfile = Path(args.outfile)
-    print(outfile)
-    outfile.parent.mkdir(parents=True, exist_ok=True)
+    if args.draft_pages is not None and args.draft_pages < 1:
+        sys.exit('--draft-pages must be at least 1')
 
-    if args.infile:
+    outfile = Path(args.outfile)
+    if args.format != 'pdf':
+        outfile = outfile.with_suffix('.' + args.format)
+
+    if args.infile and args.pages and args.infile is not sys.stdin:
+        # read only the rows for the selected pages
+        args.infile.close()
+        codes = IndexedCSV(args.infile.name)
+        if 'barcode' not in codes.fieldnames:
+            sys.exit('"barcode" is a required field in the input file')
+        # every row is read to expand copies in any case
+        if 'copies' in codes.fieldnames:
+            check_copies(codes)
+    elif args.infile:
         reader = csv.DictReader(args.infile)
         if 'barcode' not in reader.fieldnames:
             sys.exit('"barcode" is a required field in the input file')
         codes = list(reader)
+        check_copies(codes)
     else:
         # for mocking up labels during development
-        codes = ({
+        codes = [{
             'barcode': 'D-' + str(i).zfill(10),
             'label1': f'label1-{i}',
             'label2': f'label2-{i}',
             'label3': f'label3-{i}',
             'label4': f'label4-{i}',
-        } for i in range(1, 97))
+        } for i in range(1, 97)]
+
+    layout = layouts.onecol
+    per_page = layout.num_x * layout.num_y
+    if args.pages:
+        total_pages = len(args.pages)
+    else:
+        total_pages = math.ceil(sum(map(label_copies, codes)) / per_page)
+    if args.draft_pages is not None:
+        total_pages = min(total_pages, args.draft_pages)
+
+    draft = args.draft or args.draft_pages is not None
+    options = dict(grid=args.grid, draft=draft, raster_dpi=args.raster_dpi,
+                   raster_compression=args.raster_compression, invariant=args.invariant)
+
+    if args.estimate:
+        def render(npages, dirname, engine):
+            pth = Path(dirname) / outfile.name
+            if args.format != 'pdf':
+                pth.write_text(get_thermal(codes[:npages * per_page], layout=layout,
+                                           language=args.format, dpi=args.dpi))
+            else:
+                pth.write_bytes(get_pdf(codes, layout=layout, max_pages=npages,
+                                        pages=args.pages, **dict(options, engine=engine)))
+
+        engines = CODE128_ENGINES
+        if draft or args.format != 'pdf' or args.raster_dpi:
+            engines = [args.code128_engine]
+        print(estimate('sheet', render, npages=total_pages, labels_per_page=per_page,
+                       engines=engines, selected=args.code128_engine, parallel=False),
+              end='')
+        return
+
+    first_page = 1
+    if args.append:
+        if args.format != 'pdf':
+            sys.exit('--append cannot be used with --format')
+        try:
+            first_page = page_count(outfile) + 1
+        except (OSError, ValueError) as err:
+            sys.exit(f'cannot append to {outfile}: {err}')
+
+    print(outfile)
+    outfile.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(str(outfile), 'wb') as fobj:
-        fobj.write(get_pdf(codes, layout=layouts.onecol, grid=args.grid))
+    try:
+        sink = get_sink(args.upload, endpoint_url=args.endpoint_url,
+                        workers=args.upload_workers)
+    except (ImportError, ValueError) as err:
+        sys.exit(str(err))
+
+    progress = Progress.from_args('sheet', args, total_pages=total_pages)
+    with progress, sink:
+        progress.file(outfile)
+
+        if args.format != 'pdf':
+            with open(outfile, 'w') as fobj:
+                fobj.write(get_thermal(codes, layout=layout, language=args.format,
+                                       dpi=args.dpi))
+            sink.put(outfile)
+            return
+
+        pdf = get_pdf(codes, layout=layout,
+                      max_pages=args.draft_pages,
+                      engine=args.code128_engine,
+                      first_page=first_page,
+                      pages=args.pages,
+                      cache_dir=Path(args.cache_dir) / 'sheets' if args.cache else None,
+                      progress=progress,
+                      **options)
+
+        if args.append:
+            append_pages(outfile, pdf)
+        else:
+            with open(str(outfile), 'wb') as fobj:
+                fobj.write(pdf)
+
+        sink.put(outfile)
@@ -6,20 +6,25 @@
 
 import logging
 import tempfile
-from os import path
 import argparse
 from pathlib import Path
 import csv
 import itertools
+import sys
 
-from reportlab.graphics.shapes import Drawing, String, Image
-from reportlab.graphics import renderPDF
-from reportlab.pdfgen.canvas import Canvas
 from reportlab.lib.units import inch
 
-from barcoder.utils import (get_chunks, get_qr, generate_codes,
-                            generate_fake_codes, get_code128, draw_grid)
+from barcoder.utils import (get_chunks, get_qr, get_qrs, generate_codes,
+                            generate_fake_codes, get_code128, get_code128_bars,
+                            draw_grid, draw_label_bounds, ImageCache, CODE128_ENGINES)
 from barcoder import layouts
+from barcoder.append import page_count
+from barcoder.estimate import estimate, sample_action
+from barcoder.labels import Barcode, Image, Text, draw_label, label_origins, to_drawing
+from barcoder.output import RollingCanvas, pikepdf
+from barcoder.progress import Progress, add_progress_arguments
+from barcoder.sinks import add_upload_arguments, get_sink
+from barcoder.thermal import FORMATS, Label
 
 log = logging.getLogger(__name__)
 
@@ -28,149 +33,182 @@ URL = 'https://securelink.labmed.uw.edu'
 VERSION = 5
 
 
-def specimenlabel(layout, code, img, counter, batch=None):
-    label_drawing = Drawing(layout.label_width, layout.label_height)
-
+def specimenlabel_items(layout, code, img, counter, batch=None, engine='writer'):
     # x, y, width, height, path
     bc_width = 1.6 * inch
     bc_height = 0.6 * inch
 
-    label_drawing.add(String(layout.label_width - 5, 16,
-                             text=f'{counter}',
-                             fontName="Helvetica", fontSize=6, textAnchor="end"))
+    return [
+        Text(layout.label_width - 5, 16, f'{counter}', font_size=6, anchor='end'),
+        Text(5, bc_height, 'DOB (MM/DD/YYYY): ____________________'),
+        Text(5, bc_height + 12, 'Name: ________________________________'),
+        # center barcode horizontally
+        Barcode((layout.label_width - bc_width) / 2, -3, bc_width, bc_height, img,
+                '-'.join(get_chunks(code, 4)), engine),
+    ]
+
 
-    label_drawing.add(String(5, bc_height,
-                             'DOB (MM/DD/YYYY): ____________________',
-                             fontName="Helvetica", fontSize=8, textAnchor="start"))
+def specimenlabel(layout, code, img, counter, batch=None, engine='writer'):
+    return to_drawing(layout.label_width, layout.label_height,
+                      specimenlabel_items(layout, code, img, counter, batch, engine))
 
-    label_drawing.add(String(5, bc_height + 12,
-                             'Name: ________________________________',
-                             fontName="Helvetica", fontSize=8, textAnchor="start"))
 
-    # center barcode horizontally
-    barcode = Image((layout.label_width - bc_width) / 2, -3, bc_width, bc_height, img)
-    label_drawing.add(barcode)
+def lablabel_items(layout, code, counter, filename, qr_path):
+    lmar = 5
+    bc_edge = 0.75 * inch
 
-    return label_drawing
+    # place objects starting from the bottom
+    ypos = 5
+    return [
+        Text(lmar, ypos, filename),
+        Text(layout.label_width - 5, ypos, f'{counter} v{VERSION}', anchor='end'),
+        Image(0, 12, bc_edge, bc_edge, qr_path, 'QR'),
+        Text(bc_edge, 18, 'or requisition (no name/DOB)'),
+        Text(bc_edge, 28, '<-- For specimen (write name/DOB)'),
+        Text(layout.label_width - 5, 44, 'For individual being tested -->', anchor='end'),
+        Text(bc_edge, 58, 'This label may be discarded', 'Helvetica-Bold', 10),
+    ]
 
 
 def lablabel(layout, code, counter, filename, qr_path):
-    label_drawing = Drawing(layout.label_width, layout.label_height)
+    return to_drawing(layout.label_width, layout.label_height,
+                      lablabel_items(layout, code, counter, filename, qr_path))
 
-    lmar = 5
+
+def qrlabel_items(layout, code, img, counter, batch=None):
+    # x, y, width, height, path
     bc_edge = 0.75 * inch
+    top = layout.label_height
 
-    # place objects starting from the bottom
-    ypos = 5
-    label_drawing.add(String(x=lmar, y=ypos,
-                             text=filename,
-                             fontName="Helvetica", fontSize=8, textAnchor="start"))
+    return [
+        Image(0, 0, bc_edge, bc_edge, img, 'QR'),
+        Text(2, top - 14, URL, 'Helvetica-Bold', 11),
+        Text(bc_edge + 2, top - 30, 'Visit URL or scan QR code', font_size=10),
+        Text(bc_edge + 2, top - 42, 'Your retrieval code:', font_size=10),
+        Text(bc_edge + 2, top - 54, '-'.join(get_chunks(code, 4)), 'Helvetica-Bold', 10),
+        Text(bc_edge + 2, top - 64, f'Testing by Univ. of Washington  {counter}',
+             'Helvetica-Oblique', 7),
+    ]
 
-    label_drawing.add(String(x=layout.label_width - 5, y=ypos,
-                             text=f'{counter} v{VERSION}',
-                             fontName="Helvetica", fontSize=8, textAnchor="end"))
 
-    barcode = Image(x=0, y=12, width=bc_edge, height=bc_edge, path=qr_path)
-    label_drawing.add(barcode)
+def qrlabel(layout, code, img, counter, batch=None):
+    return to_drawing(layout.label_width, layout.label_height,
+                      qrlabel_items(layout, code, img, counter, batch))
 
-    label_drawing.add(String(x=bc_edge, y=18,
-                             text='or requisition (no name/DOB)',
-                             fontName="Helvetica",
-                             fontSize=8, textAnchor="start"))
-    label_drawing.add(String(x=bc_edge, y=28,
-                             text='<-- For specimen (write name/DOB)',
-                             fontName="Helvetica",
-                             fontSize=8, textAnchor="start"))
 
-    label_drawing.add(String(x=layout.label_width - 5, y=44,
-                             text='For individual being tested -->',
-                             fontName="Helvetica",
-                             fontSize=8, textAnchor="end"))
+def thermal_specimenlabel(layout, code, counter, language='zpl', dpi=203):
+    """Printer commands for the label drawn by specimenlabel()"""
 
-    label_drawing.add(String(x=bc_edge, y=58,
-                             text='This label may be discarded',
-                             fontName="Helvetica-Bold",
-                             fontSize=10, textAnchor="start"))
+    label = Label(layout.label_width, layout.label_height, language, dpi)
+    bc_width = 1.6 * inch
+    bc_height = 0.6 * inch
 
-    return label_drawing
+    label.text(layout.label_width - 5, 16, counter, font_size=6, anchor='end')
+    label.text(5, bc_height, 'DOB (MM/DD/YYYY): ____________________', font_size=8)
+    label.text(5, bc_height + 12, 'Name: ________________________________', font_size=8)
+    label.code128((layout.label_width - bc_width) / 2, -3, bc_width, bc_height,
+                  code, '-'.join(get_chunks(code, 4)))
+    return label
 
 
-def qrlabel(layout, code, img, counter, batch=None):
-    label_drawing = Drawing(layout.label_width, layout.label_height)
+def thermal_lablabel(layout, code, counter, filename, language='zpl', dpi=203):
+    """Printer commands for the label drawn by lablabel()"""
 
-    # x, y, width, height, path
+    label = Label(layout.label_width, layout.label_height, language, dpi)
+    lmar = 5
     bc_edge = 0.75 * inch
-    barcode = Image(0, 0, bc_edge, bc_edge, img)
-    label_drawing.add(barcode)
 
-    label_drawing.add(String(2, layout.label_height - 14,
-                             text=URL,
-                             fontName="Helvetica-Bold", fontSize=11, textAnchor="start"))
+    label.text(lmar, 5, filename, font_size=8)
+    label.text(layout.label_width - 5, 5, f'{counter} v{VERSION}', font_size=8, anchor='end')
+    label.qr(0, 12, bc_edge, filename)
+    label.text(bc_edge, 18, 'or requisition (no name/DOB)', font_size=8)
+    label.text(bc_edge, 28, '<-- For specimen (write name/DOB)', font_size=8)
+    label.text(layout.label_width - 5, 44, 'For individual being tested -->',
+               font_size=8, anchor='end')
+    label.text(bc_edge, 58, 'This label may be discarded', font_size=10,
+               font_name='Helvetica-Bold')
+    return label
 
-    label_drawing.add(String(bc_edge + 2, layout.label_height - 30,
-                             text='Visit URL or scan QR code',
-                             fontName="Helvetica", fontSize=10, textAnchor="start"))
 
-    label_drawing.add(String(bc_edge + 2, layout.label_height - 42,
-                             text='Your retrieval code:',
-                             fontName="Helvetica", fontSize=10, textAnchor="start"))
+def thermal_qrlabel(layout, code, counter, language='zpl', dpi=203):
+    """Printer commands for the label drawn by qrlabel()"""
 
-    label_drawing.add(String(bc_edge + 2, layout.label_height - 54,
-                             '-'.join(get_chunks(code, 4)),
-                             fontName="Helvetica-Bold",
-                             fontSize=10, textAnchor="start"))
-
-    label_drawing.add(String(bc_edge + 2, layout.label_height - 64,
-                             f'Testing by Univ. of Washington  {counter}',
-                             fontName="Helvetica-Oblique",
-                             fontSize=7, textAnchor="start"))
+    label = Label(layout.label_width, layout.label_height, language, dpi)
+    bc_edge = 0.75 * inch
+    top = layout.label_height
+
+    label.qr(0, 0, bc_edge, f'{URL}?code={code}')
+    label.text(2, top - 14, URL, font_size=11, font_name='Helvetica-Bold')
+    label.text(bc_edge + 2, top - 30, 'Visit URL or scan QR code', font_size=10)
+    label.text(bc_edge + 2, top - 42, 'Your retrieval code:', font_size=10)
+    label.text(bc_edge + 2, top - 54, '-'.join(get_chunks(code, 4)), font_size=10,
+               font_name='Helvetica-Bold')
+    label.text(bc_edge + 2, top - 64, f'Testing by Univ. of Washington  {counter}',
+               font_size=7, font_name='Helvetica-Oblique')
+    return label
+
+
+def fill_roll(fobj, layout, page_number, code_generator, filename='filename',
+              language='zpl', dpi=203):
+    """Write printer commands for the three labels in each row of one
+    page (see fill_sheet()) to `fobj`, from top to bottom, and return
+    the codes used (in the same order as fill_sheet()).
+
+    """
+
+    codes = [next(code_generator) for _ in range(layout.num_y)]
+    for label_number, code in enumerate(reversed(codes)):
+        counter = f'({page_number + 1}-{label_number + 1})'
+        fobj.write(str(thermal_specimenlabel(layout, code, counter, language, dpi)))
+        fobj.write(str(thermal_lablabel(layout, code, counter, filename, language, dpi)))
+        fobj.write(str(thermal_qrlabel(layout, code, counter, language, dpi)))
+    return codes
 
-    return label_drawing
 
+def fill_sheet(canvas, layout, page_number, code_generator, batch=None, filename='filename',
+               draft=False, images=None, labels=None, engine='writer'):
+    """Draw one page of labels (fewer if `code_generator` runs out) and
+    return the codes used. If `draft` is True, placeholders are drawn
+    instead of barcode images. Images are written to ImageCache
+    `images` if provided. If `labels` is provided, only rows with
+    these (1-based) label numbers are drawn, but a code is consumed
+    for every row. `engine` is one of CODE128_ENGINES.
 
-def fill_sheet(canvas, layout, page_number, code_generator, batch=None, filename='filename'):
+    """
 
-    codes = []
+    # labels are drawn starting at the bottom of the page
+    label_numbers = list(reversed(range(layout.num_y)))
+    codes = list(itertools.islice(code_generator, layout.num_y))
+    drawn = [not labels or label_number + 1 in labels for label_number in label_numbers]
+    get_barcode = get_code128_bars if engine == 'numpy' else get_code128
 
     with tempfile.TemporaryDirectory() as d:
+        images = images or ImageCache(d)
 
         # qr image for batch
-        filename_qr_path = path.join(d, 'filename_qr.png')
-        with open(filename_qr_path, 'wb') as f:
-            f.write(get_qr(filename))
-
-        ypos = layout.margin_bottom
-        for label_number in reversed(range(layout.num_y)):
-            code = next(code_generator)
-            codes.append(code)
-            counter = f'({page_number + 1}-{label_number + 1})'
-
-            # generate barcode images
-            code128_path = path.join(d, code) + '-code128.png'
-            with open(code128_path, 'wb') as f:
-                f.write(get_code128(code))
+        filename_qr_path = None if draft else images.path(get_qr, filename)
 
-            qr_path = path.join(d, code) + '-qr.png'
-            with open(qr_path, 'wb') as f:
-                f.write(get_qr(f'{URL}?code={code}', border=4))
+        # qr images for all codes on the page are generated together
+        urls = [f'{URL}?code={code}' for code, draw in zip(codes, drawn) if draw]
+        qr_paths = iter([None] * len(urls) if draft else images.paths(get_qrs, urls, border=4))
 
-            # first column
-            label1 = specimenlabel(layout, code, code128_path, counter, batch)
-            renderPDF.draw(label1, canvas, layout.margin_left, ypos)
+        rows = label_origins(layout)
+        for label_number, code, draw in zip(label_numbers, codes, drawn):
+            counter = f'({page_number + 1}-{label_number + 1})'
 
-            # second column
-            label2 = lablabel(layout, code, counter, filename, filename_qr_path)
-            renderPDF.draw(label2, canvas,
-                           layout.margin_left + layout.label_width + layout.hspace,
-                           ypos)
+            if not draw:
+                continue
 
-            # third column
-            label3 = qrlabel(layout, code, qr_path, counter, batch)
-            renderPDF.draw(label3, canvas,
-                           layout.margin_left + 2 * (layout.label_width + layout.hspace),
-                           ypos)
+            # generate barcode images
+            code128_path = None if draft else images.path(get_barcode, code)
+            qr_path = next(qr_paths)
 
-            ypos += layout.label_height + layout.vspace
+            col1, col2, col3 = rows[layout.num_y - label_number - 1]
+            draw_label(canvas, specimenlabel_items(
+                layout, code, code128_path, counter, batch, engine), *col1)
+            draw_label(canvas, lablabel_items(
+                layout, code, counter, filename, filename_qr_path), *col2)
+            draw_label(canvas, qrlabel_items(layout, code, qr_path, counter, batch), *col3)
 
     return codes
 
@@ -186,6 +224,8 @@ def build_parser(parser):
                         help='directory for output [%(default)s]')
     parser.add_argument('-n', '--npages', default=1, type=int, help='[default %(default)s]')
     parser.add_argument('-N', '--nfiles', default=1, type=int, help='[default %(default)s]')
+    parser.add_argument('--first-file', metavar='N', default=1, type=int,
+                        help='number of the first file [%(default)s]')
     parser.add_argument('-b', '--batch', default='',
                         help='batch identifier (placed on lab label)')
     parser.add_argument('--grid', help='draw grid',
@@ -199,13 +239,90 @@ def build_parser(parser):
                         help='fill sheets with a series of contrived codes')
     parser.add_argument('--fake-series-chars',
                         help='use these characters for the fake series')
+    parser.add_argument('--draft', action='store_true', default=False,
+                        help="""proof the layout using placeholders instead of
+                        barcode images (no csv log is written)""")
+    parser.add_argument('--draft-pages', metavar='N', type=int,
+                        help='render only the first N pages (implies --draft)')
+    parser.add_argument('--max-pages-per-file', metavar='N', type=int,
+                        help="""start a new output file and csv log after N pages;
+                        limits memory use for large values of --npages""")
+    parser.add_argument('--max-bytes-per-file', metavar='BYTES', type=int,
+                        help='start a new output file and csv log before exceeding BYTES')
+    parser.add_argument('--code128-engine', choices=CODE128_ENGINES, default='writer',
+                        help="""create Code 128 images using python-barcode's ImageWriter,
+                        or rasterize the bars using numpy and add the text to the pdf
+                        [%(default)s]""")
+    parser.add_argument('--format', choices=FORMATS, default='pdf',
+                        help="""output format; zpl and epl write commands for
+                        thermal label printers, one label at a time [%(default)s]""")
+    parser.add_argument('--dpi', type=int, default=203,
+                        help='printer resolution for zpl and epl output [%(default)s]')
+    parser.add_argument('--object-streams', action='store_true', default=False,
+                        help="""compress pdf objects into object streams with a
+                        cross-reference stream (requires pikepdf)""")
+    parser.add_argument('--linearize', action='store_true', default=False,
+                        help="""write linearized ("fast web view") pdf files so that
+                        the first page can be printed before the whole file is
+                        read (requires pikepdf)""")
+    parser.add_argument('--append', metavar='FILE',
+                        help="""add --npages pages to an existing threecol pdf file,
+                        continuing its page numbers and csv log; codes in the log
+                        are not reused""")
+    add_upload_arguments(parser)
+    parser.add_argument('--estimate', action='store_true', default=False,
+                        help="""render a small sample and report the estimated time,
+                        peak memory and size of the output for each Code 128 engine
+                        and number of worker processes (see the run command),
+                        without writing the output""")
+    add_progress_arguments(parser)
 
 
 def action(args):
     layout = layouts.threecol
-
-    outdir = Path(args.dirname)
-    outdir.mkdir(parents=True, exist_ok=True)
+    if args.draft_pages is not None and args.draft_pages < 1:
+        sys.exit('--draft-pages must be at least 1')
+
+    draft = args.draft or args.draft_pages is not None
+    npages = args.npages
+    if args.draft_pages is not None:
+        npages = min(npages, args.draft_pages)
+
+    if (args.object_streams or args.linearize) and pikepdf is None:
+        sys.exit('--object-streams and --linearize require pikepdf')
+
+    if args.estimate:
+        engines = CODE128_ENGINES
+        if draft or args.format != 'pdf':
+            engines = [args.code128_engine]
+        # unless all codes are the same, files are rendered by a single
+        # process (see the run command)
+        print(estimate('threecol', sample_action(action, args), npages=npages,
+                       nfiles=1 if args.append else args.nfiles,
+                       labels_per_page=layout.num_x * layout.num_y, engines=engines,
+                       selected=args.code128_engine, max_pages=args.max_pages_per_file,
+                       max_bytes=args.max_bytes_per_file, parallel=bool(args.fake_code)),
+              end='')
+        return
+
+    first_page, appended_codes = 0, set()
+    if args.append:
+        if args.format != 'pdf' or args.max_pages_per_file or args.max_bytes_per_file \
+           or args.object_streams or args.linearize:
+            sys.exit('--append cannot be used with --format, --max-*-per-file, '
+                     '--object-streams or --linearize')
+
+        try:
+            first_page = page_count(args.append)
+        except (OSError, ValueError) as err:
+            sys.exit(f'cannot append to {args.append}: {err}')
+
+        logfile = Path(args.append).with_suffix('.csv')
+        if not draft:
+            if not logfile.exists():
+                sys.exit(f'{logfile} is required to append to {args.append}')
+            with open(logfile) as f:
+                appended_codes = {row[-1] for row in csv.reader(f)}
 
     if args.fake_code:
         code_generator = itertools.repeat(args.fake_code)
@@ -216,23 +333,62 @@ def action(args):
             already_seen = {row[-1] for row in csv.reader(args.input_codes)}
             log.info(f'read {len(already_seen)} codes from {args.input_codes.name}')
         else:
-            already_seen = None
+            already_seen = set()
+        already_seen |= appended_codes
         code_generator = generate_codes(length=args.code_length, already_seen=already_seen)
 
-    for fileno in range(1, args.nfiles + 1):
-        outfile = outdir / args.outfile.format(
+    if args.append:
+        outfiles = [Path(args.append)]
+    else:
+        outdir = Path(args.dirname)
+        outdir.mkdir(parents=True, exist_ok=True)
+        outfiles = [outdir / args.outfile.format(
             batch=args.batch or '',
             fileno=fileno,
             npages=args.npages
-        )
-        print(outfile)
-
-        logfilename = str(outfile).replace('.pdf', '.csv')
-        with open(logfilename, 'w') as f:
-            writer = csv.writer(f)
-
-            canvas = Canvas(str(outfile), pagesize=layout.pagesize)
-            for page_number in range(args.npages):
+        ) for fileno in range(args.first_file, args.first_file + args.nfiles)]
+
+    try:
+        sink = get_sink(args.upload, endpoint_url=args.endpoint_url,
+                        workers=args.upload_workers)
+    except (ImportError, ValueError) as err:
+        sys.exit(str(err))
+
+    progress = Progress.from_args('threecol', args, total_pages=npages * len(outfiles))
+    with progress, sink:
+        for outfile in outfiles:
+            if args.format != 'pdf':
+                outfile = outfile.with_suffix('.' + args.format)
+                progress.file(outfile)
+                print(outfile)
+                with open(outfile, 'w') as f, open(outfile.with_suffix('.csv'), 'w') as logfile:
+                    writer = csv.writer(logfile)
+                    for page_number in range(npages):
+                        codes = fill_roll(f, layout, page_number, code_generator,
+                                          filename=outfile.name, language=args.format,
+                                          dpi=args.dpi)
+                        for code in codes:
+                            writer.writerow([outfile, page_number + 1, code])
+                        progress.page(layout.num_x * len(codes))
+                sink.put(outfile)
+                sink.put(outfile.with_suffix('.csv'))
+                continue
+
+            # files are split into parts if either limit is provided
+            output = RollingCanvas(outfile, pagesize=layout.pagesize,
+                                   max_pages=args.max_pages_per_file,
+                                   max_bytes=args.max_bytes_per_file,
+                                   csvlog=not draft,
+                                   object_streams=args.object_streams,
+                                   linearize=args.linearize,
+                                   append=bool(args.append),
+                                   sink=sink,
+                                   progress=progress)
+
+            for page_number in range(first_page, first_page + npages):
+                canvas = output.start_page()
+                if output.opened:
+                    print(output.path)
 
                 codes = fill_sheet(
                     canvas,
@@ -240,14 +396,20 @@ def action(args):
                     page_number=page_number,
                     code_generator=code_generator,
                     batch=args.batch,
-                    filename=str(outfile.name))
+                    filename=str(output.path.name),
+                    draft=draft,
+                    engine=args.code128_engine)
 
                 if args.grid:
                     draw_grid(canvas, layout=layout, include_vline=args.vline)
+                if draft:
+                    draw_label_bounds(canvas, layout=layout)
                 # starts a new page
-                canvas.showPage()
+                output.end_page()
 
-                for code in codes:
-                    writer.writerow([outfile, page_number + 1, code])
+                if output.writer:
+                    for code in codes:
+                        output.writer.writerow([output.path, page_number + 1, code])
+                progress.page(layout.num_x * len(codes))
 
-            canvas.save()
+            output.save()
@@ -6,19 +6,21 @@
 
 import logging
 import tempfile
-from os import path
 import datetime
 import argparse
 import sys
 from pathlib import Path
 
 from reportlab.lib.pagesizes import letter
-from reportlab.graphics.shapes import Drawing, String, Image
-from reportlab.graphics import renderPDF
 from reportlab.pdfgen.canvas import Canvas
 from reportlab.lib.units import inch
 
-from barcoder.utils import (get_chunks, get_code, get_qr, get_code128, hline, vline)
+from barcoder.estimate import estimate, sample_action
+from barcoder.progress import Progress, add_progress_arguments
+from barcoder.labels import Barcode, Image, Text, draw_label, to_drawing
+from barcoder.sinks import add_upload_arguments, get_sink
+from barcoder.utils import (get_chunks, get_code, get_qrs, get_code128, get_code128_bars,
+                            hline, vline, ImageCache, CODE128_ENGINES)
 
 log = logging.getLogger(__name__)
 
@@ -36,10 +38,7 @@ SHEET_TOP = (10 + 3 / 16) * inch
 VERSION = 3
 
 
-def lablabel(barcode_image, counter, batch):
-
-    label_drawing = Drawing(LABEL_WIDTH, LABEL_HEIGHT)
-
+def lablabel_items(barcode_image, counter, batch, code='', engine='writer'):
     bc_width, bc_height = 180, 60
     bc_top = bc_height - 8
 
@@ -47,111 +46,81 @@ def lablabel(barcode_image, counter, batch):
     tag = f'({counter})'
 
     # 0 is bottom
-
-    label_drawing.add(String(ralign, bc_top + 20,
-                             tag,
-                             fontName="Helvetica",
-                             fontSize=10, textAnchor="end"))
-
-
-    label_drawing.add(String(30, bc_top + 17,
-                             # 'Lab: scan into QRCODE if in battery;',
-                             'Lab: if order contains QRCODE scan there;',
-                             fontName="Helvetica",
-                             fontSize=10, textAnchor="start"))
-
-    label_drawing.add(String(30, bc_top + 5,
-                             # 'if not, use QRCOD (add order if necessary)',
-                             'if not, add QRCOD and scan result at prompt.',
-                             fontName="Helvetica",
-                             fontSize=10, textAnchor="start"))
-
-    # appears to right of barcode
-    label_drawing.add(String(bc_width + 30, 35,
-                             'Place on',
-                             fontName="Helvetica-Bold",
-                             fontSize=11, textAnchor="start"))
-
-    label_drawing.add(String(bc_width + 30, 20,
-                             'Lab Requisition',
-                             fontName="Helvetica-Bold",
-                             fontSize=11, textAnchor="start"))
-
-    # x, y, width, height, path
-    label_drawing.add(Image(20, -10, bc_width, bc_height, barcode_image))
-
-    label_drawing.add(String(ralign, 0,
-                             f'{batch} v{VERSION}',
-                             fontName="Helvetica",
-                             fontSize=8, textAnchor="end"))
-
-    return label_drawing
-
-
-def qrlabel(url, code, barcode_image, counter):
-
-    label_drawing = Drawing(LABEL_WIDTH, LABEL_HEIGHT)
-
+    return [
+        Text(ralign, bc_top + 20, tag, font_size=10, anchor='end'),
+        # 'Lab: scan into QRCODE if in battery;',
+        Text(30, bc_top + 17, 'Lab: if order contains QRCODE scan there;', font_size=10),
+        # 'if not, use QRCOD (add order if necessary)',
+        Text(30, bc_top + 5, 'if not, add QRCOD and scan result at prompt.', font_size=10),
+        # appears to right of barcode
+        Text(bc_width + 30, 35, 'Place on', 'Helvetica-Bold', 11),
+        Text(bc_width + 30, 20, 'Lab Requisition', 'Helvetica-Bold', 11),
+        # x, y, width, height, path
+        Barcode(20, -10, bc_width, bc_height, barcode_image, '-'.join(get_chunks(code, 4)),
+                engine),
+        Text(ralign, 0, f'{batch} v{VERSION}', anchor='end'),
+    ]
+
+
+def lablabel(barcode_image, counter, batch, code='', engine='writer'):
+    return to_drawing(LABEL_WIDTH, LABEL_HEIGHT,
+                      lablabel_items(barcode_image, counter, batch, code, engine))
+
+
+def qrlabel_items(url, code, barcode_image, counter):
     # position qr code on left of label
     # x, y, width, height, path
     bc_margin = 20
     bc_edge = LABEL_HEIGHT - bc_margin
-    barcode = Image(10, 0, bc_edge, bc_edge, barcode_image)
-    label_drawing.add(barcode)
-
     text_x = bc_edge + 10
 
-    label_drawing.add(String(text_x, 58, url,
-                             fontName="Helvetica", fontSize=14, textAnchor="start"))
+    return [
+        Image(10, 0, bc_edge, bc_edge, barcode_image, 'QR'),
+        Text(text_x, 58, url, font_size=14),
+        Text(text_x, 46, 'Visit address above or scan QR code', font_size=10),
+        Text(LABEL_WIDTH - 20, 46, f'({counter})', anchor='end'),
+        Text(text_x, 34, 'Your retrieval code:', font_size=10),
+        Text(text_x, 20, '-'.join(get_chunks(code, 4)), 'Helvetica-Bold', 13),
+        Text(text_x, 8, 'Testing performed by the University of Washington',
+             'Helvetica-Oblique', 9),
+    ]
 
-    label_drawing.add(String(text_x, 46,
-                             'Visit address above or scan QR code',
-                             fontName="Helvetica", fontSize=10, textAnchor="start"))
 
-    label_drawing.add(String(LABEL_WIDTH - 20, 46,
-                             f'({counter})',
-                             fontName="Helvetica", fontSize=8, textAnchor="end"))
+def qrlabel(url, code, barcode_image, counter):
+    return to_drawing(LABEL_WIDTH, LABEL_HEIGHT,
+                      qrlabel_items(url, code, barcode_image, counter))
 
-    label_drawing.add(String(text_x, 34,
-                             'Your retrieval code:',
-                             fontName="Helvetica", fontSize=10, textAnchor="start"))
 
-    label_drawing.add(String(text_x, 20,
-                             '-'.join(get_chunks(code, 4)),
-                             fontName="Helvetica-Bold",
-                             fontSize=13, textAnchor="start"))
+def fill_sheet(canvas, page_number, fake_code=None, batch=None, draft=False, images=None,
+               engine='writer', codes=None):
+    """Draw one page of labels and return the codes used. Unless a
+    list of `codes` is provided, codes are generated.
 
-    label_drawing.add(String(text_x, 8,
-                             'Testing performed by the University of Washington',
-                             fontName="Helvetica-Oblique",
-                             fontSize=9, textAnchor="start"))
+    """
 
-    return label_drawing
+    if codes is None:
+        codes = [fake_code or get_code(length=16) for _ in range(NUM_LABELS_Y)]
+    get_barcode = get_code128_bars if engine == 'numpy' else get_code128
 
+    with tempfile.TemporaryDirectory() as d:
+        images = images or ImageCache(d)
 
-def fill_sheet(canvas, page_number, fake_code=None, batch=None):
+        # qr images for all codes on the page are generated together
+        urls = [f'{URL}?code={code}' for code in codes]
+        qr_paths = [None] * len(urls) if draft else images.paths(get_qrs, urls)
 
-    with tempfile.TemporaryDirectory() as d:
-        for label_number in range(NUM_LABELS_Y):
+        for label_number, code in enumerate(codes):
             counter = f'{page_number + 1}-{label_number + 1}'
-            code = fake_code or get_code(length=16)
 
             y = SHEET_TOP - LABEL_HEIGHT - label_number * LABEL_HEIGHT
 
-            pth1 = path.join(d, code) + '-code128.png'
-            with open(pth1, 'wb') as f:
-                # Sunquest expects a semicolon before the payload
-                f.write(get_code128(code, add_semicolon=True))
-            label1 = lablabel(pth1, counter, batch)
+            # Sunquest expects a semicolon before the payload
+            pth1 = None if draft else images.path(get_barcode, code, add_semicolon=True)
+            draw_label(canvas, lablabel_items(pth1, counter, batch, code, engine), 0, y)
+            draw_label(canvas, qrlabel_items(URL, code, qr_paths[label_number], counter),
+                       LABEL_WIDTH, y)
 
-            renderPDF.draw(label1, canvas, 0, y)
-
-            pth2 = path.join(d, code) + '-qr.png'
-            with open(pth2, 'wb') as f:
-                f.write(get_qr(f'{URL}?code={code}'))
-            label2 = qrlabel(URL, code, pth2, counter)
-
-            renderPDF.draw(label2, canvas, LABEL_WIDTH, y)
+    return codes
 
 
 def hline(p, y):
@@ -199,32 +168,76 @@ def build_parser(parser):
                         help='directory for output [%(default)s]')
     parser.add_argument('-n', '--npages', default=1, type=int)
     parser.add_argument('-N', '--nfiles', default=1, type=int)
+    parser.add_argument('--first-file', metavar='N', default=1, type=int,
+                        help='number of the first file [%(default)s]')
     parser.add_argument('-b', '--batch', help='batch identifier (placed on lab label)')
     parser.add_argument('--vline', help='draw vertical line',
                         action='store_true', default=False)
     parser.add_argument('--fake-code', help='fill sheet with this fake code')
+    parser.add_argument('--draft', action='store_true', default=False,
+                        help='proof the layout using placeholders instead of barcode images')
+    parser.add_argument('--draft-pages', metavar='N', type=int,
+                        help='render only the first N pages (implies --draft)')
+    parser.add_argument('--code128-engine', choices=CODE128_ENGINES, default='writer',
+                        help="""create Code 128 images using python-barcode's ImageWriter,
+                        or rasterize the bars using numpy and add the text to the pdf
+                        [%(default)s]""")
+    add_upload_arguments(parser)
+    parser.add_argument('--estimate', action='store_true', default=False,
+                        help="""render a small sample and report the estimated time,
+                        peak memory and size of the output for each Code 128 engine
+                        and number of worker processes (see the run command),
+                        without writing the output""")
+    add_progress_arguments(parser)
 
 
 def action(args):
+    if args.draft_pages is not None and args.draft_pages < 1:
+        sys.exit('--draft-pages must be at least 1')
+
+    draft = args.draft or args.draft_pages is not None
+    npages = args.npages
+    if args.draft_pages is not None:
+        npages = min(npages, args.draft_pages)
+
+    if args.estimate:
+        engines = [args.code128_engine] if draft else CODE128_ENGINES
+        print(estimate('twocol', sample_action(action, args), npages=npages,
+                       nfiles=args.nfiles, labels_per_page=NUM_LABELS_X * NUM_LABELS_Y,
+                       engines=engines, selected=args.code128_engine),
+              end='')
+        return
+
     outdir = Path(args.dirname)
     outdir.mkdir(parents=True, exist_ok=True)
 
-    for fileno in range(1, args.nfiles + 1):
-        outfile = outdir / args.outfile.format(
-            batch=args.batch or '',
-            fileno=fileno,
-            npages=args.npages
-        )
-
-        print(outfile)
-
-        canvas = Canvas(str(outfile), pagesize=PAGESIZE)
-        for page_number in range(args.npages):
-            fill_sheet(canvas, page_number=page_number,
-                       fake_code=args.fake_code, batch=args.batch)
-            draw_grid(canvas, include_vline=args.vline)
-            # starts a new page
-            canvas.showPage()
-
-        canvas.save()
-
+    try:
+        sink = get_sink(args.upload, endpoint_url=args.endpoint_url,
+                        workers=args.upload_workers)
+    except (ImportError, ValueError) as err:
+        sys.exit(str(err))
+
+    progress = Progress.from_args('twocol', args, total_pages=npages * args.nfiles)
+    with progress, sink:
+        for fileno in range(args.first_file, args.first_file + args.nfiles):
+            outfile = outdir / args.outfile.format(
+                batch=args.batch or '',
+                fileno=fileno,
+                npages=args.npages
+            )
+
+            progress.file(outfile)
+            print(outfile)
+
+            canvas = Canvas(str(outfile), pagesize=PAGESIZE)
+            for page_number in range(npages):
+                fill_sheet(canvas, page_number=page_number,
+                           fake_code=args.fake_code, batch=args.batch, draft=draft,
+                           engine=args.code128_engine)
+                draw_grid(canvas, include_vline=args.vline or draft)
+                # starts a new page
+                canvas.showPage()
+                progress.page(NUM_LABELS_X * NUM_LABELS_Y)
+
+            canvas.save()
+            sink.put(outfile)
@@ -0,0 +1,159 @@
+"""Random access to the rows of large csv files
+
+The byte offset of each row of a csv file is stored in a sidecar file
+(`<name>.idx`) created in a single streaming pass, so that a range of
+rows can be read by seeking directly to the first of them. Rows are
+found by csv.reader itself, so they are the same as those of a full
+read. The sidecar records the size and modification time of the csv
+file and is rebuilt when either changes. Files are read as ENCODING.
+"""
+
+import csv
+import io
+import logging
+import os
+import struct
+from array import array
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'BCIDX2'
+
+ENCODING = 'utf-8'
+
+# magic, size and modification time (ns) of the csv file
+HEADER = struct.Struct('<6sQQ')
+
+# offsets are unsigned 64-bit integers
+OFFSET = struct.Struct('<Q')
+
+
+def index_path(path):
+    return Path(f'{path}.idx')
+
+
+def row_offsets(f):
+    """Yield the byte offset of the start of each row (including the
+    header) read by csv.reader from text file object `f` (opened with
+    newline='' and ENCODING). Empty rows after the header are skipped
+    as by csv.DictReader.
+
+    """
+
+    # csv.reader reads only the lines of each row before returning it
+    sizes = []
+
+    def lines():
+        for line in f:
+            sizes.append(len(line.encode(ENCODING)))
+            yield line
+
+    offset = 0
+    for row in csv.reader(lines()):
+        if row or offset == 0:
+            yield offset
+        offset += sum(sizes)
+        sizes.clear()
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def build_index(path):
+    """Write the index for csv file `path` and return the number of
+    rows (including the header).
+
+    """
+
+    size, mtime = _stat(path)
+    tmp = f'{index_path(path)}.{os.getpid()}.tmp'
+    nrows = 0
+    with open(path, newline='', encoding=ENCODING) as f, open(tmp, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, size, mtime))
+        offsets = array('Q')
+        for offset in row_offsets(f):
+            offsets.append(offset)
+            if len(offsets) == 1 << 16:
+                nrows += len(offsets)
+                offsets.tofile(out)
+                offsets = array('Q')
+        nrows += len(offsets)
+        offsets.tofile(out)
+    os.replace(tmp, index_path(path))
+
+    log.info(f'indexed {nrows} rows of {path}')
+    return nrows
+
+
+class IndexedCSV:
+    """Rows of csv file `path` as dicts (as returned by csv.DictReader)
+    supporting len(), iteration, and indexing or slicing without
+    reading the preceding rows. The index is built if it is missing
+    or out of date.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = _stat(path)[0]
+
+        pth = index_path(path)
+        current = False
+        if pth.exists():
+            with open(pth, 'rb') as f:
+                magic, size, mtime = HEADER.unpack(f.read(HEADER.size))
+            current = magic == MAGIC and (size, mtime) == _stat(path)
+        if not current:
+            build_index(path)
+
+        self.nrows = (os.path.getsize(pth) - HEADER.size) // OFFSET.size
+        with open(path, newline='', encoding=ENCODING) as f:
+            self.fieldnames = csv.DictReader(f).fieldnames or []
+
+    def __len__(self):
+        return max(self.nrows - 1, 0)
+
+    def _offset(self, f, row):
+        # offset of `row` (0 is the header), or the end of the file
+        if row >= self.nrows:
+            return self.size
+        f.seek(HEADER.size + row * OFFSET.size)
+        return OFFSET.unpack(f.read(OFFSET.size))[0]
+
+    def rows(self, start, stop):
+        """Return a list of rows `start` to `stop` (0 is the first row
+        after the header).
+
+        """
+
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return []
+
+        with open(index_path(self.path), 'rb') as f:
+            begin, end = self._offset(f, start + 1), self._offset(f, stop + 1)
+
+        with open(self.path, 'rb') as f:
+            f.seek(begin)
+            text = f.read(end - begin).decode(ENCODING)
+        return list(csv.DictReader(io.StringIO(text, newline=''), fieldnames=self.fieldnames))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('slices of rows must be contiguous')
+            return self.rows(start, stop)
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('row index out of range')
+        return self.rows(index, index + 1)[0]
+
+    def __iter__(self):
+        with open(self.path, newline='', encoding=ENCODING) as f:
+            yield from csv.DictReader(f)
@@ -0,0 +1,234 @@
+"""Generating large numbers of unique codes with bounded memory
+
+Codes created by utils.get_code() consist of characters in
+ALPHANUM_CHARS followed by a check character, so the characters
+before the check character can be packed into an integer in base 31.
+Integers are stored as fixed-width big-endian bytes so that sorting
+the bytes sorts the integers. Codes are written to disk in sorted
+runs of at most `run_size` codes, then merged (in several passes if
+there are more than MAX_OPEN_FILES runs); duplicates are detected as
+adjacent records during the merge, and replaced by generating more
+codes. The sorted codes are then shuffled (so that consecutive codes
+are unrelated) by distributing them at random among at most
+MAX_OPEN_FILES files, and again among the files that are still too
+large to be shuffled in memory.
+"""
+
+import hashlib
+import heapq
+import logging
+import math
+import os
+import random
+import secrets
+import tempfile
+from itertools import count as counter, product
+
+from barcoder.utils import ALPHANUM_CHARS, NUM_CHARS
+
+log = logging.getLogger(__name__)
+
+BASE = len(ALPHANUM_CHARS)
+INDEX = {c: i for i, c in enumerate(ALPHANUM_CHARS)}
+
+# strings for all combinations of three characters, for decoding
+TRIPLES = [''.join(chars) for chars in product(ALPHANUM_CHARS, repeat=3)]
+
+# number of records read or written at a time
+CHUNK_SIZE = 1 << 16
+
+# maximum number of runs merged, or files written while shuffling, at
+# once (each file being read or written is open)
+MAX_OPEN_FILES = 64
+
+_random = random.SystemRandom()
+
+
+def record_width(length):
+    """Return the number of bytes needed to store a packed code of
+    `length` characters (including the check character).
+
+    """
+
+    return math.ceil((length - 1) * math.log2(BASE) / 8)
+
+
+def check_char(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()[0].upper()
+
+
+def pack(code):
+    """Return the characters of `code` before the check character as an
+    integer.
+
+    """
+
+    value = 0
+    for c in code[:-1]:
+        value = value * BASE + INDEX[c]
+    return value
+
+
+def unpack(value, length):
+    """Inverse of pack(), recomputing the check character"""
+
+    nchars = length - 1
+    parts = []
+    for _ in range(math.ceil(nchars / 3)):
+        value, triple = divmod(value, BASE ** 3)
+        parts.append(TRIPLES[triple])
+    text = ''.join(reversed(parts))[-nchars:]
+    return text + check_char(text)
+
+
+def random_values(length, number):
+    """Return a list of `number` packed random codes with the same
+    distribution as utils.get_code(): the first character is in
+    NUM_CHARS, the rest in ALPHANUM_CHARS.
+
+    """
+
+    first = [INDEX[c] for c in NUM_CHARS]
+    scale = BASE ** (length - 2)
+    return [secrets.choice(first) * scale + secrets.randbelow(scale) for _ in range(number)]
+
+
+def write_run(pth, records):
+    """Write an iterable of byte strings `records` to file `pth` and
+    return the number of records written.
+
+    """
+
+    count = 0
+    with open(pth, 'wb') as f:
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == CHUNK_SIZE:
+                f.write(b''.join(chunk))
+                count += len(chunk)
+                chunk = []
+        f.write(b''.join(chunk))
+        count += len(chunk)
+    return count
+
+
+def read_run(pth, width):
+    """Yield records of `width` bytes from file `pth`."""
+
+    with open(pth, 'rb') as f:
+        while True:
+            buf = f.read(width * CHUNK_SIZE)
+            if not buf:
+                break
+            for i in range(0, len(buf), width):
+                yield buf[i:i + width]
+
+
+def merge_unique(pths, length, stop_if_seen=False):
+    """Yield the unique records in the sorted runs `pths`, in sorted
+    order. Duplicates are logged, or raise ValueError if
+    `stop_if_seen` is True.
+
+    """
+
+    width = record_width(length)
+    previous = None
+    for record in heapq.merge(*[read_run(pth, width) for pth in pths]):
+        if record == previous:
+            code = unpack(int.from_bytes(record, 'big'), length)
+            msg = f'code {code} has already been seen'
+            log.warning(msg)
+            if stop_if_seen:
+                raise ValueError(msg)
+            continue
+        previous = record
+        yield record
+
+
+def merge_runs(pths, length, names, stop_if_seen=False):
+    """Merge the sorted runs `pths` (which are removed) into a single
+    run named by iterator `names` using merge_unique(), at most
+    MAX_OPEN_FILES runs at a time. Return the name of the merged run
+    and the number of records in it.
+
+    """
+
+    while True:
+        merged = []
+        for i in range(0, len(pths), MAX_OPEN_FILES):
+            group = pths[i:i + MAX_OPEN_FILES]
+            merged.append(next(names))
+            count = write_run(merged[-1], merge_unique(group, length, stop_if_seen))
+            for pth in group:
+                os.remove(pth)
+        if len(merged) == 1:
+            return merged[0], count
+        log.info(f'merged {len(pths)} runs into {len(merged)}')
+        pths = merged
+
+
+def shuffle_run(pth, width, run_size, names):
+    """Yield the records of `width` bytes in file `pth` (which is
+    removed) in random order, keeping about `run_size` records in
+    memory. Records in a larger file are distributed at random among
+    files (named by iterator `names`) of about half of `run_size`
+    records on average, or among MAX_OPEN_FILES files if that would
+    require more, each of which is then shuffled in turn.
+
+    """
+
+    nrecords = os.path.getsize(pth) // width
+    if nrecords <= run_size:
+        records = list(read_run(pth, width))
+        os.remove(pth)
+        _random.shuffle(records)
+        yield from records
+        return
+
+    nbuckets = min(math.ceil(2 * nrecords / run_size), MAX_OPEN_FILES)
+    buckets = [next(names) for _ in range(nbuckets)]
+    files = [open(bucket, 'wb') for bucket in buckets]
+    try:
+        for record in read_run(pth, width):
+            files[_random.randrange(nbuckets)].write(record)
+    finally:
+        for f in files:
+            f.close()
+    os.remove(pth)
+
+    for bucket in buckets:
+        yield from shuffle_run(bucket, width, run_size, names)
+
+
+def generate_unique_codes(length, number, run_size=1000000, tmpdir=None, stop_if_seen=False):
+    """Yield `number` unique random codes (see utils.get_code()) in
+    random order, keeping about `run_size` codes in memory.
+    Temporary files are written to `tmpdir`.
+
+    """
+
+    width = record_width(length)
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as d:
+        names = (os.path.join(d, f'run{i:06d}') for i in counter())
+        runs, count = [], 0
+        while count < number:
+            # write sorted runs for the codes still needed
+            remaining = number - count
+            while remaining:
+                size = min(run_size, remaining)
+                records = sorted(value.to_bytes(width, 'big')
+                                 for value in random_values(length, size))
+                runs.append(next(names))
+                write_run(runs[-1], records)
+                remaining -= size
+                log.info(f'wrote {len(runs)} runs')
+
+            # merge all runs into one, removing duplicates
+            merged, count = merge_runs(runs, length, names, stop_if_seen)
+            runs = [merged]
+
+        for pth in runs:
+            for record in shuffle_run(pth, width, run_size, names):
+                yield unpack(int.from_bytes(record, 'big'), length)
@@ -0,0 +1,166 @@
+"""Estimating the cost of large runs
+
+estimate() renders small samples of a run using the same code as the
+full run (label drawing, image generation and saving the output) and
+extrapolates the elapsed time, peak memory and size of the output.
+Each sample is rendered with one page and with 1 + SAMPLE_PAGES
+pages, so that the cost of each page can be separated from the fixed
+cost of each output file. Memory is measured using tracemalloc in
+separate runs of the same samples (which also ensures that one-time
+costs such as loading fonts are not attributed to the run), and the
+resident size of the process is added to the result.
+"""
+
+import argparse
+import io
+import math
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from barcoder import symbols
+from barcoder.progress import format_duration, rss
+
+# number of pages in addition to the first in each sample
+SAMPLE_PAGES = 3
+
+# fixed cost of each output file and cost of each page
+Cost = namedtuple('Cost', ['seconds', 'nbytes', 'memory'])
+
+
+def format_bytes(nbytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if nbytes < 1024 or unit == 'GB':
+            break
+        nbytes /= 1024
+    return f'{nbytes:.0f} {unit}' if unit == 'B' else f'{nbytes:.1f} {unit}'
+
+
+def measure(render, npages, engine, trace=False):
+    """Return (seconds, bytes, memory) for `render(npages, dirname,
+    engine)`, which writes files to `dirname`. Memory (the peak size
+    of allocations traced by tracemalloc) is measured only if `trace`
+    is True, which slows rendering.
+
+    """
+
+    # encoded symbols would otherwise be reused from previous samples
+    symbols.clear_cache()
+
+    with tempfile.TemporaryDirectory() as dirname:
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        render(npages, dirname, engine)
+        seconds = time.perf_counter() - start
+        memory = 0
+        if trace:
+            memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        nbytes = sum(pth.stat().st_size for pth in Path(dirname).rglob('*') if pth.is_file())
+    return seconds, nbytes, memory
+
+
+def calibrate(render, engine, sample_pages=SAMPLE_PAGES):
+    """Return a Cost for each output file and for each page."""
+
+    _, _, mem_first = measure(render, 1, engine, trace=True)
+    _, _, mem_more = measure(render, 1 + sample_pages, engine, trace=True)
+    secs_first, bytes_first, _ = measure(render, 1, engine)
+    secs_more, bytes_more, _ = measure(render, 1 + sample_pages, engine)
+
+    page = Cost(max(secs_more - secs_first, 0) / sample_pages,
+                max(bytes_more - bytes_first, 0) / sample_pages,
+                max(mem_more - mem_first, 0) / sample_pages)
+    fixed = Cost(max(secs_first - page.seconds, 0),
+                 max(bytes_first - page.nbytes, 0),
+                 max(mem_first - page.memory, 0))
+    return fixed, page
+
+
+def job_counts(ntasks):
+    """Return numbers of worker processes to report (starting with 1)
+    for `ntasks` tasks, up to the number of cpus.
+
+    """
+
+    limit = max(min(os.cpu_count() or 1, ntasks), 1)
+    counts = {limit}
+    counts.update(n for n in (2 ** i for i in range(8)) if n < limit)
+    return sorted(counts)
+
+
+def estimate(command, render, npages, nfiles=1, labels_per_page=None, engines=('writer',),
+             selected='writer', max_pages=None, max_bytes=None, parallel=True,
+             sample_pages=SAMPLE_PAGES):
+    """Return a report estimating the cost of writing `nfiles` files of
+    `npages` pages using each of `engines` (the engine of the run is
+    `selected`); see sample_action() for `render`. `max_pages` and
+    `max_bytes` limit the size of each part of a file as for
+    output.RollingCanvas. If `parallel` is True, files can be
+    rendered by separate worker processes (see the run command).
+
+    """
+
+    base = rss()
+    total = npages * nfiles
+    labels = f', {total * labels_per_page} labels' if labels_per_page else ''
+    lines = [f'{command}: {nfiles} file{"s" if nfiles != 1 else ""} of {npages} pages '
+             f'({total} pages{labels}); sampled 1 and {1 + sample_pages} pages', '']
+
+    for engine in engines:
+        fixed, page = calibrate(render, engine, sample_pages)
+
+        part_pages = min(npages, max_pages or npages)
+        if max_bytes and page.nbytes:
+            part_pages = min(part_pages, max(1, int((max_bytes - fixed.nbytes) // page.nbytes)))
+        parts = math.ceil(npages / part_pages) if npages else 0
+
+        file_seconds = parts * fixed.seconds + npages * page.seconds
+        nbytes = nfiles * (parts * fixed.nbytes + npages * page.nbytes)
+        memory = base + fixed.memory + part_pages * page.memory
+
+        current = ' (selected)' if engine == selected and len(engines) > 1 else ''
+        lines.append(f'engine {engine}{current}: {page.seconds:.3f} s/page, '
+                     f'{format_bytes(page.nbytes)}/page')
+        lines.append(f'  output {format_bytes(nbytes)}; one process: '
+                     f'{format_duration(nfiles * file_seconds)}, '
+                     f'peak memory {format_bytes(memory)}')
+
+        # each worker process writes whole files
+        if parallel:
+            for jobs in job_counts(nfiles)[1:]:
+                seconds = math.ceil(nfiles / jobs) * file_seconds
+                lines.append(f'  run --jobs {jobs}: {format_duration(seconds)}, '
+                             f'peak memory {format_bytes(jobs * memory)}')
+        lines.append('')
+
+    return '\n'.join(lines).rstrip() + '\n'
+
+
+def sample_action(action, args, **options):
+    """Return a function render(npages, dirname, engine) that runs
+    `action` (the action() of a command) with a copy of `args` to
+    write a single file of `npages` pages to `dirname` using Code 128
+    engine `engine`. Output options that don't apply to a sample (eg,
+    uploads and progress) are disabled; `options` override other
+    arguments.
+
+    """
+
+    def render(npages, dirname, engine):
+        sample = argparse.Namespace(**vars(args))
+        vars(sample).update(
+            npages=npages, nfiles=1, dirname=dirname, code128_engine=engine,
+            draft=args.draft or args.draft_pages is not None, draft_pages=None,
+            max_pages_per_file=None, max_bytes_per_file=None, append=None, upload=None,
+            progress=False, metrics=None, estimate=False)
+        vars(sample).update(options)
+        with io.StringIO() as f, redirect_stdout(f):
+            action(sample)
+
+    return render
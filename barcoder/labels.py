@@ -0,0 +1,218 @@
+"""Lightweight descriptions of labels
+
+A label is described by a list of Text, Image and Barcode items in
+label coordinates (points, with the origin at the bottom left of the
+label). draw_label() draws the items directly on a canvas, which
+avoids building a reportlab Drawing and walking it with renderPDF for
+every label; to_drawing() creates the equivalent Drawing. Labels
+printed more than once can be drawn once as a form (see
+label_form()) and placed as many times as needed.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from reportlab.graphics.shapes import Drawing, String
+from reportlab.lib.rl_accel import fp_str
+from reportlab.pdfbase.pdfutils import cacheImageFile
+
+from barcoder import code128
+from barcoder.utils import code128_image, image_aspect, image_or_placeholder
+
+Text = namedtuple('Text', ['x', 'y', 'text', 'font_name', 'font_size', 'anchor'])
+Text.__new__.__defaults__ = ('Helvetica', 8, 'start')
+
+# an image file (`img`), or a placeholder labeled with `text` if img is None
+Image = namedtuple('Image', ['x', 'y', 'width', 'height', 'img', 'text'])
+Image.__new__.__defaults__ = ('',)
+
+# a Code 128 image created by `engine` (see utils.code128_image())
+Barcode = namedtuple('Barcode', ['x', 'y', 'width', 'height', 'img', 'text', 'engine'])
+Barcode.__new__.__defaults__ = ('writer',)
+
+# total size of the encoded images kept by inline_image()
+INLINE_CACHE_BYTES = 8 * 1024 * 1024
+
+_inline_cache = OrderedDict()
+_inline_bytes = 0
+_inline_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def label_origins(layout):
+    """Return a list with an element for each row of labels in `layout`
+    starting at the bottom of the page, each a list of the (x, y)
+    coordinates of the labels in the row from left to right.
+
+    """
+
+    return [[(layout.margin_left + i * (layout.label_width + layout.hspace),
+              layout.margin_bottom + j * (layout.label_height + layout.vspace))
+             for i in range(layout.num_x)]
+            for j in range(layout.num_y)]
+
+
+def inline_image(img):
+    """Return pdf code for the image file `img` as an inline image.
+    Files are expected not to change (as in an ImageCache), so the
+    encoded data of the most recently used images (up to
+    INLINE_CACHE_BYTES in total) is reused for each label.
+
+    """
+
+    global _inline_bytes
+
+    with _inline_lock:
+        code = _inline_cache.get(img)
+        if code is not None:
+            _inline_cache.move_to_end(img)
+            return code
+
+    code = '\n'.join(cacheImageFile(img, returnInMemory=1))
+
+    with _inline_lock:
+        if img not in _inline_cache:
+            _inline_cache[img] = code
+            _inline_bytes += len(code)
+        while _inline_bytes > INLINE_CACHE_BYTES and len(_inline_cache) > 1:
+            _inline_bytes -= len(_inline_cache.popitem(last=False)[1])
+    return code
+
+
+def to_drawing(width, height, items):
+    """Return a Drawing with the given dimensions containing `items`."""
+
+    drawing = Drawing(width, height)
+    for item in items:
+        if isinstance(item, Text):
+            drawing.add(String(item.x, item.y, item.text, fontName=item.font_name,
+                               fontSize=item.font_size, textAnchor=item.anchor))
+        elif isinstance(item, Barcode):
+            drawing.add(code128_image(*item))
+        else:
+            drawing.add(image_or_placeholder(*item))
+    return drawing
+
+
+def _draw_string(canvas, x, y, text, font_name, font_size, anchor, font=None):
+    """Draw `text`, setting the font unless it is `font` (the font
+    name and size set by a previous call in the same graphics state),
+    and return the font name and size.
+
+    """
+
+    if font != (font_name, font_size):
+        canvas.setFont(font_name, font_size)
+
+    if anchor == 'middle':
+        canvas.drawCentredString(x, y, text)
+    elif anchor == 'end':
+        canvas.drawRightString(x, y, text)
+    else:
+        canvas.drawString(x, y, text)
+    return font_name, font_size
+
+
+def _draw_placeholder(canvas, x, y, width, height, text):
+    canvas.saveState()
+    canvas.setLineWidth(0.5)
+    canvas.rect(x, y, width, height, stroke=1, fill=0)
+    _draw_string(canvas, x + width / 2, y + height / 2 - 2, text, 'Helvetica', 6, 'middle')
+    canvas.restoreState()
+
+
+def _draw_barcode_text(canvas, x, y, width, height, text, aspect):
+    # text for images without it (see code128.text_position())
+    text_x, text_y, font_size, hscale = code128.text_position(x, y, width, height, aspect)
+    canvas.saveState()
+    canvas.translate(text_x, text_y)
+    canvas.scale(hscale, 1)
+    _draw_string(canvas, 0, 0, text, code128.FONT_NAME, font_size, 'middle')
+    canvas.restoreState()
+
+
+def draw_label(canvas, items, x=0, y=0, raster=None):
+    """Draw `items` on `canvas` for a label with its bottom left corner
+    at (x, y). The graphics state of the canvas is restored afterward.
+    If a raster.PageRaster `raster` is provided, the bars of Barcode
+    items are drawn in the raster instead (the payload is the text
+    without dashes) and the text is drawn on the canvas.
+
+    """
+
+    canvas.saveState()
+    font = None
+    for item in items:
+        if isinstance(item, Text):
+            if item.text:
+                font = _draw_string(canvas, x + item.x, y + item.y, item.text,
+                                    item.font_name, item.font_size, item.anchor, font)
+            continue
+
+        left, bottom = x + item.x, y + item.y
+        if isinstance(item, Barcode) and raster is not None:
+            aspect = raster.code128(left, bottom, item.width, item.height,
+                                    item.text.replace('-', ''))
+            _draw_barcode_text(canvas, left, bottom, item.width, item.height, item.text,
+                               aspect)
+            continue
+
+        if item.img is None:
+            _draw_placeholder(canvas, left, bottom, item.width, item.height, item.text)
+            continue
+
+        # equivalent to canvas.drawInlineImage() (as used by renderPDF);
+        # inline images keep the page streams compressed
+        canvas.addLiteral(f'q {fp_str(item.width)} 0 0 {fp_str(item.height, left, bottom)} cm\n'
+                          f'{inline_image(item.img)}\nQ')
+
+        # images created by the numpy engine have no text
+        if isinstance(item, Barcode) and item.engine == 'numpy':
+            _draw_barcode_text(canvas, left, bottom, item.width, item.height, item.text,
+                               image_aspect(item.img))
+    canvas.restoreState()
+
+
+def form_name(*key):
+    """Return a name for the form of a label identified by `key` (eg,
+    its code and the options used to draw it).
+
+    """
+
+    return 'label' + hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+
+
+def has_form(canvas, name):
+    return canvas.hasForm(name)
+
+
+def label_form(canvas, name, items, pagesize):
+    """Add a form XObject `name` to the document of `canvas` with
+    `items` drawn by draw_label() for a label at the origin of a page
+    of size `pagesize`. The current page is not affected.
+
+    """
+
+    # items may extend beyond the label, so the bounding box (which
+    # clips the form) includes any part of the page
+    width, height = pagesize
+
+    # the form is drawn in a separate content stream starting from the
+    # initial graphics state, and the page is restored afterward
+    canvas.beginForm(name, -width, -height, width, height)
+    draw_label(canvas, items)
+    canvas.endForm()
+
+
+def draw_form(canvas, name, x=0, y=0):
+    """Draw form `name` (see label_form()) for a label with its bottom
+    left corner at (x, y).
+
+    """
+
+    canvas.saveState()
+    canvas.translate(x, y)
+    canvas.doForm(name)
+    canvas.restoreState()
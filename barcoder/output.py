@@ -0,0 +1,225 @@
+"""Writing pdf output, optionally split across several files.
+"""
+
+import csv
+import io
+import logging
+import os
+import zlib
+from pathlib import Path
+
+from reportlab import rl_config
+from reportlab.pdfgen.canvas import Canvas
+
+from barcoder.append import append_pages
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+log = logging.getLogger(__name__)
+
+# bytes of a pdf file other than its pages and XObjects (catalog,
+# fonts, info and trailer), and of each page, form or image other than
+# its stream data (dictionaries and cross-reference entries)
+FILE_OVERHEAD = 4096
+OBJECT_OVERHEAD = 512
+
+
+def part_name(outfile, part):
+    """Return the name of file number `part` of a series of files
+    derived from `outfile` (eg, 'labels.pdf' -> 'labels-part02.pdf').
+
+    """
+
+    outfile = Path(outfile)
+    return outfile.with_name(f'{outfile.stem}-part{part:02d}{outfile.suffix}')
+
+
+def optimize_pdf(path, object_streams=True, linearize=False):
+    """Rewrite the pdf file `path` using pikepdf. If `object_streams` is
+    True, objects are compressed into object streams and the
+    cross-reference table is written as a compressed stream; if
+    `linearize` is True, the file is linearized ("fast web view") so
+    that the first page can be read before the rest of the file.
+
+    """
+
+    if pikepdf is None:
+        raise ImportError('pikepdf is required to optimize pdf files')
+
+    path = Path(path)
+    mode = pikepdf.ObjectStreamMode.generate if object_streams else \
+        pikepdf.ObjectStreamMode.preserve
+    tmp = path.with_name(f'.{path.name}.tmp')
+    with pikepdf.open(path) as pdf:
+        pdf.save(tmp, object_stream_mode=mode, linearize=linearize)
+    os.replace(tmp, path)
+
+
+def stream_size(content):
+    """Return the size of the content stream `content` (bytes) as
+    written by reportlab: compressed, then ASCII85 encoded unless
+    rl_config.useA85 is false.
+
+    """
+
+    size = len(zlib.compress(content))
+    if rl_config.useA85:
+        # five characters for every four bytes, and the end marker
+        size = (size + 3) // 4 * 5 + 2
+    return size
+
+
+class SizedCanvas(Canvas):
+    """A Canvas that keeps an estimate of the size of its pdf file in
+    `nbytes`. Pages and forms are counted as they are finished; other
+    XObjects (eg, page images) are counted by calling add_bytes().
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.nbytes = FILE_OVERHEAD
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes + OBJECT_OVERHEAD
+
+    def _add_content(self):
+        self.add_bytes(stream_size(self.getCurrentPageContent().encode('utf-8')))
+
+    def showPage(self):
+        self._add_content()
+        super().showPage()
+
+    def endForm(self, **extra_attributes):
+        self._add_content()
+        super().endForm(**extra_attributes)
+
+
+class RollingCanvas:
+    """Provides a reportlab Canvas for each page, starting a new output
+    file when the current one reaches `max_pages` pages or (as
+    estimated by SizedCanvas from the size of the previous page)
+    would exceed `max_bytes`. Each file is saved and released when it is complete
+    so that only the pages of a single file are held in memory. If
+    `csvlog` is True, a csv file is opened alongside each pdf and is
+    available as `writer`. Each file is rewritten by optimize_pdf()
+    if `object_streams` or `linearize` is True (which usually makes
+    it smaller than estimated).
+
+    If `append` is True, pages are added to the existing file
+    `outfile` as an incremental update (see barcoder.append), and rows
+    are added to the existing csv log; files are not split.
+
+    Each complete pdf file and csv log is passed to `sink` (see
+    barcoder.sinks) if provided, and each new file to `progress` (see
+    barcoder.progress). `opened` is True if the last call to
+    start_page() started a new file (`path`).
+
+    If neither limit is provided, all pages are written to `outfile`;
+    otherwise, files are named using part_name().
+
+    """
+
+    def __init__(self, outfile, pagesize, max_pages=None, max_bytes=None, csvlog=False,
+                 object_streams=False, linearize=False, append=False, sink=None,
+                 progress=None):
+        self.outfile = Path(outfile)
+        self.pagesize = pagesize
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.csvlog = csvlog
+        self.object_streams = object_streams
+        self.linearize = linearize
+        self.append = append
+        self.sink = sink
+        self.progress = progress
+        self.rollover = bool(max_pages or max_bytes) and not append
+
+        self.paths = []
+        self.opened = False
+        self.canvas = None
+        self.writer = None
+        self._logfile = None
+        self._buffer = None
+        self._npages = 0
+        self._start_bytes = self._page_bytes = 0
+
+    @property
+    def path(self):
+        return self.paths[-1] if self.paths else None
+
+    def _full(self):
+        if self.max_pages and self._npages >= self.max_pages:
+            return True
+        if self.max_bytes and self.canvas.nbytes + self._page_bytes > self.max_bytes:
+            return True
+        return False
+
+    def _open(self):
+        part = len(self.paths) + 1
+        path = part_name(self.outfile, part) if self.rollover else self.outfile
+        self.paths.append(path)
+        if self.progress:
+            self.progress.file(path)
+
+        # pages are compressed to estimate their size only if needed
+        canvas_class = SizedCanvas if self.max_bytes else Canvas
+        if self.append:
+            self._buffer = io.BytesIO()
+            self.canvas = canvas_class(self._buffer, pagesize=self.pagesize)
+        else:
+            self.canvas = canvas_class(str(path), pagesize=self.pagesize)
+        if self.csvlog:
+            self._logfile = open(path.with_suffix('.csv'), 'a' if self.append else 'w')
+            self.writer = csv.writer(self._logfile)
+
+        self._npages = 0
+
+    def _close(self):
+        if self.canvas is not None:
+            self.canvas.save()
+            self.canvas = None
+            if self.append:
+                append_pages(self.path, self._buffer.getvalue())
+                self._buffer = None
+            elif self.object_streams or self.linearize:
+                optimize_pdf(self.path, self.object_streams, self.linearize)
+            if self.sink:
+                self.sink.put(self.path)
+        if self._logfile is not None:
+            self._logfile.close()
+            self._logfile = self.writer = None
+            if self.sink:
+                self.sink.put(self.path.with_suffix('.csv'))
+
+    def start_page(self):
+        """Return the canvas on which the next page should be drawn,
+        rolling over to a new file if necessary.
+
+        """
+
+        self.opened = self.canvas is None or bool(self._npages and self._full())
+        if self.opened:
+            self._close()
+            self._open()
+
+        if self.max_bytes:
+            self._start_bytes = self.canvas.nbytes
+        return self.canvas
+
+    def end_page(self):
+        """Finish the current page."""
+
+        self.canvas.showPage()
+        if self.max_bytes:
+            # including any forms and images added for the page
+            self._page_bytes = self.canvas.nbytes - self._start_bytes
+        self._npages += 1
+        if self._logfile is not None:
+            self._logfile.flush()
+
+    def save(self):
+        self._close()
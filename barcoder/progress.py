@@ -0,0 +1,263 @@
+"""Reporting the progress of long runs
+
+Commands call Progress.file() when they start an output file and
+Progress.page() after each page. Progress can be shown on a single
+line of stderr that is rewritten in place (labels per second, pages
+done, ETA, resident memory and the current file), and written
+periodically to a file in OpenMetrics text format for collection by
+the node exporter's textfile collector (the file name should end in
+'.prom'). The metrics file is replaced atomically, and
+barcoder_last_progress_timestamp_seconds shows when a run has
+stalled. add_progress_arguments() adds the options for both to a
+command's parser.
+"""
+
+import logging
+import os
+import resource
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# seconds between updates of the progress line on a terminal
+REFRESH = 0.5
+
+# the rate (and ETA) is calculated over pages in this many seconds
+WINDOW = 30
+
+
+def rss():
+    """Return the resident set size of this process in bytes."""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # peak rather than current size; in bytes on macOS, KiB elsewhere
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def add_progress_arguments(parser):
+    """Add the options used by Progress.from_args() to `parser`."""
+
+    parser.add_argument('--progress', action='store_true', default=False,
+                        help="""show pages done, labels per second, ETA, memory use
+                        and the current file on stderr""")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="""write progress metrics in OpenMetrics text format to
+                        FILE (eg, a .prom file read by the node exporter's textfile
+                        collector)""")
+    parser.add_argument('--metrics-interval', metavar='SECONDS', type=float, default=15,
+                        help="""seconds between updates of --metrics (and of --progress
+                        if stderr is not a terminal) [%(default)s]""")
+
+
+class Progress:
+    """Counts pages and labels for `command` out of `total_pages` (if
+    known). If `show` is True, progress is written to `stream`
+    (stderr by default), in place if it is a terminal or otherwise as
+    a line every `interval` seconds. If `metrics_file` is provided,
+    metrics are written to it every `interval` seconds and when the
+    run is closed. Used as a context manager, the run is closed
+    however the block exits.
+
+    """
+
+    def __init__(self, command, total_pages=None, show=False, metrics_file=None,
+                 interval=15, stream=None):
+        self.command = command
+        self.total_pages = total_pages
+        self.show = show
+        self.metrics_file = Path(metrics_file) if metrics_file else None
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.tty = self.stream.isatty()
+
+        self.files = self.pages = self.labels = 0
+        self.path = None
+        self.running = True
+        self.start = self.last_page = time.time()
+        self._started = time.monotonic()
+        self._recent = deque([(self._started, 0, 0)])
+        self._shown = self._written = self._started
+
+        self.write_metrics()
+
+    @classmethod
+    def from_args(cls, command, args, total_pages=None):
+        """Create a Progress using the options added by
+        add_progress_arguments().
+
+        """
+
+        return cls(command, total_pages=total_pages, show=args.progress,
+                   metrics_file=args.metrics, interval=args.metrics_interval)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def elapsed(self):
+        return time.monotonic() - self._started
+
+    def rate(self):
+        """Return (labels per second, pages per second) over recent pages."""
+
+        now = time.monotonic()
+        then, labels, pages = self._recent[0]
+        if now - then <= 0:
+            return 0.0, 0.0
+        return (self.labels - labels) / (now - then), (self.pages - pages) / (now - then)
+
+    def eta(self):
+        """Return the estimated number of seconds remaining, or None."""
+
+        page_rate = self.rate()[1]
+        if not self.total_pages or not page_rate:
+            return None
+        return max(self.total_pages - self.pages, 0) / page_rate
+
+    def line(self):
+        total = f'/{self.total_pages}' if self.total_pages else ''
+        eta = self.eta()
+        parts = [
+            f'{self.command}: page {self.pages}{total}',
+            f'{self.labels} labels',
+            f'{self.rate()[0]:.1f} labels/s',
+            f'ETA {format_duration(eta)}' if eta is not None else 'ETA -',
+            f'RSS {rss() / 2**20:.0f} MB',
+        ]
+        if self.path:
+            parts.append(self.path.name)
+        return '  '.join(parts)
+
+    def _clear(self):
+        if self.show and self.tty:
+            self.stream.write('\r\x1b[K')
+            self.stream.flush()
+
+    def display(self):
+        if self.tty:
+            self.stream.write('\r\x1b[K' + self.line())
+        else:
+            self.stream.write(self.line() + '\n')
+        self.stream.flush()
+
+    def file(self, path):
+        """Start output file `path`. The progress line is cleared so that
+        the file name can be printed.
+
+        """
+
+        self._clear()
+        self.files += 1
+        self.path = Path(path)
+        self.write_metrics()
+
+    def page(self, labels, pages=1):
+        """Record `pages` pages with a total of `labels` labels."""
+
+        now = time.monotonic()
+        self.pages += pages
+        self.labels += labels
+        self.last_page = time.time()
+
+        self._recent.append((now, self.labels, self.pages))
+        while len(self._recent) > 2 and now - self._recent[1][0] > WINDOW:
+            self._recent.popleft()
+
+        if self.show and now - self._shown >= (REFRESH if self.tty else self.interval):
+            self._shown = now
+            self.display()
+        if self.metrics_file and now - self._written >= self.interval:
+            self.write_metrics()
+
+    def metrics(self):
+        """Return the current values in OpenMetrics text format."""
+
+        labels = f'command="{_escape(self.command)}"'
+        label_rate, page_rate = self.rate()
+        eta = self.eta()
+
+        # name, type, unit, help, value
+        families = [
+            ('barcoder_labels', 'counter', None, 'Labels drawn.', self.labels),
+            ('barcoder_pages', 'counter', None, 'Pages drawn.', self.pages),
+            ('barcoder_files', 'counter', None, 'Output files started.', self.files),
+            ('barcoder_planned_pages', 'gauge', None, 'Pages in the run.',
+             self.total_pages),
+            ('barcoder_labels_per_second', 'gauge', None,
+             f'Labels drawn per second over the last {WINDOW} seconds.', label_rate),
+            ('barcoder_pages_per_second', 'gauge', None,
+             f'Pages drawn per second over the last {WINDOW} seconds.', page_rate),
+            ('barcoder_eta_seconds', 'gauge', 'seconds',
+             'Estimated time remaining.', eta),
+            ('barcoder_resident_memory_bytes', 'gauge', 'bytes',
+             'Resident set size of the process.', rss()),
+            ('barcoder_start_timestamp_seconds', 'gauge', 'seconds',
+             'Time the run started.', self.start),
+            ('barcoder_last_progress_timestamp_seconds', 'gauge', 'seconds',
+             'Time the last page was drawn.', self.last_page),
+            ('barcoder_running', 'gauge', None,
+             '1 while the run is in progress, 0 when it is complete.', int(self.running)),
+        ]
+
+        lines = []
+        for name, kind, unit, text, value in families:
+            if value is None:
+                continue
+            lines.append(f'# TYPE {name} {kind}')
+            if unit:
+                lines.append(f'# UNIT {name} {unit}')
+            lines.append(f'# HELP {name} {text}')
+            suffix = '_total' if kind == 'counter' else ''
+            lines.append(f'{name}{suffix}{{{labels}}} {value}')
+
+        if self.path:
+            lines.append('# TYPE barcoder_file info')
+            lines.append('# HELP barcoder_file The current output file.')
+            lines.append(f'barcoder_file_info{{{labels},path="{_escape(self.path)}"}} 1')
+
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write_metrics(self):
+        if not self.metrics_file:
+            return
+
+        self._written = time.monotonic()
+        # the collector must never read a partial file
+        tmp = self.metrics_file.with_name(f'.{self.metrics_file.name}.{os.getpid()}.tmp')
+        try:
+            tmp.write_text(self.metrics())
+            os.replace(tmp, self.metrics_file)
+        except OSError as err:
+            log.warning(f'could not write metrics to {self.metrics_file}: {err}')
+
+    def close(self):
+        """Finish the run, showing the final totals."""
+
+        self.running = False
+        if self.show:
+            self.display()
+            if self.tty:
+                self.stream.write('\n')
+        self.write_metrics()
+        log.info(f'{self.command}: {self.pages} pages, {self.labels} labels '
+                 f'in {format_duration(self.elapsed())}')
@@ -0,0 +1,389 @@
+"""QR code encoding specialized for payloads of a fixed length
+
+Every QR code on a securelink label encodes a url of the same length
+(only the code changes), so the version, function patterns, format
+information, data module positions and error correction generator
+are the same for every label. FixedLengthQR computes these once and
+encodes many payloads at a time using numpy. Mask selection follows
+qrcode.QRCode.best_mask_pattern(), so the resulting matrices (and
+images) are identical to those produced by the qrcode package.
+"""
+
+import io
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+from qrcode import constants, util, base
+
+# exponent and log tables for GF(256) with the QR polynomial 0x11d
+GF_EXP = np.zeros(512, dtype=np.int32)
+GF_LOG = np.zeros(256, dtype=np.int32)
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+GF_EXP[255:510] = GF_EXP[:255]
+
+# finder-like patterns penalized by rule 3 of the mask evaluation
+FINDER_PATTERNS = [
+    np.array([1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0], dtype=bool),
+    np.array([0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1], dtype=bool),
+]
+
+
+def generator_poly(degree):
+    """Return coefficients (highest power first, excluding the leading
+    1) of the Reed-Solomon generator polynomial of `degree`.
+
+    """
+
+    poly = [1]
+    for i in range(degree):
+        # multiply by (x - a^i)
+        nxt = poly + [0]
+        for j, coeff in enumerate(poly):
+            if coeff:
+                nxt[j + 1] ^= int(GF_EXP[GF_LOG[coeff] + i])
+        poly = nxt
+    return np.array(poly[1:], dtype=np.int32)
+
+
+def rs_remainder(data, generator):
+    """Return the error correction codewords for each row of `data`
+    (an array of shape (n, data_count)).
+
+    """
+
+    n = data.shape[0]
+    ec_count = len(generator)
+    gen_log = GF_LOG[generator]
+    remainder = np.zeros((n, ec_count), dtype=np.int32)
+    for k in range(data.shape[1]):
+        factor = data[:, k] ^ remainder[:, 0]
+        remainder[:, :-1] = remainder[:, 1:]
+        remainder[:, -1] = 0
+        nonzero = factor != 0
+        if nonzero.any():
+            terms = GF_EXP[GF_LOG[factor[nonzero]][:, None] + gen_log[None, :]]
+            remainder[nonzero] ^= terms
+    return remainder
+
+
+def run_penalty(rows, n):
+    """Return rule 1 penalties (runs of 5 or more modules of the same
+    color) for each of `n` matrices whose rows are stacked in `rows`.
+
+    """
+
+    width = rows.shape[1]
+    flat = rows.reshape(-1)
+    starts = np.ones(flat.shape, dtype=bool)
+    starts[1:] = flat[1:] != flat[:-1]
+    starts[::width] = True
+    idx = np.flatnonzero(starts)
+    lengths = np.diff(np.append(idx, flat.size))
+    points = np.where(lengths >= 5, lengths - 2, 0)
+    return np.bincount(idx // (width * width), weights=points, minlength=n)
+
+
+def pattern_count(mats):
+    """Return the number of rule 3 patterns in the rows of each matrix."""
+
+    size = mats.shape[-1]
+    count = np.zeros(mats.shape[0], dtype=np.int64)
+    for pattern in FINDER_PATTERNS:
+        match = np.ones(mats.shape[:2] + (size - 10,), dtype=bool)
+        for t, value in enumerate(pattern):
+            window = mats[:, :, t:t + size - 10]
+            match &= window if value else ~window
+        count += match.sum(axis=(1, 2))
+    return count
+
+
+def lost_points(mats):
+    """Vectorized equivalent of qrcode.util.lost_point() for an array of
+    matrices with shape (n, size, size).
+
+    """
+
+    n, size, _ = mats.shape
+
+    points = run_penalty(mats.reshape(n * size, size), n)
+    points += run_penalty(mats.transpose(0, 2, 1).reshape(n * size, size), n)
+
+    a = mats[:, :-1, :-1]
+    blocks = (a == mats[:, :-1, 1:]) & (a == mats[:, 1:, :-1]) & (a == mats[:, 1:, 1:])
+    points += 3 * blocks.sum(axis=(1, 2))
+
+    points += 40 * (pattern_count(mats) + pattern_count(mats.transpose(0, 2, 1)))
+
+    percent = mats.sum(axis=(1, 2)) / (size * size)
+    points += (np.abs(percent * 100 - 50) / 5).astype(np.int64) * 10
+
+    return points.astype(np.int64)
+
+
+class FixedLengthQR:
+    """Encodes payloads of `length` bytes as QR codes in byte mode.
+    The encoding is identical to qrcode.QRCode(error_correction,
+    border, box_size) with fit=True for payloads that qrcode would
+    encode as a single byte-mode segment (see is_single_segment()).
+
+    """
+
+    def __init__(self, length, error_correction=constants.ERROR_CORRECT_M,
+                 border=4, box_size=10):
+        self.length = length
+        self.error_correction = error_correction
+        self.border = border
+        self.box_size = box_size
+
+        mode = util.MODE_8BIT_BYTE
+
+        # smallest version with capacity for the payload
+        for version in range(1, 41):
+            needed = 4 + util.mode_sizes_for_version(version)[mode] + 8 * length
+            if util.BIT_LIMIT_TABLE[error_correction][version] >= needed:
+                break
+        else:
+            raise ValueError(f'a payload of {length} bytes is too long for a QR code')
+
+        self.version = version
+        self.size = version * 4 + 17
+        self.rs_blocks = base.rs_blocks(version, error_correction)
+
+        # header and padding surrounding the payload bits
+        bit_limit = sum(block.data_count for block in self.rs_blocks) * 8
+        header = format(mode, '04b') + format(length, f'0{util.length_in_bits(mode, version)}b')
+        used = len(header) + 8 * length
+        trailer = '0' * min(bit_limit - used, 4)
+        trailer += '0' * (-(used + len(trailer)) % 8)
+        pad = [util.PAD0, util.PAD1] * bit_limit
+        trailer += ''.join(format(b, '08b') for b in pad[:(bit_limit - used - len(trailer)) // 8])
+        self.header = np.array([int(b) for b in header], dtype=np.uint8)
+        self.trailer = np.array([int(b) for b in trailer], dtype=np.uint8)
+
+        self.generators = {
+            block.total_count - block.data_count:
+            generator_poly(block.total_count - block.data_count)
+            for block in self.rs_blocks}
+
+        # order in which codewords from each block are interleaved
+        offsets, order = [], []
+        offset = 0
+        for block in self.rs_blocks:
+            offsets.append(offset)
+            offset += block.data_count
+        for i in range(max(block.data_count for block in self.rs_blocks)):
+            order.extend(o + i for o, block in zip(offsets, self.rs_blocks)
+                         if i < block.data_count)
+        ec_offset = offset
+        for i in range(max(block.total_count - block.data_count for block in self.rs_blocks)):
+            for r, block in enumerate(self.rs_blocks):
+                ec_count = block.total_count - block.data_count
+                if i < ec_count:
+                    order.append(ec_offset + sum(
+                        b.total_count - b.data_count for b in self.rs_blocks[:r]) + i)
+        self.order = np.array(order)
+
+        self._setup_matrix()
+
+    def _setup_matrix(self):
+        size = self.size
+
+        # function patterns; None marks data modules
+        modules = [[None] * size for _ in range(size)]
+
+        def probe(row, col):
+            for r in range(-1, 8):
+                for c in range(-1, 8):
+                    if 0 <= row + r < size and 0 <= col + c < size:
+                        modules[row + r][col + c] = bool(
+                            (0 <= r <= 6 and c in (0, 6))
+                            or (0 <= c <= 6 and r in (0, 6))
+                            or (2 <= r <= 4 and 2 <= c <= 4))
+
+        probe(0, 0)
+        probe(size - 7, 0)
+        probe(0, size - 7)
+
+        pos = util.pattern_position(self.version)
+        for row in pos:
+            for col in pos:
+                if modules[row][col] is not None:
+                    continue
+                for r in range(-2, 3):
+                    for c in range(-2, 3):
+                        modules[row + r][col + c] = (
+                            abs(r) == 2 or abs(c) == 2 or (r == 0 and c == 0))
+
+        for i in range(8, size - 8):
+            if modules[i][6] is None:
+                modules[i][6] = i % 2 == 0
+            if modules[6][i] is None:
+                modules[6][i] = i % 2 == 0
+
+        # format information; placeholder values are replaced below
+        self.format_cells = []
+        for i in range(15):
+            if i < 6:
+                cell = (i, 8)
+            elif i < 8:
+                cell = (i + 1, 8)
+            else:
+                cell = (size - 15 + i, 8)
+            self.format_cells.append(cell)
+        for i in range(15):
+            if i < 8:
+                cell = (8, size - i - 1)
+            elif i < 9:
+                cell = (8, 15 - i)
+            else:
+                cell = (8, 15 - i - 1)
+            self.format_cells.append(cell)
+        for row, col in self.format_cells:
+            modules[row][col] = False
+        modules[size - 8][8] = False
+
+        version_cells, version_bits = [], []
+        if self.version >= 7:
+            bits = util.BCH_type_number(self.version)
+            for i in range(18):
+                version_bits += [(bits >> i) & 1 == 1] * 2
+                version_cells += [(i // 3, i % 3 + size - 8 - 3), (i % 3 + size - 8 - 3, i // 3)]
+            for row, col in version_cells:
+                modules[row][col] = False
+
+        # data module positions, in placement order
+        rows, cols = [], []
+        row, inc = size - 1, -1
+        for col in range(size - 1, 0, -2):
+            if col <= 6:
+                col -= 1
+            while True:
+                for c in (col, col - 1):
+                    if modules[row][c] is None:
+                        rows.append(row)
+                        cols.append(c)
+                row += inc
+                if row < 0 or size <= row:
+                    row -= inc
+                    inc = -inc
+                    break
+        self.data_rows = np.array(rows)
+        self.data_cols = np.array(cols)
+
+        # matrices used to evaluate masks have light format and version
+        # information modules
+        self.function = np.array([[bool(m) for m in row] for row in modules])
+
+        data = np.zeros((size, size), dtype=bool)
+        data[self.data_rows, self.data_cols] = True
+        ii, jj = np.indices((size, size))
+        self.masks = np.array(
+            [np.vectorize(util.mask_func(m))(ii, jj).astype(bool) & data for m in range(8)])
+
+        # function patterns with final format and version information
+        self.final = np.repeat(self.function[None], 8, axis=0)
+        self.final[:, size - 8, 8] = True
+        for (row, col), bit in zip(version_cells, version_bits):
+            self.final[:, row, col] = bit
+        for m in range(8):
+            bits = util.BCH_type_info((self.error_correction << 3) | m)
+            for i, (row, col) in enumerate(self.format_cells):
+                self.final[m, row, col] = (bits >> (i % 15)) & 1 == 1
+
+    def codewords(self, payloads):
+        """Return an array of shape (n, total_count) with the final
+        (interleaved) codewords for each payload in `payloads`.
+
+        """
+
+        n = len(payloads)
+        data = np.frombuffer(b''.join(payloads), dtype=np.uint8).reshape(n, self.length)
+        bits = np.concatenate([
+            np.broadcast_to(self.header, (n, len(self.header))),
+            np.unpackbits(data, axis=1),
+            np.broadcast_to(self.trailer, (n, len(self.trailer)))], axis=1)
+        data = np.packbits(bits, axis=1).astype(np.int32)
+
+        blocks, ec_blocks = [], []
+        offset = 0
+        for block in self.rs_blocks:
+            chunk = data[:, offset:offset + block.data_count]
+            blocks.append(chunk)
+            ec_count = block.total_count - block.data_count
+            ec_blocks.append(rs_remainder(chunk, self.generators[ec_count]))
+            offset += block.data_count
+
+        return np.concatenate(blocks + ec_blocks, axis=1)[:, self.order].astype(np.uint8)
+
+    def matrices(self, texts):
+        """Return an array of shape (n, size, size) with the module matrix
+        for each string in `texts`.
+
+        """
+
+        payloads = [util.to_bytestring(text) for text in texts]
+        for payload in payloads:
+            if len(payload) != self.length:
+                raise ValueError(f'expected a payload of {self.length} bytes: {payload}')
+
+        n = len(payloads)
+        bits = np.unpackbits(self.codewords(payloads), axis=1).astype(bool)
+        data = np.zeros((n, self.size, self.size), dtype=bool)
+        # any remaining modules are light (before masking)
+        nbits = bits.shape[1]
+        data[:, self.data_rows[:nbits], self.data_cols[:nbits]] = bits
+
+        # (n, 8, size, size)
+        masked = data[:, None] ^ self.masks[None]
+        points = lost_points((masked | self.function).reshape(n * 8, self.size, self.size))
+        best = points.reshape(n, 8).argmin(axis=1)
+
+        return masked[np.arange(n), best] | self.final[best]
+
+    def images(self, texts):
+        """Return a list of bytes representing QR code images (png) for
+        each string in `texts`, identical to utils.get_qr().
+
+        """
+
+        return [matrix_png(matrix, self.border, self.box_size)
+                for matrix in self.matrices(texts)]
+
+
+def matrix_png(matrix, border=4, box_size=10):
+    """Return bytes representing a png image of the QR code module
+    `matrix` (True for dark modules), identical to the image created
+    by qrcode.QRCode(border=border, box_size=box_size).
+
+    """
+
+    modules = np.pad(matrix, border)
+    pixels = modules.repeat(box_size, axis=0).repeat(box_size, axis=1)
+    with io.BytesIO() as f:
+        Image.fromarray(~pixels).save(f, format='PNG')
+        return f.getvalue()
+
+
+def is_single_segment(text, optimize=20):
+    """Return True if qrcode.QRCode.add_data() would encode `text` as
+    a single byte-mode segment.
+
+    """
+
+    chunks = list(util.optimal_data_chunks(text, minimum=optimize))
+    return len(chunks) == 1 and chunks[0].mode == util.MODE_8BIT_BYTE
+
+
+@lru_cache(maxsize=None)
+def get_encoder(length, error_correction=constants.ERROR_CORRECT_M, border=4, box_size=10):
+    """Return a (shared) FixedLengthQR instance."""
+
+    return FixedLengthQR(length, error_correction=error_correction,
+                         border=border, box_size=box_size)
@@ -0,0 +1,152 @@
+"""Compositing the barcodes on a page into a single 1-bit image
+
+A PageRaster is a bitmap covering the page at the printer's
+resolution. Code 128 bars are drawn directly into the bitmap with
+each module a whole number of device pixels, so that bars are aligned
+to the printer's pixel grid instead of being resampled from separate
+images for each label. The bitmap is embedded once per page as an
+image mask (only the bars are painted, so text and lines drawn on the
+canvas are unaffected) compressed using CCITT Group 4 or Flate.
+"""
+
+import hashlib
+import io
+import zlib
+
+import numpy as np
+from PIL import Image
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFDictionary, PDFName, PDFObject, PDFStream
+
+from barcoder import code128
+from barcoder.output import SizedCanvas
+
+COMPRESSIONS = ['flate', 'g4']
+
+
+class PageImageXObject(PDFObject):
+    """An image mask XObject with `data` already compressed using
+    `compression` (one of COMPRESSIONS).
+
+    """
+
+    def __init__(self, name, width, height, data, compression):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.data = data
+        self.compression = compression
+
+    def format(self, document):
+        dictionary = PDFDictionary({
+            'Type': PDFName('XObject'),
+            'Subtype': PDFName('Image'),
+            'Width': self.width,
+            'Height': self.height,
+            'ImageMask': 'true',
+            'BitsPerComponent': 1,
+        })
+        if self.compression == 'g4':
+            dictionary['Filter'] = PDFName('CCITTFaxDecode')
+            dictionary['DecodeParms'] = PDFDictionary(
+                {'K': -1, 'Columns': self.width, 'Rows': self.height})
+        else:
+            dictionary['Filter'] = PDFArray([PDFName('FlateDecode')])
+        return PDFStream(dictionary, self.data, filters=()).format(document)
+
+
+def encode_g4(pixels):
+    """Return CCITT Group 4 data for the boolean array `pixels` (True
+    for white) as a single strip.
+
+    """
+
+    height, width = pixels.shape
+
+    # the encoder codes 1 bits as black
+    img = Image.fromarray(~pixels)
+    with io.BytesIO() as f:
+        img.save(f, format='TIFF', compression='group4',
+                 strip_size=height * ((width + 7) // 8))
+        f.seek(0)
+        tiff = Image.open(f)
+        offset, = tiff.tag_v2[273]
+        length, = tiff.tag_v2[279]
+        return f.getvalue()[offset:offset + length]
+
+
+def encode_flate(pixels):
+    return zlib.compress(np.packbits(pixels, axis=1).tobytes())
+
+
+class PageRaster:
+    """A bitmap covering a page of size `pagesize` (in points) at `dpi`
+    dots per inch.
+
+    """
+
+    def __init__(self, pagesize, dpi=600, compression='flate'):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'compression must be one of {", ".join(COMPRESSIONS)}')
+
+        self.pagesize = pagesize
+        self.dpi = dpi
+        self.compression = compression
+        width, height = (self.dots(size) for size in pagesize)
+        self.pixels = np.ones((height, width), dtype=bool)
+
+    def dots(self, points):
+        return round(points * self.dpi / 72)
+
+    def code128(self, x, y, width, height, payload):
+        """Draw the bars of a Code 128 barcode for `payload` in the box that
+        an image from code128.rasterize() would occupy at (x, y) with
+        the given width and height, and return the proportions of that
+        image (see code128.text_position()).
+
+        """
+
+        modules = code128.get_modules(payload)
+        image_width = 2 * code128.QUIET_ZONE + code128.MODULE_WIDTH * len(modules)
+
+        # modules are a whole number of pixels, rounded down so that
+        # the quiet zones are preserved, and centered on the image
+        module = max(1, int(width * code128.MODULE_WIDTH / image_width * self.dpi / 72))
+        row = ~modules.repeat(module).astype(bool)
+        left = self.dots(x + width / 2) - row.size // 2
+        left = max(0, min(left, self.pixels.shape[1] - row.size))
+
+        scale = height / code128.IMAGE_HEIGHT
+        page_height = self.pagesize[1]
+        top = self.dots(page_height - (y + height - 1.0 * scale))
+        bottom = self.dots(page_height - (y + height - (1.0 + code128.MODULE_HEIGHT) * scale))
+
+        self.pixels[top:bottom, left:left + row.size] &= row
+
+        return code128.image_aspect(payload)
+
+    def draw(self, canvas):
+        """Paint the bars on `canvas` as a single image covering the page."""
+
+        if self.pixels.all():
+            return
+
+        encode = encode_g4 if self.compression == 'g4' else encode_flate
+        data = encode(self.pixels)
+
+        # identical pages share an image
+        name = 'raster' + hashlib.md5(data).hexdigest()
+        reg_name = canvas._doc.getXObjectName(name)
+        if reg_name not in canvas._doc.idToObject:
+            height, width = self.pixels.shape
+            obj = PageImageXObject(name, width, height, data, self.compression)
+            canvas._doc.Reference(obj, reg_name)
+            canvas._doc.addForm(name, obj)
+            if isinstance(canvas, SizedCanvas):
+                canvas.add_bytes(len(data))
+
+        page_width, page_height = self.pagesize
+        canvas.saveState()
+        canvas.setFillGray(0)
+        canvas.scale(page_width, page_height)
+        canvas.doForm(name)
+        canvas.restoreState()
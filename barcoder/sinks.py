@@ -0,0 +1,144 @@
+"""Destinations for output files
+
+Commands write each output file (pdf files and csv logs) to a local
+directory and pass it to a sink as soon as it is complete:
+
+* LocalSink leaves files where they are.
+* MemorySink also reads the contents of each file (after it has
+  been written to disk) into a dict, which is useful when labels are
+  created from another application.
+* S3Sink uploads files to S3 or an S3-compatible object store (eg,
+  MinIO) using a pool of background threads, so that uploads overlap
+  with rendering of the files that follow. Large files are uploaded
+  in parts.
+
+get_sink() creates a sink from a url given on the command line, and
+add_upload_arguments() adds the options for it to a command's parser.
+Sinks are context managers, and close() waits for any uploads.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:
+    boto3 = None
+
+log = logging.getLogger(__name__)
+
+# size of parts for multipart uploads
+PART_SIZE = 8 * 1024 * 1024
+
+
+class Sink:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LocalSink(Sink):
+    """Leaves files in place."""
+
+    def put(self, path):
+        log.info(f'wrote {path}')
+
+    def close(self):
+        pass
+
+
+class MemorySink(LocalSink):
+    """Keeps the contents of each file in `files`, keyed by file name.
+    Files are still written to disk first and read back by put().
+
+    """
+
+    def __init__(self):
+        self.files = {}
+
+    def put(self, path):
+        path = Path(path)
+        self.files[path.name] = path.read_bytes()
+
+
+class S3Sink(Sink):
+    """Uploads files to bucket and key prefix given by `url` (eg,
+    's3://bucket/prefix') using up to `workers` threads. `endpoint_url`
+    selects an S3-compatible service; credentials are found by boto3
+    as usual (eg, from the environment or ~/.aws).
+
+    """
+
+    def __init__(self, url, endpoint_url=None, workers=4, part_size=PART_SIZE, client=None):
+        if boto3 is None:
+            raise ImportError('boto3 is required to upload files')
+
+        parsed = urlparse(url)
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.strip('/')
+        self.client = client or boto3.client('s3', endpoint_url=endpoint_url)
+
+        # parts of each file are uploaded by the thread uploading it,
+        # so that no more than `workers` uploads run at once
+        self.config = TransferConfig(multipart_threshold=part_size,
+                                     multipart_chunksize=part_size, use_threads=False)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def key(self, path):
+        name = Path(path).name
+        return f'{self.prefix}/{name}' if self.prefix else name
+
+    def _upload(self, path):
+        key = self.key(path)
+        self.client.upload_file(str(path), self.bucket, key, Config=self.config)
+        log.info(f'uploaded {path} to s3://{self.bucket}/{key}')
+        return key
+
+    def put(self, path):
+        self.futures.append(self.executor.submit(self._upload, path))
+
+    def close(self):
+        """Wait for all uploads to finish, and raise the first error (if
+        any) once they have.
+
+        """
+
+        self.executor.shutdown(wait=True)
+        errors = [future.exception() for future in self.futures if future.exception()]
+        for err in errors:
+            log.error(f'upload failed: {err}')
+        if errors:
+            raise errors[0]
+
+
+def add_upload_arguments(parser):
+    """Add the options used by get_sink() to `parser`."""
+
+    parser.add_argument('--upload', metavar='URL',
+                        help="""upload each output file to S3 or an S3-compatible store
+                        (eg, s3://bucket/prefix) as soon as it is complete, while
+                        later files are rendered (requires boto3)""")
+    parser.add_argument('--endpoint-url', metavar='URL',
+                        help='endpoint of an S3-compatible service for --upload')
+    parser.add_argument('--upload-workers', metavar='N', type=int, default=4,
+                        help='number of concurrent uploads [%(default)s]')
+
+
+def get_sink(url=None, endpoint_url=None, workers=4):
+    """Return a sink for `url`: an S3Sink for 's3://bucket/prefix', or a
+    LocalSink if `url` is None.
+
+    """
+
+    if url is None:
+        return LocalSink()
+    if urlparse(url).scheme == 's3':
+        return S3Sink(url, endpoint_url=endpoint_url, workers=workers)
+    raise ValueError(f'unsupported destination: {url}')
@@ -0,0 +1,144 @@
+"""Encoded barcode symbols shared by all renderers
+
+Encoding a payload (choosing Code 128 code sets and the check
+character, or QR codewords, error correction and the mask) is
+separate from drawing it. The functions here return a compact,
+immutable description of each symbol that is computed once per
+payload and kept in a small cache, so that a payload drawn by
+several renderers in one process (png images, page rasters,
+thermal printer commands) is encoded only once:
+
+* Code128: the widths in modules of alternating bars and spaces,
+  starting with a bar.
+* QR: the module matrix (without the quiet zone), packed eight
+  modules to a byte.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+from itertools import groupby
+
+import barcode
+import numpy as np
+import qrcode
+from qrcode import constants
+
+from barcoder.qr import get_encoder, is_single_segment
+
+# number of symbols kept in the cache
+CACHE_SIZE = 4096
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+class Code128(namedtuple('Code128', ['payload', 'widths'])):
+    """A Code 128 barcode; `widths` are bytes."""
+
+    __slots__ = ()
+
+    @property
+    def nmodules(self):
+        return sum(self.widths)
+
+    def modules(self):
+        """Return a uint8 array with one element per module (1 for bars)."""
+
+        colors = np.arange(len(self.widths), dtype=np.uint8) % 2 ^ 1
+        return colors.repeat(np.frombuffer(self.widths, dtype=np.uint8))
+
+
+class QR(namedtuple('QR', ['size', 'bits'])):
+    """A QR code with `size` modules on a side; `bits` are bytes."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        matrix = np.asarray(matrix, dtype=bool)
+        return cls(matrix.shape[0], np.packbits(matrix).tobytes())
+
+    def matrix(self):
+        """Return a boolean array of shape (size, size) (True for dark
+        modules).
+
+        """
+
+        bits = np.unpackbits(np.frombuffer(self.bits, dtype=np.uint8),
+                             count=self.size * self.size)
+        return bits.reshape(self.size, self.size).astype(bool)
+
+
+def _get(key):
+    with _lock:
+        symbol = _cache.get(key)
+        if symbol is not None:
+            _cache.move_to_end(key)
+        return symbol
+
+
+def _put(key, symbol):
+    with _lock:
+        _cache[key] = symbol
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return symbol
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+def code128(payload):
+    """Return a Code128 symbol for `payload` as encoded by python-barcode."""
+
+    key = ('code128', payload)
+    symbol = _get(key)
+    if symbol is None:
+        pattern, = barcode.get('code128', payload).build()
+        widths = bytes(len(list(run)) for _, run in groupby(pattern))
+        symbol = _put(key, Code128(payload, widths))
+    return symbol
+
+
+def _encode_qr(text, error_correction):
+    qr = qrcode.QRCode(error_correction=error_correction, border=0)
+    qr.add_data(text)
+    qr.make(fit=True)
+    return QR.from_matrix(qr.modules)
+
+
+def qrs(texts, error_correction=constants.ERROR_CORRECT_M):
+    """Return a list of QR symbols for each of `texts`, identical to
+    those encoded by qrcode.QRCode(error_correction) with fit=True.
+    Texts that would be encoded in a single segment are grouped by
+    length and encoded together using barcoder.qr.FixedLengthQR.
+
+    """
+
+    symbols = [_get(('qr', text, error_correction)) for text in texts]
+
+    groups = {}
+    for i, (text, symbol) in enumerate(zip(texts, symbols)):
+        if symbol is not None:
+            continue
+        if is_single_segment(text):
+            groups.setdefault(len(text.encode('utf-8')), []).append(i)
+        else:
+            symbols[i] = _put(('qr', text, error_correction),
+                              _encode_qr(text, error_correction))
+
+    for length, indices in groups.items():
+        encoder = get_encoder(length, error_correction=error_correction)
+        for i, matrix in zip(indices, encoder.matrices([texts[i] for i in indices])):
+            symbols[i] = _put(('qr', texts[i], error_correction), QR.from_matrix(matrix))
+
+    return symbols
+
+
+def qr(text, error_correction=constants.ERROR_CORRECT_M):
+    """Return a QR symbol for `text`; see qrs()."""
+
+    return qrs([text], error_correction)[0]
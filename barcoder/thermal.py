@@ -0,0 +1,170 @@
+"""Commands for thermal label printers (ZPL and EPL)
+
+A Label collects printer commands for a single label using the same
+coordinates as a reportlab Drawing (points, with the origin at the
+bottom left), so that label functions can mirror their pdf
+counterparts. Barcodes are drawn by the printer using its native
+Code 128 and QR code commands in the boxes that the corresponding
+images would occupy.
+"""
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from barcoder import code128, symbols
+
+LANGUAGES = ['zpl', 'epl']
+FORMATS = ['pdf'] + LANGUAGES
+
+# EPL resident fonts: font number -> (width, height) in dots
+EPL_FONTS = {
+    203: {1: (8, 12), 2: (10, 16), 3: (12, 20), 4: (14, 24), 5: (32, 48)},
+    300: {1: (12, 20), 2: (16, 28), 3: (20, 36), 4: (24, 44), 5: (48, 80)},
+}
+
+# Helvetica cap height in em, used to size Code 128 text
+CAP_HEIGHT = 0.718
+
+# minimum width of the quiet zone on either side of Code 128 barcodes
+QUIET_MODULES = 10
+
+
+def qr_size(data, border=4):
+    """Return the width in modules (including the border) of the QR code
+    created by utils.get_qr() for `data`.
+
+    """
+
+    return symbols.qr(data).size + 2 * border
+
+
+def zpl_field(data):
+    """Return a ZPL field data command for `data`, escaping characters
+    that would otherwise be interpreted as commands.
+
+    """
+
+    if any(c in data for c in '^~'):
+        escaped = ''.join(f'_{ord(c):02X}' if c in '^~_' else c for c in data)
+        return f'^FH^FD{escaped}^FS'
+    return f'^FD{data}^FS'
+
+
+def epl_string(data):
+    escaped = data.replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+class Label:
+    """Printer commands in `language` (one of LANGUAGES) for a label
+    `width` x `height` points printed at `dpi` dots per inch.
+
+    """
+
+    def __init__(self, width, height, language='zpl', dpi=203):
+        if language not in LANGUAGES:
+            raise ValueError(f'language must be one of {", ".join(LANGUAGES)}')
+
+        self.width = width
+        self.height = height
+        self.language = language
+        self.dpi = dpi
+        self.commands = []
+
+    def dots(self, points):
+        return round(points * self.dpi / 72)
+
+    def text(self, x, y, text, font_size, anchor='start', font_name='Helvetica'):
+        """Add `text` with its baseline at (x, y), aligned as for a reportlab
+        String. The printer's scalable font is used for ZPL and the
+        closest resident font for EPL; `font_name` is used to
+        estimate the width of the text for alignment.
+
+        """
+
+        if not text:
+            return
+
+        width = stringWidth(text, font_name, font_size)
+        x -= {'start': 0, 'middle': width / 2, 'end': width}[anchor]
+
+        if self.language == 'zpl':
+            height = self.dots(font_size)
+            self.commands.append(
+                f'^FT{self.dots(x)},{self.dots(self.height - y)}'
+                f'^A0N,{height},{height}{zpl_field(text)}')
+        else:
+            fonts = EPL_FONTS.get(self.dpi, EPL_FONTS[203])
+            target = self.dots(font_size)
+            font, mult = min(
+                ((font, mult) for font in fonts for mult in (1, 2, 3)),
+                key=lambda fm: abs(fonts[fm[0]][1] * fm[1] - target))
+            cell_height = fonts[font][1] * mult
+            top = self.dots(self.height - y) - round(0.8 * cell_height)
+            self.commands.append(
+                f'A{self.dots(x)},{top},0,{font},{mult},{mult},N,{epl_string(text)}')
+
+    def code128(self, x, y, width, height, payload, text=''):
+        """Add a Code 128 barcode for `payload` occupying the box that an
+        image from utils.get_code128() would occupy at (x, y) with
+        the given width and height, followed by `text`.
+
+        """
+
+        scale = height / code128.IMAGE_HEIGHT
+        bars_top = y + height - 1.0 * scale
+        bars_height = self.dots(code128.MODULE_HEIGHT * scale)
+
+        # modules must be a whole number of dots, so the bars may be
+        # narrower or wider than in the image, but must leave a quiet
+        # zone of QUIET_MODULES on either side within the label
+        nmodules = symbols.code128(payload).nmodules
+        image_modules = nmodules + 2 * code128.QUIET_ZONE / code128.MODULE_WIDTH
+        module = max(1, min(round(self.dots(width) / image_modules),
+                            self.dots(self.width) // (nmodules + 2 * QUIET_MODULES)))
+
+        # center the bars on the image, moving them onto the label if necessary
+        bars_width = module * nmodules
+        quiet = QUIET_MODULES * module
+        left = self.dots(x + width / 2) - bars_width // 2
+        left = max(quiet, min(left, self.dots(self.width) - quiet - bars_width))
+        top = self.dots(self.height - bars_top)
+
+        if self.language == 'zpl':
+            self.commands.append(
+                f'^FO{left},{top}^BY{module}^BCN,{bars_height},N,N,N,A{zpl_field(payload)}')
+        else:
+            self.commands.append(
+                f'B{left},{top},0,1,{module},{2 * module},{bars_height},N,'
+                f'{epl_string(payload)}')
+
+        font_size = code128.TEXT_CAP_HEIGHT * height / CAP_HEIGHT
+        self.text(x + width / 2, y + code128.TEXT_BASELINE * height, text, font_size,
+                  anchor='middle')
+
+    def qr(self, x, y, edge, data):
+        """Add a QR code for `data` occupying the box that an image from
+        utils.get_qr() would occupy at (x, y) with sides of length
+        `edge`.
+
+        """
+
+        border = 4
+        size = qr_size(data, border)
+        magnification = max(1, int(self.dots(edge) / size))
+        left = self.dots(x) + border * magnification
+        top = self.dots(self.height - y - edge) + border * magnification
+
+        if self.language == 'zpl':
+            self.commands.append(
+                f'^FO{left},{top}^BQN,2,{magnification}{zpl_field("MA," + data)}')
+        else:
+            self.commands.append(
+                f'b{left},{top},Q,m2,s{magnification},eM,{epl_string(data)}')
+
+    def __str__(self):
+        width, height = self.dots(self.width), self.dots(self.height)
+        if self.language == 'zpl':
+            lines = [f'^XA^CI28^PW{width}^LL{height}'] + self.commands + ['^XZ']
+        else:
+            lines = ['', 'N', f'q{width}', f'Q{height},24'] + self.commands + ['P1']
+        return '\n'.join(lines) + '\n'
@@ -3,12 +3,21 @@ import string
 import secrets
 import hashlib
 import io
+import os
+import threading
+from functools import lru_cache
+from os import path
 
 from reportlab.lib.pagesizes import letter
+from reportlab.graphics.shapes import Group, Image, Rect, String
 
 from barcode.writer import ImageWriter
 import barcode
 import qrcode
+from PIL import Image as PILImage
+
+from barcoder import __version__, code128, symbols
+from barcoder.qr import matrix_png
 
 log = logging.getLogger(__name__)
 
@@ -65,11 +74,20 @@ def generate_fake_codes(length, chars=None):
             yield code
 
 
+# qrcode.QRCode() parameters supported by barcoder.symbols and
+# barcoder.qr.matrix_png()
+QR_OPTIONS = {'error_correction', 'border', 'box_size'}
+
+
 def get_qr(text, **kwargs):
     """Return bytes representing a QR code image. kwargs can be used to
     provide parameters to qrcode.QRCode() constructor.
 
     """
+
+    if set(kwargs) <= QR_OPTIONS:
+        return get_qrs([text], **kwargs)[0]
+
     qr = qrcode.QRCode(**kwargs)
     qr.add_data(text)
     qr.make(fit=True)
@@ -81,6 +99,24 @@ def get_qr(text, **kwargs):
         return f.read()
 
 
+def get_qrs(texts, **kwargs):
+    """Return a list of bytes representing QR code images for each of
+    `texts`, identical to [get_qr(text, **kwargs) for text in texts].
+    If only parameters in QR_OPTIONS are provided, texts are encoded
+    using barcoder.symbols (which encodes each text once, and texts
+    of the same length together).
+
+    """
+
+    if not set(kwargs) <= QR_OPTIONS:
+        return [get_qr(text, **kwargs) for text in texts]
+
+    kwargs = dict(kwargs)
+    error_correction = kwargs.pop('error_correction', qrcode.constants.ERROR_CORRECT_M)
+    return [matrix_png(symbol.matrix(), **kwargs)
+            for symbol in symbols.qrs(texts, error_correction)]
+
+
 def get_code128(text, add_semicolon=False):
     ean = barcode.get(
         'code128',
@@ -113,6 +149,162 @@ def get_pool_label(text):
         return f.read()
 
 
+# engines used to create images of Code 128 barcodes: 'writer' uses
+# python-barcode's ImageWriter; 'numpy' rasterizes the bars only and
+# adds the human-readable text to the pdf (see code128_image())
+CODE128_ENGINES = ['writer', 'numpy']
+
+
+def get_code128_bars(text, add_semicolon=False):
+    """Like get_code128(), but rasterized using numpy and without the
+    human-readable text.
+
+    """
+
+    return code128.rasterize(';' + text if add_semicolon else text)
+
+
+def get_pool_label_bars(text):
+    """Like get_pool_label(), but rasterized using numpy and without
+    the human-readable text.
+
+    """
+
+    return code128.rasterize(text.replace('-', ''))
+
+
+def placeholder(x, y, width, height, text=''):
+    """Return a Group with an outlined box labeled with `text`, drawn
+    in place of a barcode image in draft mode.
+
+    """
+
+    return Group(
+        Rect(x, y, width, height, fillColor=None, strokeWidth=0.5),
+        String(x + width / 2, y + height / 2 - 2, text,
+               fontName="Helvetica", fontSize=6, textAnchor="middle"))
+
+
+def image_or_placeholder(x, y, width, height, img, text=''):
+    """Return an Image for the file `img`, or a placeholder labeled with
+    `text` if `img` is None.
+
+    """
+
+    if img is None:
+        return placeholder(x, y, width, height, text)
+    return Image(x, y, width, height, img)
+
+
+@lru_cache(maxsize=1024)
+def image_aspect(img):
+    """Return the ratio of width to height of the image file `img`."""
+
+    with PILImage.open(img) as im:
+        return im.width / im.height
+
+
+def code128_image(x, y, width, height, img, text, engine='writer'):
+    """Return a Code 128 barcode image or placeholder as for
+    image_or_placeholder(). Images created using the 'numpy' engine
+    have no human-readable text, so `text` is added as a String in
+    the position it would occupy in the image.
+
+    """
+
+    image = image_or_placeholder(x, y, width, height, img, text)
+    if engine != 'numpy' or img is None:
+        return image
+
+    text_x, text_y, font_size, hscale = code128.text_position(
+        x, y, width, height, image_aspect(img))
+    label = Group(String(0, 0, text, fontName=code128.FONT_NAME,
+                         fontSize=font_size, textAnchor="middle"),
+                  transform=(hscale, 0, 0, 1, text_x, text_y))
+    return Group(image, label)
+
+
+def default_cache_dir():
+    """Return the directory used for persistent caches."""
+
+    base = os.environ.get('XDG_CACHE_HOME') or path.expanduser('~/.cache')
+    return path.join(base, 'barcoder')
+
+
+class ImageCache:
+    """Writes images returned by functions such as get_qr() and
+    get_code128() to files in `dirname`. Files are named using a hash
+    of the function name, its arguments, and the package version, so
+    that images written by a previous call (or process) are reused.
+    Other output (eg, pdf files) can be cached by providing a
+    different file name `suffix`.
+
+    """
+
+    def __init__(self, dirname, suffix='.png'):
+        self.dirname = dirname
+        self.suffix = suffix
+        os.makedirs(dirname, exist_ok=True)
+
+    def _name(self, func, args, kwargs):
+        key = repr((__version__, func.__name__, args, sorted(kwargs.items())))
+        return path.join(self.dirname,
+                         hashlib.sha1(key.encode('utf-8')).hexdigest() + self.suffix)
+
+    def _write(self, pth, data):
+        # write to a temporary name so that concurrent processes (or
+        # threads) never see a partial file
+        tmp = f'{pth}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, pth)
+
+    def path(self, func, *args, **kwargs):
+        """Return the path to a file containing `func(*args, **kwargs)`,
+        creating the file if necessary.
+
+        """
+
+        pth = self._name(func, args, kwargs)
+        if not path.exists(pth):
+            self._write(pth, func(*args, **kwargs))
+        return pth
+
+    def paths(self, func, items, **kwargs):
+        """Return a list of paths as for path() for each of `items`, where
+        `func(items, **kwargs)` returns a list of images (eg,
+        get_qrs()). `func` is called once for all items without an
+        existing file.
+
+        """
+
+        pths = [self._name(func, (item,), kwargs) for item in items]
+        missing = [(item, pth) for item, pth in zip(items, pths) if not path.exists(pth)]
+        if missing:
+            for (item, pth), data in zip(missing, func([item for item, _ in missing], **kwargs)):
+                self._write(pth, data)
+        return pths
+
+
+def parse_ranges(text):
+    """Return a sorted list of integers from a string such as
+    '1-3,17' (-> [1, 2, 3, 17]).
+
+    """
+
+    numbers = set()
+    for part in text.split(','):
+        start, sep, end = part.strip().partition('-')
+        try:
+            if sep:
+                numbers.update(range(int(start), int(end) + 1))
+            else:
+                numbers.add(int(start))
+        except ValueError:
+            raise ValueError(f'invalid range: "{part}"')
+    return sorted(numbers)
+
+
 def hline(p, y, pagesize=letter):
     """
     Draw a horizontal line at y given p = canvas.beginPath()
@@ -151,3 +343,23 @@ def draw_grid(canvas, layout, include_vline=False):
     p.close()
     canvas.drawPath(p)
 
+
+def draw_page_number(canvas, page_number):
+    """
+    Add the page number and package version to the bottom left of the page
+    """
+
+    canvas.drawString(10, 20, str(page_number))
+    canvas.drawString(30, 20, f'barcoder version {__version__}')
+
+
+def draw_label_bounds(canvas, layout):
+    """
+    Outline the boundary of each label defined by `layout`
+    """
+
+    for j in range(layout.num_y):
+        y = layout.margin_bottom + j * (layout.label_height + layout.vspace)
+        for i in range(layout.num_x):
+            x = layout.margin_left + i * (layout.label_width + layout.hspace)
+            canvas.rect(x, y, layout.label_width, layout.label_height, stroke=1, fill=0)
@@ -55,6 +55,11 @@ params = {'author': 'Noah Hoffman',
               'qrcode==6.1',
               'reportlab==3.6.1',
               'Pillow',
-          ]}
+              'numpy',
+          ],
+          'extras_require': {
+              'optimize': ['pikepdf'],
+              's3': ['boto3'],
+          }}
 
 setup(**params)
@@ -0,0 +1,40 @@
+import io
+import unittest
+
+from barcoder.api import Renderer, page_codes
+
+
+class TestPageCodes(unittest.TestCase):
+
+    def test_partial_page(self):
+        self.assertEqual(list(page_codes(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_npages(self):
+        self.assertEqual(list(page_codes(range(7), 3, npages=2)), [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(list(page_codes(range(2), 3, npages=2)), [[0, 1]])
+
+
+class TestRenderer(unittest.TestCase):
+
+    def render(self, label_type, codes, npages=None):
+        renderer = Renderer(label_type, draft=True)
+        buf = io.BytesIO()
+        used = renderer.render(buf, npages=npages, codes=codes)
+        self.assertTrue(buf.getvalue().startswith(b'%PDF'))
+        return used
+
+    def test_codes_run_out(self):
+        for label_type, ncodes in [('threecol', 7), ('twocol', 5), ('pool', 5)]:
+            codes = [f'3ABCDEFGHJ{i:02d}' for i in range(ncodes)]
+            with self.subTest(label_type=label_type):
+                self.assertEqual(self.render(label_type, codes, npages=3), codes)
+
+    def test_all_codes_by_default(self):
+        for label_type, ncodes in [('threecol', 25), ('twocol', 20), ('pool', 100)]:
+            codes = [f'3ABCDEFGHJ{i:03d}' for i in range(ncodes)]
+            with self.subTest(label_type=label_type):
+                self.assertEqual(self.render(label_type, codes), codes)
+
+    def test_twocol_layout(self):
+        with self.assertRaises(ValueError):
+            Renderer('twocol', layout=object())
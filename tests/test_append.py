@@ -0,0 +1,108 @@
+import io
+import os
+import re
+import tempfile
+import unittest
+
+from reportlab.pdfgen.canvas import Canvas
+
+from barcoder.append import append_pages, page_count, read_xref
+from barcoder.commands import run
+from barcoder.output import optimize_pdf
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+
+def document(npages, label):
+    buf = io.BytesIO()
+    canvas = Canvas(buf)
+    for i in range(npages):
+        canvas.drawString(72, 72, f'{label} {i + 1}')
+        canvas.showPage()
+    canvas.save()
+    return buf.getvalue()
+
+
+class TestAppend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'labels.pdf')
+        with open(self.path, 'wb') as f:
+            f.write(document(2, 'old'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def check_xref(self, data):
+        # every object in the cross-reference table is found at its offset
+        offsets, trailer, _ = read_xref(data)
+        for number, offset in offsets.items():
+            self.assertTrue(data.startswith(b'%d 0 obj' % number, offset), number)
+        size = int(re.search(rb'/Size\s+(\d+)', trailer).group(1))
+        self.assertEqual(size, max(offsets) + 1)
+
+    def check_pdf(self, npages):
+        self.assertEqual(page_count(self.path), npages)
+        self.check_xref(self.read())
+        if pikepdf:
+            with pikepdf.open(self.path) as pdf:
+                self.assertEqual(len(pdf.pages), npages)
+                # check() is check_pdf_syntax() in newer versions of pikepdf
+                check = getattr(pdf, 'check_pdf_syntax', None) or pdf.check
+                self.assertEqual(check(), [])
+
+    def test_reportlab(self):
+        original = self.read()
+        self.check_pdf(2)
+
+        append_pages(self.path, document(3, 'new'))
+        self.check_pdf(5)
+        append_pages(self.path, document(1, 'newer'))
+        self.check_pdf(6)
+
+        # existing content is not rewritten
+        self.assertTrue(self.read().startswith(original))
+
+    @unittest.skipIf(pikepdf is None, 'pikepdf is not installed')
+    def test_page_order(self):
+        append_pages(self.path, document(2, 'new'))
+        with pikepdf.open(self.path) as pdf:
+            text = [page.Contents.read_bytes() for page in pdf.pages]
+        for content, label in zip(text, [b'old 1', b'old 2', b'new 1', b'new 2']):
+            self.assertIn(label, content)
+
+    @unittest.skipIf(pikepdf is None, 'pikepdf is not installed')
+    def test_linearized(self):
+        optimize_pdf(self.path, object_streams=False, linearize=True)
+        self.check_pdf(2)
+        append_pages(self.path, document(3, 'new'))
+        self.check_pdf(5)
+
+    @unittest.skipIf(pikepdf is None, 'pikepdf is not installed')
+    def test_object_streams(self):
+        optimize_pdf(self.path, object_streams=True)
+        original = self.read()
+        with self.assertRaises(ValueError):
+            page_count(self.path)
+        with self.assertRaises(ValueError):
+            append_pages(self.path, document(1, 'new'))
+        self.assertEqual(self.read(), original)
+
+    @unittest.skipIf(pikepdf is None, 'pikepdf is not installed')
+    def test_pool_command(self):
+        # the timestamp and file number are read from the file name
+        outfile = os.path.join(self.tmpdir.name, 'pool-labels-0123-001-n2.pdf')
+        for argv in [['--nfiles', '1', '--npages', '2', '--linearize',
+                      '--dirname', self.tmpdir.name],
+                     ['--npages', '3', '--append', outfile]]:
+            run.run_task('pool', argv + ['--timestamp', '0123', '--draft'])
+        self.path = outfile
+        self.check_pdf(5)
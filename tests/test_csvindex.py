@@ -0,0 +1,114 @@
+import csv
+import os
+import tempfile
+import unittest
+
+from barcoder import layouts
+from barcoder.commands import run, sheet
+from barcoder.csvindex import ENCODING, IndexedCSV, index_path
+
+ROWS = [
+    ['barcode', 'label1', 'label2'],
+    ['D-0001', 'plate 1', 'café'],
+    ['D-0002', 'two\nlines', '"quoted"'],
+    ['   ', '', ''],
+    ['D-0003', 'a,b', 'üñîçødé'],
+]
+
+
+def read_all(path):
+    with open(path, newline='', encoding=ENCODING) as f:
+        return list(csv.DictReader(f))
+
+
+class TestIndexedCSV(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, text, name='codes.csv'):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w', newline='', encoding=ENCODING) as f:
+            f.write(text)
+        return path
+
+    def check(self, path):
+        expected = read_all(path)
+        rows = IndexedCSV(path)
+        self.assertTrue(index_path(path).exists())
+        self.assertEqual(len(rows), len(expected))
+        self.assertEqual(list(rows), expected)
+        self.assertEqual(rows[:], expected)
+        for i in range(len(expected)):
+            self.assertEqual(rows[i], expected[i])
+            self.assertEqual(rows[i:], expected[i:])
+
+    def test_line_endings(self):
+        for terminator in ['\n', '\r\n', '\r']:
+            with self.subTest(terminator=repr(terminator)):
+                with open(os.path.join(self.tmpdir.name, 'codes.csv'), 'w', newline='',
+                          encoding=ENCODING) as f:
+                    csv.writer(f, lineterminator=terminator).writerows(ROWS)
+                self.check(f.name)
+
+    def test_blank_and_whitespace_lines(self):
+        path = self.write('barcode,label1\n\nD-1,a\n  \n\r\n\t\nD-2,"b\n\nc"\n\n')
+        self.check(path)
+        self.assertEqual([row['barcode'] for row in IndexedCSV(path)],
+                         ['D-1', '  ', '\t', 'D-2'])
+
+    def test_no_final_newline(self):
+        self.check(self.write('barcode\nD-1\nD-2'))
+
+    def test_rebuilt(self):
+        path = self.write('barcode\nD-1\n')
+        self.assertEqual(len(IndexedCSV(path)), 1)
+        with open(path, 'a', encoding=ENCODING) as f:
+            f.write('D-2\nD-3\n')
+        os.utime(path, ns=(0, 0))
+        self.check(path)
+
+
+class TestSheetPages(unittest.TestCase):
+
+    def test_same_as_full_read(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            path = os.path.join(dirname, 'plates.csv')
+            with open(path, 'w', newline='', encoding=ENCODING) as f:
+                writer = csv.writer(f)
+                writer.writerow(['barcode', 'label1', 'label2'])
+                for i in range(1, 51):
+                    # whitespace-only rows are read by csv.DictReader
+                    writer.writerow(['   '] if i == 7 else
+                                    [f'D-{i:04d}', f'plate\n{i}', 'café'])
+
+            outfile = os.path.join(dirname, 'plates-2-3.pdf')
+            run.run_task('sheet', ['-i', path, '-o', outfile, '--pages', '2-3',
+                                   '--invariant', '--code128-engine', 'numpy'])
+            self.assertTrue(os.path.exists(f'{path}.idx'))
+
+            expected = sheet.get_pdf(read_all(path), layout=layouts.onecol, pages=[2, 3],
+                                     engine='numpy', invariant=True)
+            with open(outfile, 'rb') as f:
+                self.assertEqual(f.read(), expected)
+
+    def test_invalid_copies(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            path = os.path.join(dirname, 'plates.csv')
+            with open(path, 'w', newline='', encoding=ENCODING) as f:
+                writer = csv.writer(f)
+                writer.writerow(['barcode', 'label1', 'copies'])
+                writer.writerow(['D-0001', 'plate 1', '2'])
+                writer.writerow(['D-0002', 'plate 2', 'two'])
+
+            outfile = os.path.join(dirname, 'plates.pdf')
+            for pages in [[], ['--pages', '1']]:
+                with self.subTest(pages=pages):
+                    with self.assertRaises(SystemExit) as cm:
+                        run.run_task('sheet', ['-i', path, '-o', outfile] + pages)
+                    self.assertEqual(str(cm.exception.code),
+                                     'invalid number of copies for D-0002: two')
+                    self.assertFalse(os.path.exists(outfile))
@@ -0,0 +1,89 @@
+import builtins
+import unittest
+from unittest import mock
+
+from barcoder import dedupe
+from barcoder.utils import get_code
+
+
+class TestPack(unittest.TestCase):
+
+    def test_round_trip(self):
+        for length in [3, 4, 8, 12, 16, 20]:
+            for _ in range(50):
+                code = get_code(length)
+                with self.subTest(code=code):
+                    value = dedupe.pack(code)
+                    self.assertLess(value.bit_length(), 8 * dedupe.record_width(length) + 1)
+                    self.assertEqual(dedupe.unpack(value, length), code)
+
+    def test_record_width(self):
+        self.assertEqual(dedupe.record_width(12), 7)
+        self.assertEqual(dedupe.record_width(16), 10)
+
+    def test_sort_order(self):
+        # sorting packed records sorts the packed values
+        width = dedupe.record_width(12)
+        values = dedupe.random_values(12, 100)
+        records = sorted(value.to_bytes(width, 'big') for value in values)
+        self.assertEqual([int.from_bytes(r, 'big') for r in records], sorted(values))
+
+
+class TestGenerateUniqueCodes(unittest.TestCase):
+
+    def test_unique_across_runs(self):
+        # 1000 of 248 * 31 possible four-character codes in runs of 50
+        # are almost certain to include duplicates that must be replaced
+        codes = list(dedupe.generate_unique_codes(4, 1000, run_size=50))
+        self.assertEqual(len(codes), 1000)
+        self.assertEqual(len(set(codes)), 1000)
+        for code in codes:
+            self.assertEqual(dedupe.unpack(dedupe.pack(code), 4), code)
+
+    def test_stop_if_seen(self):
+        with self.assertRaises(ValueError):
+            list(dedupe.generate_unique_codes(3, 200, run_size=50, stop_if_seen=True))
+
+    def test_random_order(self):
+        codes = list(dedupe.generate_unique_codes(12, 1000, run_size=200))
+        self.assertEqual(len(set(codes)), 1000)
+        self.assertNotEqual(codes, sorted(codes, key=dedupe.pack))
+
+    def test_none(self):
+        self.assertEqual(list(dedupe.generate_unique_codes(12, 0)), [])
+
+    def test_open_files(self):
+        # 40 runs are merged in several passes, and codes are shuffled
+        # in two rounds of distribution among files
+        opened = []
+        peak = []
+
+        class File:
+            def __init__(self, *args, **kwargs):
+                self.f = builtins.open(*args, **kwargs)
+                opened.append(self)
+                peak.append(len(opened))
+
+            def __getattr__(self, name):
+                return getattr(self.f, name)
+
+            def close(self):
+                if self in opened:
+                    opened.remove(self)
+                self.f.close()
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                self.close()
+
+        with mock.patch.object(dedupe, 'MAX_OPEN_FILES', 4), \
+             mock.patch.object(dedupe, 'open', File, create=True):
+            codes = list(dedupe.generate_unique_codes(6, 2000, run_size=50))
+
+        self.assertEqual(len(set(codes)), 2000)
+        self.assertNotEqual(codes, sorted(codes, key=dedupe.pack))
+        # each merge or distribution reads or writes one more file
+        self.assertLessEqual(max(peak), 5)
+        self.assertEqual(opened, [])
@@ -0,0 +1,75 @@
+import io
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image as PILImage
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen.canvas import Canvas
+
+from barcoder import labels
+from barcoder.labels import Text
+
+
+class TestInlineImage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.images = []
+        for i in range(4):
+            pth = os.path.join(self.tmpdir.name, f'{i}.png')
+            PILImage.new('L', (20, 20), color=i * 60).save(pth)
+            self.images.append(pth)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_size_limit(self):
+        size = len(labels.inline_image(self.images[0]))
+        with mock.patch.object(labels, 'INLINE_CACHE_BYTES', 2 * size), \
+                mock.patch.object(labels, '_inline_cache', labels.OrderedDict()), \
+                mock.patch.object(labels, '_inline_bytes', 0):
+            codes = [labels.inline_image(img) for img in self.images]
+            self.assertEqual(list(labels._inline_cache), self.images[-2:])
+            self.assertEqual(labels._inline_bytes, sum(map(len, codes[-2:])))
+            self.assertLessEqual(labels._inline_bytes, 2 * size)
+            self.assertEqual(labels.inline_image(self.images[0]), codes[0])
+
+
+class TestLabelForm(unittest.TestCase):
+
+    def test_page_unchanged(self):
+        canvas = Canvas(io.BytesIO())
+        canvas.setFont('Helvetica-Bold', 14)
+        canvas.drawString(10, 10, 'page')
+        content = canvas.getCurrentPageContent()
+
+        name = labels.form_name('code')
+        labels.label_form(canvas, name, [Text(0, 0, 'label', 'Courier', 6)], letter)
+        self.assertTrue(labels.has_form(canvas, name))
+        self.assertEqual(canvas.getCurrentPageContent(), content)
+        self.assertEqual((canvas._fontname, canvas._fontsize), ('Helvetica-Bold', 14))
+
+        labels.draw_form(canvas, name, 72, 72)
+        self.assertIn(f'/{canvas._doc.getXObjectName(name)} Do',
+                      canvas.getCurrentPageContent())
+        canvas.save()
+
+
+class TestDrawLabel(unittest.TestCase):
+
+    def test_fonts(self):
+        canvas = Canvas(io.BytesIO())
+        canvas.setFont('Courier', 6)
+        labels.draw_label(canvas, [
+            # the font is set again inside the label's graphics state
+            Text(0, 0, 'a', 'Courier', 6),
+            Text(0, 10, 'b', 'Courier', 6),
+            Text(0, 20, 'c', 'Helvetica', 8),
+            Text(0, 30, 'd', 'Helvetica', 8),
+            Text(0, 40, 'e', 'Courier', 6),
+        ])
+        content = canvas.getCurrentPageContent()
+        self.assertEqual(re.findall(r' (\S+) Tf', content), ['6', '6', '8', '6'])
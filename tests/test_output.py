@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+
+from barcoder.commands import run
+
+
+class TestMaxBytes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def check(self, command, argv, max_bytes):
+        files, _ = run.run_task(command, argv + [
+            '-d', self.tmpdir.name, '--max-bytes-per-file', str(max_bytes)])
+        sizes = [os.path.getsize(f) for f in files]
+        self.assertGreater(len(sizes), 2)
+        for size in sizes:
+            self.assertLessEqual(size, max_bytes)
+        # files other than the last are not much smaller than the limit
+        for size in sizes[:-1]:
+            self.assertGreater(size, max_bytes / 2)
+
+    def test_pool(self):
+        self.check('pool', ['--nfiles', '1', '--npages', '8'], 600000)
+
+    def test_pool_copies(self):
+        # labels are drawn in forms outside the page content
+        self.check('pool', ['--nfiles', '1', '--npages', '8', '--copies', '4'], 150000)
+
+    def test_pool_raster(self):
+        # page images are outside the page content
+        self.check('pool', ['--nfiles', '1', '--npages', '6', '--raster-dpi', '300',
+                            '--code128-engine', 'numpy'], 25000)
+
+    def test_threecol(self):
+        self.check('threecol', ['--npages', '8'], 300000)
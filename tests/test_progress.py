@@ -0,0 +1,50 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from barcoder.commands import pool, run
+from barcoder.progress import Progress
+
+
+def running(path):
+    with open(path) as f:
+        for line in f:
+            if line.startswith('barcoder_running{'):
+                return int(line.split()[-1])
+
+
+class TestProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.metrics = os.path.join(self.tmpdir.name, 'barcoder.prom')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_counts(self):
+        stream = io.StringIO()
+        with Progress('pool', total_pages=4, show=True, metrics_file=self.metrics,
+                      stream=stream) as progress:
+            progress.file('a.pdf')
+            self.assertEqual(running(self.metrics), 1)
+            progress.page(80)
+            progress.page(40)
+
+        self.assertEqual(running(self.metrics), 0)
+        self.assertEqual((progress.files, progress.pages, progress.labels), (1, 2, 120))
+        self.assertTrue(stream.getvalue().startswith('pool: page 2/4  120 labels'))
+        with open(self.metrics) as f:
+            text = f.read()
+        self.assertIn('barcoder_labels_total{command="pool"} 120\n', text)
+        self.assertIn('barcoder_file_info{command="pool",path="a.pdf"} 1\n', text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+    def test_closed_if_rendering_fails(self):
+        with mock.patch.object(pool, 'fill_sheet', side_effect=RuntimeError('failed')):
+            with self.assertRaises(RuntimeError):
+                run.run_task('pool', ['-d', self.tmpdir.name, '--npages', '1',
+                                      '--fake-code', 'X' * 16, '--metrics', self.metrics])
+        self.assertEqual(running(self.metrics), 0)
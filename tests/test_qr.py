@@ -0,0 +1,71 @@
+import io
+import random
+import string
+import unittest
+
+import numpy as np
+import qrcode
+from PIL import Image
+from qrcode import constants
+
+from barcoder.qr import get_encoder, is_single_segment
+from barcoder.utils import get_qrs
+
+LEVELS = [constants.ERROR_CORRECT_L, constants.ERROR_CORRECT_M,
+          constants.ERROR_CORRECT_Q, constants.ERROR_CORRECT_H]
+
+# 150 bytes needs version 7 (with version information) or higher at
+# every level
+LENGTHS = [17, 42, 100, 150]
+
+
+def qrcode_matrix(text, error_correction):
+    qr = qrcode.QRCode(error_correction=error_correction)
+    qr.add_data(text)
+    qr.make(fit=True)
+    return qr.version, np.array(qr.get_matrix())
+
+
+def image_matrix(png, box_size=10):
+    pixels = np.array(Image.open(io.BytesIO(png)).convert('L')) < 128
+    return pixels[::box_size, ::box_size]
+
+
+class TestFixedLengthQR(unittest.TestCase):
+
+    def texts(self, length, number=4):
+        rand = random.Random(length)
+        chars = string.ascii_lowercase + string.digits + '/.:-'
+        texts = ['https://' + ''.join(rand.choice(chars) for _ in range(length - 8))
+                 for _ in range(number)]
+        for text in texts:
+            self.assertTrue(is_single_segment(text))
+        return texts
+
+    def test_same_as_qrcode(self):
+        versions = set()
+        for error_correction in LEVELS:
+            for length in LENGTHS:
+                texts = self.texts(length)
+                version = get_encoder(length, error_correction).version
+                versions.add(version)
+                for text, png in zip(texts, get_qrs(texts, error_correction=error_correction)):
+                    with self.subTest(error_correction=error_correction, text=text):
+                        expected_version, expected = qrcode_matrix(text, error_correction)
+                        self.assertEqual(version, expected_version)
+                        np.testing.assert_array_equal(image_matrix(png), expected)
+        self.assertGreaterEqual(max(versions), 7)
+
+    def test_masks(self):
+        # payloads of one length are encoded together, and may need
+        # different mask patterns
+        texts = self.texts(30, number=24)
+        masks = set()
+        for text, matrix in zip(texts, get_encoder(30).matrices(texts)):
+            qr = qrcode.QRCode()
+            qr.add_data(text)
+            qr.make(fit=True)
+            np.testing.assert_array_equal(np.pad(matrix, 4), np.array(qr.get_matrix()))
+            # best_mask_pattern() redraws the matrix with each mask
+            masks.add(qr.best_mask_pattern())
+        self.assertGreater(len(masks), 1)
@@ -0,0 +1,57 @@
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from barcoder.append import page_count
+from barcoder.commands import reprint, run
+
+
+class TestReprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dirname = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def reprint(self, pages, name='pool-labels-0123-004-n25.pdf'):
+        return run.run_task('reprint', [
+            '--pool', name, '--pages', pages, '--dirname', self.dirname,
+            '--cache-dir', self.dirname, '--code128-engine', 'numpy'])[0]
+
+    def test_concurrent(self):
+        # run a second reprint into the same directory after the first
+        # is saved, but before it is renamed
+        outfiles = []
+        test = self
+
+        class Canvas(reprint.Canvas):
+            def save(self):
+                super().save()
+                if not outfiles:
+                    outfiles.append(None)
+                    outfiles[:] = test.reprint('1-3')
+
+        with mock.patch.object(reprint, 'Canvas', Canvas):
+            outfiles.extend(self.reprint('5'))
+
+        self.assertEqual([os.path.basename(f) for f in outfiles], [
+            'pool-labels-0123-004-n25-reprint-1-3.pdf',
+            'pool-labels-0123-004-n25-reprint-5.pdf'])
+        self.assertEqual([page_count(f) for f in outfiles], [3, 1])
+        self.assertEqual(sorted(os.listdir(self.dirname)),
+                         sorted(os.path.basename(f) for f in outfiles + ['images']))
+
+    def test_permissions(self):
+        outfile, = self.reprint('1')
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(outfile).st_mode), 0o666 & ~umask)
+
+    def test_error(self):
+        with self.assertRaises(SystemExit):
+            self.reprint('1', name='labels.pdf')
+        self.assertEqual(os.listdir(self.dirname), ['images'])
@@ -0,0 +1,44 @@
+import csv
+import tempfile
+import unittest
+from pathlib import Path
+
+from barcoder.commands import run
+
+
+class TestSplitJob(unittest.TestCase):
+
+    def test_threecol_fake_code(self):
+        tasks = run.split_job('threecol', ['--nfiles', '3', '--fake-code', '3ABCDEFGHJK7'])
+        self.assertEqual(len(tasks), 3)
+        self.assertEqual(tasks[1][0][-4:], ['--first-file', '2', '--nfiles', '1'])
+
+    def test_pool(self):
+        self.assertEqual(len(run.split_job('pool', ['--nfiles', '4'])), 4)
+
+    def test_append(self):
+        # all pages are added to one file, whatever --nfiles is
+        for command in ['pool', 'threecol']:
+            argv = ['--fake-code', '3ABCDEFGHJK7', '--append', 'labels.pdf']
+            tasks = run.split_job(command, argv + ['--nfiles', '4'])
+            self.assertEqual([task for task, _ in tasks], [argv + ['--nfiles', '4']])
+
+    def test_threecol_unique_across_files(self):
+        # 120 three-character codes out of 248 would almost certainly
+        # include duplicates if each file were generated separately
+        with tempfile.TemporaryDirectory() as dirname:
+            argv = ['--dirname', dirname, '--nfiles', '4', '--npages', '3',
+                    '--code-length', '3', '--code128-engine', 'numpy']
+            tasks = run.split_job('threecol', argv)
+            self.assertEqual(len(tasks), 1)
+
+            for task, _ in tasks:
+                files, _ = run.run_task('threecol', task)
+            self.assertEqual(len(files), 4)
+
+            codes = []
+            for logfile in sorted(Path(dirname).glob('*.csv')):
+                with open(logfile) as f:
+                    codes.extend(row[-1] for row in csv.reader(f))
+            self.assertEqual(len(codes), 120)
+            self.assertEqual(len(set(codes)), len(codes))
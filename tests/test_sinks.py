@@ -0,0 +1,109 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from barcoder.commands import pool, run
+from barcoder.sinks import LocalSink, S3Sink, get_sink, boto3
+
+
+class FakeClient:
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.uploaded = []
+        self.lock = threading.Lock()
+
+    def upload_file(self, filename, bucket, key, Config=None):
+        time.sleep(0.05)
+        if os.path.basename(filename) in self.fail:
+            raise OSError(f'could not upload {filename}')
+        with self.lock:
+            self.uploaded.append((bucket, key))
+
+
+@unittest.skipIf(boto3 is None, 'boto3 is not installed')
+class TestS3Sink(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for name in ['a.pdf', 'a.csv', 'b.pdf']:
+            path = os.path.join(self.tmpdir.name, name)
+            with open(path, 'w') as f:
+                f.write(name)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_close_waits_for_uploads(self):
+        client = FakeClient()
+        with S3Sink('s3://bucket/some/prefix/', client=client, workers=2) as sink:
+            for path in self.paths:
+                sink.put(path)
+        self.assertEqual(sorted(client.uploaded), [
+            ('bucket', 'some/prefix/a.csv'),
+            ('bucket', 'some/prefix/a.pdf'),
+            ('bucket', 'some/prefix/b.pdf'),
+        ])
+
+    def test_close_raises_upload_error(self):
+        client = FakeClient(fail=['a.csv'])
+        sink = S3Sink('s3://bucket', client=client)
+        for path in self.paths:
+            sink.put(path)
+        with self.assertLogs('barcoder.sinks', 'ERROR'), self.assertRaises(OSError):
+            sink.close()
+        self.assertEqual(sorted(client.uploaded), [('bucket', 'a.pdf'), ('bucket', 'b.pdf')])
+
+    def test_upload_option(self):
+        client = FakeClient()
+        with mock.patch.object(boto3, 'client', return_value=client):
+            files, _ = run.run_task('twocol', [
+                '-d', self.tmpdir.name, '--nfiles', '2', '--fake-code', 'X' * 16,
+                '--upload', 's3://bucket/twocol'])
+        self.assertEqual(len(files), 2)
+        self.assertEqual(sorted(client.uploaded),
+                         [('bucket', 'twocol/' + os.path.basename(f)) for f in files])
+
+    def test_uploads_finish_if_rendering_fails(self):
+        client = FakeClient()
+        sinks = []
+
+        def get_s3_sink(url, **kwargs):
+            sinks.append(S3Sink(url, client=client))
+            return sinks[-1]
+
+        fill_sheet = pool.fill_sheet
+        pages = []
+
+        def fail_on_second_file(canvas, *args, **kwargs):
+            pages.append(kwargs['page_number'])
+            if len(pages) > 1:
+                raise RuntimeError('rendering failed')
+            fill_sheet(canvas, *args, **kwargs)
+
+        with mock.patch.object(pool, 'get_sink', get_s3_sink), \
+             mock.patch.object(pool, 'fill_sheet', fail_on_second_file):
+            with self.assertRaises(RuntimeError):
+                run.run_task('pool', ['-d', self.tmpdir.name, '--nfiles', '2', '--npages', '1',
+                                      '--timestamp', '0123', '--fake-code', 'X' * 16,
+                                      '--upload', 's3://bucket'])
+
+        # the first file was uploaded before the error was raised
+        self.assertEqual(client.uploaded, [('bucket', 'pool-labels-0123-001-n1.pdf')])
+        self.assertTrue(sinks[0].executor._shutdown)
+
+
+class TestGetSink(unittest.TestCase):
+
+    def test_local(self):
+        self.assertIsInstance(get_sink(), LocalSink)
+
+    def test_unsupported(self):
+        for url in ['memory:', 'ftp://host/path']:
+            with self.assertRaises(ValueError):
+                get_sink(url)
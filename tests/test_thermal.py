@@ -0,0 +1,124 @@
+import io
+import itertools
+import unittest
+
+from barcoder import layouts, thermal
+from barcoder.commands import pool, sheet, threecol
+
+
+class TestFields(unittest.TestCase):
+
+    def test_zpl_field(self):
+        self.assertEqual(thermal.zpl_field('ABC'), '^FDABC^FS')
+        self.assertEqual(thermal.zpl_field('A^B_C'), '^FH^FDA_5EB_5FC^FS')
+
+    def test_epl_string(self):
+        self.assertEqual(thermal.epl_string('a"b\\c'), '"a\\"b\\\\c"')
+
+    def test_language(self):
+        with self.assertRaises(ValueError):
+            thermal.Label(72, 72, language='pdf')
+
+
+class TestPool(unittest.TestCase):
+
+    def test_zpl(self):
+        label = pool.thermal_specimenlabel(layouts.pool, '0123-01-0001', 'zpl', 203)
+        self.assertEqual(str(label), (
+            '^XA^CI28^PW355^LL102\n'
+            '^FO43,29^BY3^BCN,42,N,N,N,A^FD0123010001^FS\n'
+            '^FT132,89^A0N,15,15^FD0123-01-0001^FS\n'
+            '^XZ\n'))
+
+    def test_epl(self):
+        label = pool.thermal_specimenlabel(layouts.pool, '0123-01-0001', 'epl', 203)
+        self.assertEqual(str(label), (
+            '\nN\nq355\nQ102,24\n'
+            'B43,29,0,1,3,6,42,N,"0123010001"\n'
+            'A132,76,0,2,1,1,N,"0123-01-0001"\n'
+            'P1\n'))
+
+
+class TestSheet(unittest.TestCase):
+
+    code = {'barcode': 'D-0000000001', 'label1': 'label1', 'label2': 'label2',
+            'label3': 'l3', 'label4': 'l4'}
+
+    def test_zpl(self):
+        label = sheet.thermal_specimenlabel(layouts.onecol, language='zpl', **self.code)
+        self.assertEqual(str(label), (
+            '^XA^CI28^PW533^LL162\n'
+            '^FT14,39^A0N,23,23^FDlabel1^FS\n'
+            '^FT14,70^A0N,23,23^FDlabel2^FS\n'
+            '^FT281,39^A0N,23,23^FDl3^FS\n'
+            '^FT281,70^A0N,23,23^FDl4^FS\n'
+            '^FO42,90^BY2^BCN,42,N,N,N,A^FDD0000000001^FS\n'
+            '^FT105,150^A0N,15,15^FDD-0000000001^FS\n'
+            '^XZ\n'))
+
+    def test_epl(self):
+        label = sheet.thermal_specimenlabel(layouts.onecol, language='epl', **self.code)
+        self.assertEqual(str(label), (
+            '\nN\nq533\nQ162,24\n'
+            'A14,20,0,1,2,2,N,"label1"\n'
+            'A14,51,0,1,2,2,N,"label2"\n'
+            'A281,20,0,1,2,2,N,"l3"\n'
+            'A281,51,0,1,2,2,N,"l4"\n'
+            'B42,90,0,1,2,4,42,N,"D0000000001"\n'
+            'A105,137,0,2,1,1,N,"D-0000000001"\n'
+            'P1\n'))
+
+    def test_copies(self):
+        codes = [dict(self.code, copies='2'), {'barcode': 'D-0000000002'}]
+        text = sheet.get_thermal(codes, layouts.onecol, language='zpl')
+        self.assertEqual(text.count('^XA'), 3)
+        self.assertEqual(text.count('^FDD0000000001^FS'), 2)
+
+
+class TestThreecol(unittest.TestCase):
+
+    code = '3ABCDEFGHJK7'
+
+    def test_specimenlabel(self):
+        zpl = threecol.thermal_specimenlabel(layouts.threecol, self.code, '(1-1)', 'zpl')
+        self.assertEqual(str(zpl), (
+            '^XA^CI28^PW533^LL203\n'
+            '^FT483,158^A0N,17,17^FD(1-1)^FS\n'
+            '^FT14,81^A0N,23,23^FDDOB (MM/DD/YYYY): ____________________^FS\n'
+            '^FT14,47^A0N,23,23^FDName: ________________________________^FS\n'
+            '^FO99,102^BY2^BCN,62,N,N,N,A^FD3ABCDEFGHJK7^FS\n'
+            '^FT173,193^A0N,22,22^FD3ABC-DEFG-HJK7^FS\n'
+            '^XZ\n'))
+
+        epl = threecol.thermal_specimenlabel(layouts.threecol, self.code, '(1-1)', 'epl')
+        self.assertEqual(str(epl), (
+            '\nN\nq533\nQ203,24\n'
+            'A483,145,0,2,1,1,N,"(1-1)"\n'
+            'A14,62,0,1,2,2,N,"DOB (MM/DD/YYYY): ____________________"\n'
+            'A14,28,0,1,2,2,N,"Name: ________________________________"\n'
+            'B99,102,0,1,2,4,62,N,"3ABCDEFGHJK7"\n'
+            'A173,174,0,1,2,2,N,"3ABC-DEFG-HJK7"\n'
+            'P1\n'))
+
+    def test_qrlabel(self):
+        url = 'https://securelink.labmed.uw.edu?code=3ABCDEFGHJK7'
+        zpl = str(threecol.thermal_qrlabel(layouts.threecol, self.code, '(1-1)', 'zpl'))
+        self.assertIn(f'^FO12,63^BQN,2,3^FDMA,{url}^FS\n', zpl)
+        epl = str(threecol.thermal_qrlabel(layouts.threecol, self.code, '(1-1)', 'epl'))
+        self.assertIn(f'b12,63,Q,m2,s3,eM,"{url}"\n', epl)
+
+    def test_lablabel(self):
+        zpl = str(threecol.thermal_lablabel(
+            layouts.threecol, self.code, '(1-1)', 'f.zpl', 'zpl'))
+        self.assertTrue(zpl.startswith('^XA^CI28^PW533^LL203\n^FT14,189^A0N,23,23^FDf.zpl^FS\n'))
+        self.assertIn('^FO20,37^BQN,2,5^FDMA,f.zpl^FS\n', zpl)
+        epl = str(threecol.thermal_lablabel(
+            layouts.threecol, self.code, '(1-1)', 'f.epl', 'epl'))
+        self.assertIn('b20,37,Q,m2,s5,eM,"f.epl"\n', epl)
+
+    def test_fill_roll(self):
+        f = io.StringIO()
+        codes = threecol.fill_roll(f, layouts.threecol, 0, itertools.repeat(self.code),
+                                   filename='f.zpl', language='zpl')
+        self.assertEqual(codes, [self.code] * layouts.threecol.num_y)
+        self.assertEqual(f.getvalue().count('^XA'), 3 * layouts.threecol.num_y)